@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+import re
+from PerEpochReader import readEpochRows
+
+COLUMN_PATTERN = re.compile(r"^(?P<node>.+)_(?P<node_index>\d{12})_(?P<kind>Input|Output|Expected)_Batch-(?P<batch>\d+)_Memory-(?P<memory>\d+)$")
+HEADER_INDEX_COLUMNS = ["position", "column", "node", "node_index", "kind", "batch", "memory"]
+
+def parseHeader(columns):
+    """Parse the column names of an EvoNet *PerEpoch.csv file into a structured index.
+    Columns that are not node values, such as the epoch, are left out.
+
+    Args:
+        columns: list of the column names in the order of the file
+
+    Returns:
+        pandas data frame with the HEADER_INDEX_COLUMNS of each node value column, where position is the position of the column in the file
+    """
+    rows = []
+    for position, column in enumerate(columns):
+        match = COLUMN_PATTERN.match(column)
+        if match is not None:
+            rows.append((position, column, match.group("node"), int(match.group("node_index")), match.group("kind"),
+                int(match.group("batch")), int(match.group("memory"))))
+    return pd.DataFrame(rows, columns=HEADER_INDEX_COLUMNS)
+
+def readHeaderIndex(filename):
+    """Read and parse the header of an EvoNet *PerEpoch.csv file without reading its data
+
+    Args:
+        filename: name of the csv file
+
+    Returns:
+        list of the column names, and the data frame from parseHeader
+    """
+    columns = pd.read_csv(filename, nrows=0).columns.tolist()
+    return columns, parseHeader(columns)
+
+def selectColumns(header_index, node, kind, node_indices=None, batches=None, memories=None):
+    """Select the columns of the values of a node and kind, optionally only of some node indices, batches and memory steps
+
+    Args:
+        header_index: the data frame from parseHeader
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        node_indices, batches, memories: lists of the values to keep, or None to keep all of them
+
+    Returns:
+        the rows of header_index that are selected
+    """
+    selected = (header_index["node"]==node) & (header_index["kind"]==kind)
+    for name, values in [("node_index", node_indices), ("batch", batches), ("memory", memories)]:
+        if values is not None:
+            selected &= header_index[name].isin(values)
+    return header_index[selected]
+
+def getNodeCount(header_index, node, kind):
+    """Get the number of node indices of a node and kind, as the largest node index + 1, or 0 when the node has no values"""
+    selected = selectColumns(header_index, node, kind)
+    return int(selected["node_index"].max()) + 1 if len(selected) else 0
+
+def placeColumns(data, selected, axes):
+    """Place the values of the selected columns at their node index, batch and memory step
+
+    Args:
+        data: data frame with the columns of selected
+        selected: the rows of the header index from selectColumns
+        axes: dict of 'node_index','batch','memory' to the values along each axis
+
+    Returns:
+        4-D float32 array of shape (rows, nodes, batches, memory) that is NaN where a column is missing
+    """
+    positions = [np.searchsorted(axes[name], selected[name].to_numpy()) for name in ["node_index", "batch", "memory"]]
+    tensor = np.full((len(data),) + tuple(len(values) for values in axes.values()), np.nan, dtype=np.float32)
+    tensor[:, positions[0], positions[1], positions[2]] = data.loc[:, selected["column"].tolist()].to_numpy()
+    return tensor
+
+def selectTensorColumns(filename, node, kind, index_name="Epoch", node_indices=None, batches=None, memories=None):
+    """Select the columns of the values of a node and kind of an EvoNet *PerEpoch.csv file from its header
+
+    Args:
+        filename: name of the csv file
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        index_name: name of the index header
+        node_indices, batches, memories: lists of the values to read, or None to read all of them
+
+    Returns:
+        the positions of the index and value columns to read, the rows of the header index that are selected,
+        and dict of 'node_index','batch','memory' to the values along each axis
+    """
+    columns, header_index = readHeaderIndex(filename)
+    selected = selectColumns(header_index, node, kind, node_indices, batches, memories)
+    if selected.empty:
+        raise ValueError("{} has no {} values of node {}.".format(filename, kind, node))
+    if index_name not in columns:
+        raise ValueError("{} has no column {}.".format(filename, index_name))
+    usecols = [columns.index(index_name)] + selected["position"].tolist()
+    axes = {name: np.unique(selected[name].to_numpy()) for name in ["node_index", "batch", "memory"]}
+    return usecols, selected, axes
+
+def readTensor(filename, node, kind, index_name="Epoch", node_indices=None, batches=None, memories=None, epochs=None):
+    """Read the values of a node and kind from an EvoNet *PerEpoch.csv file as an array with an axis
+    per epoch, node index, batch and memory step.  The header is parsed once and the columns are read
+    by position; the values are placed in the array with a single vectorized assignment.
+
+    Args:
+        filename: name of the csv file
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        index_name: name of the index header
+        node_indices, batches, memories: lists of the values to read, or None to read all of them
+        epochs: list of the epochs to read using the epoch index of the file, or None to read all of the rows
+
+    Returns:
+        1-D array of the epochs, 4-D float32 array of shape (epochs, nodes, batches, memory) that is NaN
+        where a column is missing, and dict of 'node_index','batch','memory' to the values along each axis
+    """
+    usecols, selected, axes = selectTensorColumns(filename, node, kind, index_name, node_indices, batches, memories)
+    if epochs is None:
+        data = pd.read_csv(filename, usecols=usecols, dtype=np.float32)
+    else:
+        data = readEpochRows(filename, epochs, usecols, index_name)
+    return data[index_name].to_numpy(), placeColumns(data, selected, axes), axes
+
+def readTensorChunks(filename, node, kind, index_name="Epoch", node_indices=None, batches=None, memories=None, chunksize=10000):
+    """Read the values of a node and kind from an EvoNet *PerEpoch.csv file as readTensor,
+    but a chunk of rows at a time so that files with many epochs do not need to fit in memory
+
+    Args:
+        filename: name of the csv file
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        index_name: name of the index header
+        node_indices, batches, memories: lists of the values to read, or None to read all of them
+        chunksize: the number of rows to read at a time
+
+    Returns:
+        dict of 'node_index','batch','memory' to the values along each axis, and a generator of
+        the epochs and the 4-D float32 array of each chunk
+    """
+    usecols, selected, axes = selectTensorColumns(filename, node, kind, index_name, node_indices, batches, memories)
+    chunks = ((data[index_name].to_numpy(), placeColumns(data, selected, axes))
+        for data in pd.read_csv(filename, usecols=usecols, dtype=np.float32, chunksize=chunksize))
+    return axes, chunks
+
+def addToTensorPlan(plan, filename, node, kind, epoch, node_indices=None, batches=None, memories=None):
+    """Record that the values of a node and kind of the rows of an epoch of a file will be needed
+
+    Args:
+        plan: dict of filename to the 'tensors' (dict of (node, kind) to the values needed along each axis)
+            and 'epochs' needed from the file
+        filename: name of the *PerEpoch.csv file
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        epoch: the index value of the rows needed
+        node_indices, batches, memories: lists of the values needed, or None to read all of them
+    """
+    # dicts are used as ordered sets, and None stands for all of the values in the file
+    entry = plan.setdefault(filename, {"tensors": {}, "epochs": {}})
+    axes = entry["tensors"].setdefault((node, kind), {"node_index": {}, "batch": {}, "memory": {}})
+    for name, values in [("node_index", node_indices), ("batch", batches), ("memory", memories)]:
+        if values is None:
+            axes[name] = None
+        elif axes[name] is not None:
+            axes[name].update(dict.fromkeys(int(value) for value in values))
+    entry["epochs"][epoch] = None
+
+def readTensorPlan(plan, index_name="Epoch"):
+    """Read each file of the plan once with the columns of all of the node values needed from it, reading only
+    the lines of the epochs needed with the epoch index of the file.  The header of each file is parsed once
+    and the columns are read by position.
+
+    Args:
+        plan: dict of filename to the 'tensors' and 'epochs' needed from the file, from addToTensorPlan
+        index_name: name of the index header
+
+    Returns:
+        dict of (filename, node, kind) to the 1-D array of the epochs of the rows, the 4-D float32 array of shape
+        (rows, nodes, batches, memory) that is NaN where a column is missing, and dict of 'node_index','batch','memory'
+        to the values along each axis
+    """
+    tensors = {}
+    for filename, entry in plan.items():
+        columns, header_index = readHeaderIndex(filename)
+        if index_name not in columns:
+            raise ValueError("{} has no column {}.".format(filename, index_name))
+        selections = {}
+        for (node, kind), planned in entry["tensors"].items():
+            selected = selectColumns(header_index, node, kind, *[None if planned[name] is None else list(planned[name])
+                for name in ["node_index", "batch", "memory"]])
+            if selected.empty:
+                raise ValueError("{} has no {} values of node {}.".format(filename, kind, node))
+            axes = {name: np.unique(selected[name].to_numpy()) if planned[name] is None else np.array(sorted(planned[name]), dtype=np.int64)
+                for name in ["node_index", "batch", "memory"]}
+            selections[(node, kind)] = (selected, axes)
+        positions = sorted(set(position for selected, axes in selections.values() for position in selected["position"]))
+        print("reading {} columns of {} epochs from {}...".format(len(positions), len(entry["epochs"]), filename))
+        data = readEpochRows(filename, list(entry["epochs"]), [columns.index(index_name)] + positions, index_name)
+        for (node, kind), (selected, axes) in selections.items():
+            tensors[(filename, node, kind)] = (data[index_name].to_numpy(), placeColumns(data, selected, axes), axes)
+    return tensors
+
+def getTensorSlice(tensors, filename, node, kind, epochs, node_indices=None, batches=None, memories=None):
+    """Get the values of the first row of each epoch of a node and kind from the tensors of readTensorPlan
+
+    Args:
+        tensors: dict from readTensorPlan
+        filename: name of the *PerEpoch.csv file
+        node: the node name, e.g. 'Output'
+        kind: 'Input', 'Output' or 'Expected'
+        epochs: list of the epochs
+        node_indices, batches, memories: lists of the values in the order to return them, or None for all of the values that were read
+
+    Returns:
+        4-D float32 array of shape (epochs, nodes, batches, memory), which is NaN for the epochs that are missing
+    """
+    file_epochs, tensor, axes = tensors[(filename, node, kind)]
+    positions = []
+    for name, values in [("node_index", node_indices), ("batch", batches), ("memory", memories)]:
+        if values is None:
+            positions.append(np.arange(len(axes[name])))
+            continue
+        values = np.asarray(values)
+        found = np.minimum(np.searchsorted(axes[name], values), len(axes[name]) - 1)
+        if not np.array_equal(axes[name][found], values):
+            raise ValueError("Some {} values of the {} values of node {} were not read from {}.".format(name, kind, node, filename))
+        positions.append(found)
+    epochs = np.asarray(epochs, dtype=file_epochs.dtype)
+    if not len(file_epochs):
+        return np.full((len(epochs),) + tuple(len(p) for p in positions), np.nan, dtype=np.float32)
+    unique_epochs, first_rows = np.unique(file_epochs, return_index=True)
+    found = np.minimum(np.searchsorted(unique_epochs, epochs), len(unique_epochs) - 1)
+    values = tensor[np.ix_(first_rows[found], *positions)]
+    values[unique_epochs[found] != epochs] = np.nan
+    return values
@@ -1,8 +1,12 @@
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
+import os, argparse, warnings
+import concurrent.futures
+from PerEpochReader import parseRange
+from EvoNetColumns import addToTensorPlan, readTensorPlan, getTensorSlice
 
-def plotFeature(n_row, feature_length, subplot_titles, input_data, output_data, expected_data, label, axs, color, marker, series):
+def plotFeature(n_row, feature_length, subplot_titles, input_values, output_values, expected_values, label, axs, color, marker, series):
     """Generate a side by side plot of the input node values, output node values, and expected output node values.
     Each figure is of a single train/text batch.
     Each panel is of a single node.
@@ -10,28 +14,30 @@ def plotFeature(n_row, feature_length, subplot_titles, input_data, output_data,
     Args:
         n_node
         subplot_titles
-        input_data
-        output_data
-        expected_data
+        input_values: the input values of each feature node
+        output_values: the output values of each output node, normalised by normalizeFeatures
+        expected_values: the expected values of each output node, normalised by normalizeFeatures
         nodes_to_labels
         axs
         color: the color to use for the plots
         maker: the marker to use for the plots
     """
-    x_data = np.arange(0, feature_length)
-    # Normalised [0,1] np.ptp(a[np.isfinite(a)])
-    #input_plot = (input_data.iloc[0][1:] - np.min(input_data.iloc[0][1:]))/np.ptp(input_data.iloc[0][1:])
-    input_plot = input_data.iloc[0][1:]
-    output_plot = (output_data.iloc[0][1:] - np.min(output_data.iloc[0][1:]))/np.ptp(output_data.iloc[0][1:])
-    expected_plot = (expected_data.iloc[0][1:] - np.min(expected_data.iloc[0][1:]))/np.ptp(expected_data.iloc[0][1:])
+    input_plot = input_values
+    output_plot = output_values
+    expected_plot = expected_values
+
+    # the number of output nodes can differ from the feature length
+    x_input = np.arange(len(input_plot))
+    x_output = np.arange(len(output_plot))
+    x_expected = np.arange(len(expected_plot))
 
     # Make the subplots
-    try:
-        axs[n_row, 0].scatter(x_data, input_plot,
+    if np.ndim(axs) == 2:
+        axs[n_row, 0].scatter(x_input, input_plot,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[n_row, 1].scatter(x_data, output_plot,
+        axs[n_row, 1].scatter(x_output, output_plot,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[n_row, 2].scatter(x_data, expected_plot,
+        axs[n_row, 2].scatter(x_expected, expected_plot,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
 
         # Make the titles 
@@ -42,12 +48,12 @@ def plotFeature(n_row, feature_length, subplot_titles, input_data, output_data,
         # make the legend
         axs[n_row,0].legend(loc="upper left", markerscale=2)
 
-    except:
-        axs[0].scatter(x_data, input_plot,
+    else:
+        axs[0].scatter(x_input, input_plot,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        #axs[1].scatter(x_data, output_plot,
+        #axs[1].scatter(x_output, output_plot,
         #            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        #axs[2].scatter(x_data, expected_plot,
+        #axs[2].scatter(x_expected, expected_plot,
         #            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
 
         # Make the titles 
@@ -58,37 +64,157 @@ def plotFeature(n_row, feature_length, subplot_titles, input_data, output_data,
         # make the legend
         axs[0].legend(loc="upper left", markerscale=2)
 
-def makeColumnHeaders(input, output, n_batch, feature_start, feature_length, index_name): 
-    """Make the expected headers for the input, output, and expected data files.
-    The sequence is generated downwards to match the memory steps.
+def planFeatureReads(filenames, nodes_to_labels, epochs=None, batches=None):
+    """Plan the node values and epochs needed from each file for each feature and filename row.
+    All of the output and expected nodes are read, as the number of output nodes can differ from the feature length.
 
     Args:
-        headers: list of train/test metric names
-        agg_func: name of an aggregation function
-        index_name: name of the index header
-        data: the actual data frame of values to aggregate according to the specified statistics
+        filenames: data frame of the input/output/expected filenames with 'n_epoch','n_batch' of each row
+        nodes_to_labels: data frame of the features
+        epochs: list of the epochs to read of each row, or None to read the 'n_epoch' of the row
+        batches: list of the batches to read of each row, or None to read the 'n_batch' of the row
+
+    Returns:
+        the read plan for readTensorPlan
+    """
+    read_plan = {}
+    for n_row in range(len(nodes_to_labels)):
+        feature = nodes_to_labels.iloc[n_row]
+        for index, row in filenames.iterrows():
+            row_batches = [row['n_batch']] if batches is None else batches
+            for n_epoch in ([row['n_epoch']] if epochs is None else epochs):
+                addToTensorPlan(read_plan, row['input_filenames'], feature.loc["input"], "Input", n_epoch, range(feature.loc["start"], feature.loc["span"]), row_batches, [0])
+                addToTensorPlan(read_plan, row['output_filenames'], feature.loc["output"], "Output", n_epoch, None, row_batches, [0])
+                addToTensorPlan(read_plan, row['expected_filenames'], feature.loc["output"], "Expected", n_epoch, None, row_batches, [0])
+    return read_plan
+
+def getFeatureSlices(tensors, row, feature, epochs, batches):
+    """Get the input, output and expected values of a feature and filename row from the tensors of readTensorPlan
+
+    Args:
+        tensors: dict from readTensorPlan
+        row: the filename row
+        feature: the feature row
+        epochs: list of the epochs
+        batches: list of the batches
 
     Returns:
-        pandas data frame
-    """   
-    input_headers = ["{}_{:012d}_Input_Batch-{}_Memory-0".format(input, j, n_batch) for j in range(feature_start, feature_length)]
-    #output_headers = ["{}_{:012d}_Output_Batch-{}_Memory-0".format(output, j, n_batch) for j in range(feature_start, feature_length)]
-    #expected_headers = ["{}_{:012d}_Expected_Batch-{}_Memory-0".format(output, j, n_batch) for j in range(feature_start, feature_length)]
-    output_headers = ["{}_{:012d}_Output_Batch-{}_Memory-0".format(output, j, n_batch) for j in range(feature_start, 4)]
-    expected_headers = ["{}_{:012d}_Expected_Batch-{}_Memory-0".format(output, j, n_batch) for j in range(feature_start, 4)]
-    input_headers.append(index_name)
-    output_headers.append(index_name)
-    expected_headers.append(index_name)
-    return input_headers, output_headers, expected_headers
-
-def main(data_dir, data_filename, nodes_filename, index_name):
-    """Run main script"""
+        the input, output and expected values as 3-D arrays of shape (batches, epochs, nodes)
+    """
+    # the output nodes run from the feature start to the last output node
+    output_nodes = tensors[(row['output_filenames'], feature.loc["output"], "Output")][2]["node_index"]
+    output_nodes = np.arange(feature.loc["start"], output_nodes.max() + 1)
+    slices = [getTensorSlice(tensors, row['input_filenames'], feature.loc["input"], "Input", epochs, range(feature.loc["start"], feature.loc["span"]), batches, [0]),
+        getTensorSlice(tensors, row['output_filenames'], feature.loc["output"], "Output", epochs, output_nodes, batches, [0]),
+        getTensorSlice(tensors, row['expected_filenames'], feature.loc["output"], "Expected", epochs, output_nodes, batches, [0])]
+    return [values[..., 0].transpose(2, 0, 1) for values in slices]
+
+def normalizeFeatures(values):
+    """Scale each slice of values along its last axis to [0,1] by its minimum and range, all of the slices at once"""
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # missing epochs stay NaN
+        minimum = np.nanmin(values, axis=-1, keepdims=True)
+        return (values - minimum) / (np.nanmax(values, axis=-1, keepdims=True) - minimum)
+
+def exportFeatureFigure(features, subplot_titles, filename, dpi=150):
+    """Render the figure of a single epoch and batch to a file on the Agg backend
+
+    Args:
+        features: list of (label, series) of each feature, where series is a list of
+            (series label, color, marker, input values, normalised output values, normalised expected values)
+        subplot_titles: the titles of the input, output and expected panels
+        filename: name of the image file
+        dpi: the resolution of the image
+
+    Returns:
+        filename
+    """
+    plt.switch_backend("Agg")
+    fig, axs = plt.subplots(len(features), 3, sharex=False, sharey=False, squeeze=False, figsize=(12, 3 * len(features)))
+    for n_row, (label, series) in enumerate(features):
+        for series_label, color, marker, input_plot, output_plot, expected_plot in series:
+            for m, values in enumerate([input_plot, output_plot, expected_plot]):
+                axs[n_row, m].scatter(np.arange(len(values)), values,
+                    alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series_label)
+        for m in range(3):
+            axs[n_row, m].title.set_text("{} {}".format(label, subplot_titles[m]))
+        axs[n_row, 0].legend(loc="upper left", markerscale=2)
+    fig.suptitle(os.path.splitext(os.path.basename(filename))[0])
+    fig.tight_layout()
+    fig.savefig(filename, dpi=dpi)
+    plt.close(fig)
+    return filename
+
+def exportFeatures(filenames, nodes_to_labels, index_name, epochs, batches, output_dir, image_format="png", n_jobs=1, dpi=150):
+    """Render a figure of every feature and filename row for each epoch and batch to
+    <output_dir>/Feature_Epoch-<epoch>_Batch-<batch>.<image_format>, using a process pool.
+    Each file is read once, and the outputs and expected values of all of the epochs and
+    batches of a feature and filename row are normalised at once.
+
+    Args:
+        filenames: data frame of the input/output/expected filenames and 'series' of each row
+        nodes_to_labels: data frame of the features
+        index_name: name of the index header
+        epochs: list of the epochs
+        batches: list of the batches
+        output_dir: directory of the image files
+        image_format: png, svg or pdf
+        n_jobs: the number of figures to render at the same time
+        dpi: the resolution of the images
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tensors = readTensorPlan(planFeatureReads(filenames, nodes_to_labels, epochs, batches), index_name)
+
+    # collect the (batches, epochs, features) values of each feature and filename row
+    all_colors = ["b","r","g","m","c","y","k"]
+    all_markers = [".","+",",","o","x","v"]
+    subplot_titles = ["Input", "Output", "Expected"]
+    values = {}
+    for n_row in range(len(nodes_to_labels)):
+        for n_series, (index, row) in enumerate(filenames.iterrows()):
+            input_values, output_values, expected_values = getFeatureSlices(tensors, row, nodes_to_labels.iloc[n_row], epochs, batches)
+            values[(n_row, n_series)] = (input_values, normalizeFeatures(output_values), normalizeFeatures(expected_values))
+
+    # render a figure per epoch and batch
+    tasks = []
+    for e, n_epoch in enumerate(epochs):
+        for b, n_batch in enumerate(batches):
+            features = []
+            for n_row in range(len(nodes_to_labels)):
+                series = []
+                for n_series, (index, row) in enumerate(filenames.iterrows()):
+                    input_values, output_values, expected_values = values[(n_row, n_series)]
+                    series.append((row['series'], all_colors[n_series % len(all_colors)], all_markers[(n_series // len(all_colors)) % len(all_markers)],
+                        input_values[b, e], output_values[b, e], expected_values[b, e]))
+                features.append((nodes_to_labels.iloc[n_row].loc["labels"], series))
+            tasks.append((features, subplot_titles, os.path.join(output_dir, "Feature_Epoch-{}_Batch-{}.{}".format(n_epoch, n_batch, image_format)), dpi))
+    print("Rendering {} figures...".format(len(tasks)))
+    if n_jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+            for filename in executor.map(exportFeatureFigure, *zip(*tasks)):
+                print("saved {}".format(filename))
+    else:
+        for task in tasks:
+            print("saved {}".format(exportFeatureFigure(*task)))
+
+def main(data_dir, data_filename, nodes_filename, index_name, epochs=None, batches=None, output_dir=None, image_format="png", n_jobs=1, dpi=150):
+    """Run main script
+
+    When output_dir is given a figure of each of the epochs and batches is saved to output_dir
+    instead of showing a single figure of the 'n_epoch' and 'n_batch' of each row; epochs and batches
+    default to the 'n_epoch' and 'n_batch' values of the rows.
+    """
 
     # read in the input files
     filenames = pd.read_csv(data_filename)
     filenames = filenames[filenames["used_"]==True] # filter on used
     nodes_to_labels = pd.read_csv(nodes_filename)
     nodes_to_labels = nodes_to_labels[nodes_to_labels["used_"]==True] # filter on used
+    if output_dir is not None:
+        epochs = sorted(filenames["n_epoch"].unique()) if epochs is None else epochs
+        batches = sorted(filenames["n_batch"].unique()) if batches is None else batches
+        exportFeatures(filenames, nodes_to_labels, index_name, epochs, batches, output_dir, image_format, n_jobs, dpi)
+        return
 
     # make the initial figure
     n_nodes = len(nodes_to_labels)
@@ -101,22 +227,19 @@ def main(data_dir, data_filename, nodes_filename, index_name):
     subplot_titles = ["Input", "Output", "Expected"]
     marker_iter = 0
     color_iter = 0
+
+    # plan the node values and epochs needed from each file and read each file once
+    tensors = readTensorPlan(planFeatureReads(filenames, nodes_to_labels), index_name)
+
     for n_row in range(len(nodes_to_labels)):
         print("adding feature {}...".format(nodes_to_labels.iloc[n_row].loc["labels"]))
         for index, row in filenames.iterrows():
-            # make the expected column headers
-            input_headers, output_headers, expected_headers = makeColumnHeaders(nodes_to_labels.iloc[n_row].loc["input"], nodes_to_labels.iloc[n_row].loc["output"], row['n_batch'], nodes_to_labels.iloc[n_row].loc["start"], nodes_to_labels.iloc[n_row].loc["span"], index_name)
-
-            # read in and trim the data
-            input_data = pd.read_csv(row['input_filenames'], usecols = input_headers, dtype=np.float32)
-            input_data = input_data[input_data[index_name]==row['n_epoch']] # filter on epoch
-            output_data = pd.read_csv(row["output_filenames"], usecols = output_headers, dtype=np.float32)
-            output_data = output_data[output_data[index_name]==row['n_epoch']] # filter on epoch
-            expected_data = pd.read_csv(row["expected_filenames"], usecols = expected_headers, dtype=np.float32)
-            expected_data = expected_data[expected_data[index_name]==row['n_epoch']] # filter on epoch
-
-            # plot each node time-course
-            plotFeature(n_row, nodes_to_labels.iloc[n_row].loc["span"], subplot_titles, input_data, output_data, expected_data, nodes_to_labels.iloc[n_row].loc["labels"],
+            # get the values of the epoch and batch
+            input_values, output_values, expected_values = [values[0, 0] for values in
+                getFeatureSlices(tensors, row, nodes_to_labels.iloc[n_row], [row['n_epoch']], [row['n_batch']])]
+
+            # plot each node time-course with the output and expected values normalised to [0,1] as in exportFeatures
+            plotFeature(n_row, nodes_to_labels.iloc[n_row].loc["span"], subplot_titles, input_values, normalizeFeatures(output_values), normalizeFeatures(expected_values), nodes_to_labels.iloc[n_row].loc["labels"],
                             axs, all_colors[color_iter], all_markers[marker_iter], row['series'])
             color_iter += 1
             if color_iter >= len(all_colors):
@@ -131,11 +254,23 @@ def main(data_dir, data_filename, nodes_filename, index_name):
 
 # Run main
 if __name__ == "__main__":
-    # Input files
-    data_dir = ""
-    data_filename = data_dir + "FeatureFilenames.csv"
-    nodes_filename = data_dir + "FeatureNodes.csv"
-
-    # Input parameters
-    index_name = "Epoch"
-    main(data_dir, data_filename, nodes_filename, index_name)
\ No newline at end of file
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-d", "--data", default="FeatureFilenames.csv", dest="data_filename", help = "Input data filenames csv")
+    parser.add_argument("-l", "--nodes", default="FeatureNodes.csv", dest="nodes_filename", help = "Input features csv")
+    parser.add_argument("-i", "--index", default="Epoch", dest="index_name", help = "Name of the index; default = Epoch")
+    parser.add_argument("-o", "--output-dir", dest="output_dir", help = "Save a figure of each epoch and batch to this directory instead of showing the plot")
+    parser.add_argument("-e", "--epochs", nargs="+", dest="epochs", help = "Epochs to save, as numbers and/or start:stop[:step] ranges; default = n_epoch of the rows")
+    parser.add_argument("-b", "--batches", nargs="+", dest="batches", help = "Batches to save, as numbers and/or start:stop[:step] ranges; default = n_batch of the rows")
+    parser.add_argument("--format", default="png", choices=["png", "svg", "pdf"], dest="image_format", help = "Format of the saved figures; default = png")
+    parser.add_argument("-j", "--jobs", type=int, default=1, dest="n_jobs", help = "Number of figures to render at the same time; default = 1")
+    parser.add_argument("--dpi", type=int, default=150, dest="dpi", help = "Resolution of the saved figures; default = 150")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    main("", args.data_filename, args.nodes_filename, args.index_name,
+        None if args.epochs is None else parseRange(args.epochs), None if args.batches is None else parseRange(args.batches),
+        args.output_dir, args.image_format, args.n_jobs, args.dpi)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
+from StatsAccumulator import StatsAccumulator
 
 def aggregateCategoryLabel(headers, traversals, index_name, data, label, agg_stats):
     """Creates a pandas data frame with headers according to headers
@@ -14,26 +15,35 @@ def aggregateCategoryLabel(headers, traversals, index_name, data, label, agg_sta
         categories: dataframe of mapping from index to the category, label, and input
         index_name: name of the index header
         data: the actual data frame of values to aggregate according to the specified statistics
+        agg_stats: StatsAccumulator to add the rows to
 
     Returns:
-        dataframe
+        agg_stats
     """
 
-    unique_input = list(set(traversals['input']))
-    unique_input.sort()
+    # join the rows of the data with the inputs of the traversals that include their epoch,
+    # keeping the rows of each input in the order of the data
+    traversal_keys = traversals[['input', 'index']].drop_duplicates()
+    traversal_keys = traversal_keys.assign(index=traversal_keys['index'].astype(data[index_name].dtype))
+    joined = data.assign(_row=np.arange(len(data))).merge(traversal_keys, left_on=index_name, right_on='index')
+    joined = joined.sort_values(['input', '_row'], kind='stable').reset_index(drop=True)
+
+    # the traversals of each input in the order of the inputs
+    traversals_sorted = traversals.sort_values('input', kind='stable')
     for index, row in headers.iterrows():
-        for input in unique_input:
-            traversals_input = traversals[traversals['input']==input]
-            data_subset = data[data[index_name].isin(traversals_input['index'])]
-            if row['min_or_max'] == 'min':
-                data_subset = data_subset[data_subset[row['headers']] == data_subset[row['headers']].min()]
-            else:
-                data_subset = data_subset[data_subset[row['headers']] == data_subset[row['headers']].max()]
-            traversals_filtered = traversals_input[traversals_input['index'] == data_subset[index_name].iloc[0]]
-            traversals_filtered.insert(0, "metric_value", data_subset[row['headers']])
-            traversals_filtered.insert(0, "metric_name", row['headers'])
-            traversals_filtered.insert(0, "label", label) 
-            agg_stats = agg_stats.append(traversals_filtered, ignore_index=True)
+        # the first row of the data with the min or max of the header of each input
+        grouped = joined.groupby('input', sort=True)[row['headers']]
+        best = grouped.idxmin() if row['min_or_max'] == 'min' else grouped.idxmax()
+        best_epochs = pd.Series(joined.loc[best.to_numpy(), index_name].to_numpy(), index=best.index)
+        best_values = pd.Series(joined.loc[best.to_numpy(), row['headers']].to_numpy(), index=best.index)
+
+        # the traversals at the epoch of the min or max of each input
+        selected = traversals_sorted['index'] == traversals_sorted['input'].map(best_epochs)
+        traversals_filtered = traversals_sorted[selected].copy()
+        traversals_filtered.insert(0, "metric_value", traversals_filtered['input'].map(best_values).astype(data[row['headers']].dtype))
+        traversals_filtered.insert(0, "metric_name", row['headers'])
+        traversals_filtered.insert(0, "label", label)
+        agg_stats.append(traversals_filtered)
     return agg_stats
 
 def readDataFilenamesCsv(filename):
@@ -83,7 +93,7 @@ def readLatentTraversalSteps(filename):
     data_used = data[data["used_"]==True]
     return data_used
 
-def main(data_dir, data_filename, headers_filename, traversals_filename, index_name, n_rows):
+def main(data_dir, data_filename, headers_filename, traversals_filename, index_name, n_rows, stream_output=False):
     """Run main script"""
 
     # read in the input files
@@ -95,7 +105,7 @@ def main(data_dir, data_filename, headers_filename, traversals_filename, index_n
     flat_headers = list(headers.loc[:, "headers"])
     flat_headers.insert(0, index_name)
     columns_custom = ['label', 'step','gaussian_node','categorical_node','input','index','metric_value','metric_name']
-    agg_stats = pd.DataFrame(columns=columns_custom)
+    agg_stats = StatsAccumulator(columns_custom, data_dir + "LatentTraversal.csv", stream_output)
 
     # make the initial figure
     n_data = len(filenames)
@@ -109,10 +119,11 @@ def main(data_dir, data_filename, headers_filename, traversals_filename, index_n
         # calculate the aggregate statistics
         print("Aggregating statistics for {}...".format(n))
         agg_stats = aggregateCategoryLabel(headers, traversals, index_name, data, labels[n], agg_stats)
+        agg_stats.flush()
 
     # store the aggregate statistics
     print("Storing aggregate statistics...")
-    agg_stats.to_csv(data_dir + "LatentTraversal.csv")
+    agg_stats.close()
 
 # Run main
 if __name__ == "__main__":
@@ -123,5 +134,5 @@ if __name__ == "__main__":
     traversals_filename = data_dir + "LatentTraversalSteps.csv"
 
     # Name of the index
-    index_name = "Epoch"; n_rows = 100000;
-    main(data_dir, data_filename, headers_filename, traversals_filename, index_name, n_rows)
\ No newline at end of file
+    index_name = "Epoch"; n_rows = 100000; stream_output = False;
+    main(data_dir, data_filename, headers_filename, traversals_filename, index_name, n_rows, stream_output)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
+from StatsAccumulator import StatsAccumulator
 
 def aggregateCategoryLabel(thresholds, categories, index_name, data, label, n_agg_values = 10):
     """Creates a pandas data frame with headers according to headers
@@ -32,9 +33,121 @@ def aggregateCategoryLabel(thresholds, categories, index_name, data, label, n_ag
 
     # add in the labels as a new column
     categories_filtered.insert(0, "label", label)
-    categories_filtered.drop(columns=['used_', 'index'], axis=1)
     return categories_filtered
 
+def readThresholdGrid(filename):
+    """Creates a dict of the sorted thresholds of each header from a .csv file with headers for
+    'headers','thresholds' with a row per threshold of each header.  The column 'used_' is
+    used to select what rows to use
+
+    Args:
+        filename: name of the file
+
+    Returns:
+        dict of header to the list of its thresholds in ascending order, in the order of the headers in the file
+    """
+    data = pd.read_csv(filename)
+    data_used = data[data["used_"]==True]
+    grid = {}
+    for header, thresholds in data_used.groupby("headers", sort=False)["thresholds"]:
+        grid[header] = sorted(set(thresholds))
+    return grid
+
+def countAboveThresholds(ranks, shape, codes=None, n_codes=1, weights=None):
+    """Count the rows that are above each point of a grid of thresholds.  Each row is counted at the cell
+    of its ranks, and the counts are summed from the top of each axis down, so that the count at a point
+    is the number of rows whose rank is above it on every axis.
+
+    Args:
+        ranks: list of the rank of each row along each axis, from 0 to the number of thresholds of the axis
+        shape: the number of thresholds + 1 along each axis
+        codes: the group of each row, or None to count all of the rows together
+        n_codes: the number of groups
+        weights: the number each row is counted with, or None to count each row once
+
+    Returns:
+        array of shape (n_codes,) + the number of thresholds along each axis
+    """
+    cells = np.ravel_multi_index(ranks, shape) if len(ranks[0]) else np.zeros(0, dtype=np.intp)
+    n_cells = int(np.prod(shape))
+    if codes is not None:
+        cells = codes * n_cells + cells
+    counts = np.bincount(cells, weights, minlength=n_codes * n_cells)
+    if weights is not None:
+        counts = counts.astype(np.int64)
+    counts = counts.reshape((n_codes,) + tuple(shape))
+    for axis in range(1, counts.ndim):
+        counts = np.flip(np.cumsum(np.flip(counts, axis), axis), axis)
+    return counts[(slice(None),) + (slice(1, None),) * len(shape)]
+
+def sweepThresholds(grid, categories, index_name, data, label):
+    """Count the epochs that pass every combination of the thresholds of a grid, and the categories
+    of those epochs, in a single pass over the data instead of filtering the data for each combination.
+    As in aggregateCategoryLabel a row passes when each header is above its threshold,
+    and the categories of an epoch are matched when any of the rows of the epoch pass.
+
+    Args:
+        grid: dict of header to the list of its thresholds in ascending order, from readThresholdGrid
+        categories: dataframe of mapping from index to the category, label, and input
+        index_name: name of the index header
+        data: the actual data frame of values to filter by the thresholds
+        label: the label of the data
+
+    Returns:
+        dataframe with a row per point of the grid with the 'label', the threshold of each header,
+        'n_epochs' (the number of epochs that pass), 'n_matched' (the number of rows of the categories
+        of those epochs), 'n_categories' and 'n_inputs' (the number of distinct categories and inputs)
+    """
+    # the rank of the value of each row among the thresholds of each header;
+    # a row passes the threshold at position j of a header when j < rank
+    headers = list(grid)
+    thresholds, ranks = [], []
+    for header in headers:
+        values = data[header].to_numpy()
+        header_thresholds = np.asarray(grid[header], dtype=values.dtype) # compared as with data[header] > threshold
+        rank = np.searchsorted(header_thresholds, values, side='left')
+        rank[np.isnan(values)] = 0
+        thresholds.append(header_thresholds)
+        ranks.append(rank)
+    shape = [len(header_thresholds) + 1 for header_thresholds in thresholds]
+
+    # the epoch of each row of the data and of each category; an epoch can have more than one row,
+    # and as with the isin filter of aggregateCategoryLabel its categories are matched when any of its rows pass
+    row_epochs, epochs = pd.factorize(data[index_name], use_na_sentinel=False)
+    positions = pd.Index(epochs).get_indexer(categories['index'].astype(data[index_name].dtype))
+    found = positions >= 0
+    n_epoch_rows = np.bincount(row_epochs, minlength=len(epochs))
+    n_epoch_categories = np.bincount(positions[found], minlength=len(epochs))
+
+    counts = {"n_epochs": countAboveThresholds(ranks, shape)[0]}
+
+    # the rows of the epochs seen once are counted with the number of categories of their epoch,
+    # and the rows of the repeated epochs once per epoch where at least one of them passes
+    single = n_epoch_rows[row_epochs] == 1
+    counts["n_matched"] = countAboveThresholds([rank[single] for rank in ranks], shape,
+        weights=n_epoch_categories[row_epochs[single]])[0]
+    repeated_codes, repeated_epochs = pd.factorize(row_epochs[~single])
+    if len(repeated_epochs):
+        passed = countAboveThresholds([rank[~single] for rank in ranks], shape, repeated_codes, len(repeated_epochs)) > 0
+        counts["n_matched"] += np.tensordot(n_epoch_categories[repeated_epochs], passed, axes=1)
+
+    # each category is paired with every row of the data of its epoch
+    pairs = pd.merge(
+        pd.DataFrame({"epoch": positions[found], "category": categories['category'][found].to_numpy(), "input": categories['input'][found].to_numpy()}),
+        pd.DataFrame({"epoch": row_epochs, "row": np.arange(len(row_epochs))}), on="epoch")
+    pair_ranks = [rank[pairs["row"].to_numpy()] for rank in ranks]
+    for name, column in [("n_categories", "category"), ("n_inputs", "input")]:
+        codes, uniques = pd.factorize(pairs[column])
+        counts[name] = (countAboveThresholds(pair_ranks, shape, codes, len(uniques)) > 0).sum(axis=0)
+
+    # one row per point of the grid
+    points = np.meshgrid(*thresholds, indexing='ij')
+    sweep = pd.DataFrame({header: point.ravel() for header, point in zip(headers, points)})
+    for name, count in counts.items():
+        sweep[name] = count.ravel()
+    sweep.insert(0, "label", label)
+    return sweep
+
 def readDataFilenamesCsv(filename):
     """Creates a pandas data frame with headers for 'filenames','labels','color','marker'
     from a .csv file and returns each of the columns as seperate entities.  The column 'used_' is
@@ -83,20 +196,29 @@ def readCategoryLabel(filename):
     data_used = data[data["used_"]==True]
     return data_used
 
-def main(data_dir, data_filename, headers_filename, categories_filename, index_name, n_rows):
-    """Run main script"""
+def main(data_dir, data_filename, headers_filename, categories_filename, index_name, n_rows, stream_output=False, sweep_filename=None):
+    """Run main script
+
+    When sweep_filename is given the epochs and categories that pass each combination of the thresholds
+    in sweep_filename are counted and stored in LatentUnsClassSweep.csv instead of LatentUnsClass.csv
+    """
 
     # read in the input files
     filenames, labels = readDataFilenamesCsv(data_filename)
     headers = readDataHeaders(headers_filename)
     categories = readCategoryLabel(categories_filename)
+    grid = None if sweep_filename is None else readThresholdGrid(sweep_filename)
 
     # make the empty data frame for the aggregate statistics
-    flat_headers = list(headers.loc[:, "headers"])
+    flat_headers = list(headers.loc[:, "headers"]) if grid is None else list(grid)
     flat_headers.insert(0, index_name)
-    columns_custom = ["label", "category", "predicted", "input"]
-    columns_custom = columns_custom + flat_headers
-    agg_stats = pd.DataFrame(columns=columns_custom)
+    if grid is None:
+        columns_custom = ["label", "category", "predicted", "input"]
+        columns_custom = columns_custom + flat_headers
+        agg_stats = StatsAccumulator(columns_custom, data_dir + "LatentUnsClass.csv", stream_output)
+    else:
+        columns_custom = ["label"] + list(grid) + ["n_epochs", "n_matched", "n_categories", "n_inputs"]
+        agg_stats = StatsAccumulator(columns_custom, data_dir + "LatentUnsClassSweep.csv", stream_output)
 
     # make the initial figure
     n_data = len(filenames)
@@ -109,12 +231,16 @@ def main(data_dir, data_filename, headers_filename, categories_filename, index_n
 
         # calculate the aggregate statistics
         print("Aggregating statistics for {}...".format(n))
-        row_data = aggregateCategoryLabel(headers, categories, index_name, data, labels[n])
-        agg_stats = agg_stats.append(row_data, ignore_index=True)
+        if grid is None:
+            row_data = aggregateCategoryLabel(headers, categories, index_name, data, labels[n])
+        else:
+            row_data = sweepThresholds(grid, categories, index_name, data, labels[n])
+        agg_stats.append(row_data)
+        agg_stats.flush()
 
     # store the aggregate statistics
     print("Storing aggregate statistics...")
-    agg_stats.to_csv(data_dir + "LatentUnsClass.csv")
+    agg_stats.close()
 
 # Run main
 if __name__ == "__main__":
@@ -125,5 +251,8 @@ if __name__ == "__main__":
     categories_filename = data_dir + "LatentUnsClassCategories.csv"
 
     # Name of the index
-    index_name = "Epoch"; n_rows = 100000;
-    main(data_dir, data_filename, headers_filename, categories_filename, index_name, n_rows)
\ No newline at end of file
+    index_name = "Epoch"; n_rows = 100000; stream_output = False;
+
+    # Grid of thresholds to sweep instead, e.g. data_dir + "LatentUnsClassThresholds.csv"
+    sweep_filename = None
+    main(data_dir, data_filename, headers_filename, categories_filename, index_name, n_rows, stream_output, sweep_filename)
\ No newline at end of file
@@ -1,49 +1,909 @@
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
-from subprocess import Popen
+import os, re, time, json, signal, argparse, hashlib, asyncio, logging, logging.handlers
+
+LEDGER_COLUMNS = ["hash", "command", "status", "returncode", "start", "end", "attempts", "host"]
+RESOURCE_COLUMNS = ["gpu_slots", "cpu_cores", "mem_gb"]
+PROGRESS_PATTERN = r"[Ee]poch\D{0,3}(\d+)(?:\s*(?:/|of)\s*(\d+))?"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+AGENT_WAIT_INTERVAL = 5.0
+CPU_SAMPLE_INTERVAL = 2.0
+TERMINATE_TIMEOUT = 10.0
 
 def readCommandsCsv(filename):
-    """Creates a pandas data frame with headers for 'commands'
-    from a .csv file and returns each of the columns as seperate entities.  The column 'used_' is
-    used to select what rows to use
+    """Creates a pandas data frame with headers for 'commands' and the optional resource columns
+    'gpu_slots','cpu_cores','mem_gb' from a .csv file and returns each of the columns as seperate entities.
+    The column 'used_' is used to select what rows to use.  Missing resource columns or empty
+    values are taken to mean that the command does not need that resource
 
     Args:
         filename: name of the file
 
     Returns:
-        pandas data frame with headers for 'filenames','labels','colors','markers'
+        list of commands and list of dicts with the resources required by each command
     """
     data = pd.read_csv(filename)
     data_used = data[data["used_"]==True]
-    commands = list(data_used.loc[:, "commands"]) 
-    return commands
+    commands = list(data_used.loc[:, "commands"])
+    resources = pd.DataFrame(index=data_used.index)
+    for column in RESOURCE_COLUMNS:
+        resources[column] = data_used[column].fillna(0) if column in data_used else 0
+    resources["gpu_slots"] = resources["gpu_slots"].astype(int)
+    return commands, resources.to_dict("records")
+
+def formatTime(timestamp):
+    """Format a time.time() timestamp as a local date and time string"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+def hashCommand(command):
+    """Hash a command so that it can be identified between runs"""
+    return hashlib.sha1(command.encode("utf-8")).hexdigest()
+
+def getLedgerFilename(filename):
+    """Name of the ledger file that is kept next to the commands .csv file"""
+    return os.path.splitext(filename)[0] + "_ledger.csv"
+
+def readLedger(filename):
+    """Read the job ledger from a .csv file
+
+    Args:
+        filename: name of the ledger file
+
+    Returns:
+        dict of command hash to a dict with 'hash','command','status','returncode','start','end','attempts','host'
+    """
+    if not os.path.exists(filename):
+        return {}
+    data = pd.read_csv(filename, dtype={"hash": str, "command": str, "status": str, "host": str})
+    ledger = {}
+    for entry in data.to_dict("records"):
+        entry["attempts"] = int(entry["attempts"])
+        ledger[entry["hash"]] = entry
+    return ledger
+
+def writeLedger(filename, ledger):
+    """Write the job ledger to a .csv file.
+    The ledger is first written to a temporary file and then moved into place so that
+    an interrupted write does not corrupt the ledger.
+
+    Args:
+        filename: name of the ledger file
+        ledger: dict of command hash to ledger entry
+    """
+    data = pd.DataFrame(list(ledger.values()), columns=LEDGER_COLUMNS)
+    data.to_csv(filename + ".tmp", index=False)
+    os.replace(filename + ".tmp", filename)
+
+def selectCommands(commands, resources, ledger, max_attempts):
+    """Select the commands that still need to be run and add any new commands to the ledger.
+    Finished commands are skipped, failed commands are retried until they have been
+    attempted max_attempts times, and commands that were still running when a previous
+    sweep was interrupted are run again.
+
+    Args:
+        commands: list of shell commands
+        resources: list of dicts with the resources required by each command
+        ledger: dict of command hash to ledger entry
+        max_attempts: the maximum number of times to attempt a failed command
+
+    Returns:
+        list of (job number, command hash, required resources) tuples to run
+    """
+    to_run = []
+    for n, (command, required) in enumerate(zip(commands, resources)):
+        command_hash = hashCommand(command)
+        if command_hash not in ledger:
+            ledger[command_hash] = {"hash": command_hash, "command": command, "status": "pending",
+                "returncode": np.nan, "start": np.nan, "end": np.nan, "attempts": 0, "host": np.nan}
+        entry = ledger[command_hash]
+        if any(command_hash == h for _, h, _ in to_run):
+            print("job {} is a duplicate command and will only be run once".format(n))
+        elif entry["status"] == "finished":
+            print("job {} already finished at {}".format(n, formatTime(entry["end"])))
+        elif entry["status"] == "failed" and entry["attempts"] >= max_attempts:
+            print("job {} failed {} times with exit code {} and will not be retried".format(
+                n, entry["attempts"], int(entry["returncode"])))
+        else:
+            to_run.append((n, command_hash, required))
+    return to_run
+
+def fitsResources(required, free):
+    """Check if the required resources fit into the free resources of the pool
+
+    Args:
+        required: dict of resource name to the amount required
+        free: dict of resource name to the amount free; None means the resource is not limited
+
+    Returns:
+        True if the required resources fit
+    """
+    return all(free[column] is None or required[column] <= free[column] for column in RESOURCE_COLUMNS)
+
+def checkResources(commands, pool):
+    """Raise an error for any command that requires more resources than the whole pool
+
+    Args:
+        commands: list of (job number, command hash, required resources) tuples to run
+        pool: dict of resource name to the amount in the pool; None means the resource is not limited
+    """
+    for n, command_hash, required in commands:
+        if not fitsResources(required, pool):
+            raise ValueError("job {} requires {} which does not fit into the resource pool {}".format(n, required, pool))
+
+def getAvailableCores():
+    """List the ids of the cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+def makePoolState(pool, n_threads, pin_cores=None):
+    """Make the bookkeeping of the free slots and resources of a resource pool
+
+    Args:
+        pool: dict of resource name to the amount in the pool; None means the resource is not limited
+        n_threads: the number of slots
+        pin_cores: the number of cores to pin each job to when it does not require a number of cpu_cores;
+            None to not pin the jobs to cores
+
+    Returns:
+        dict with 'pool','free','free_slots','free_gpu_slots','pin_cores','free_cores'
+    """
+    if pool is None:
+        pool = {column: None for column in RESOURCE_COLUMNS}
+    return {"pool": pool, "free": dict(pool), "free_slots": list(range(n_threads)),
+        "free_gpu_slots": list(range(pool["gpu_slots"])) if pool["gpu_slots"] is not None else [],
+        "pin_cores": pin_cores, "free_cores": getAvailableCores() if pin_cores else []}
+
+def allocateResources(state, required):
+    """Allocate a slot and the required resources from the pool.
+    When pinning is enabled the job also gets its own set of cores that no other job is pinned to.
+
+    Args:
+        state: the pool bookkeeping from makePoolState
+        required: dict of resource name to the amount required
+
+    Returns:
+        the slot id, the list of GPU slot ids and the list of pinned core ids,
+        or None if the required resources are not free
+    """
+    if not state["free_slots"] or not fitsResources(required, state["free"]):
+        return None
+    n_cores = 0
+    if state["pin_cores"]:
+        n_cores = int(np.ceil(required["cpu_cores"])) or state["pin_cores"]
+        if n_cores > len(state["free_cores"]):
+            return None
+    for column in RESOURCE_COLUMNS:
+        if state["free"][column] is not None:
+            state["free"][column] -= required[column]
+    slot = state["free_slots"].pop(0)
+    gpu_slots = []
+    if state["pool"]["gpu_slots"] is not None:
+        gpu_slots = state["free_gpu_slots"][:required["gpu_slots"]]
+        state["free_gpu_slots"] = state["free_gpu_slots"][required["gpu_slots"]:]
+    cores, state["free_cores"] = state["free_cores"][:n_cores], state["free_cores"][n_cores:]
+    return slot, gpu_slots, cores
+
+def releaseResources(state, required, slot, gpu_slots, cores):
+    """Return a slot and its resources to the pool
+
+    Args:
+        state: the pool bookkeeping from makePoolState
+        required: dict of resource name to the amount required
+        slot: the slot id
+        gpu_slots: the list of GPU slot ids
+        cores: the list of pinned core ids
+    """
+    for column in RESOURCE_COLUMNS:
+        if state["free"][column] is not None:
+            state["free"][column] += required[column]
+    state["free_slots"] = sorted(state["free_slots"] + [slot])
+    state["free_gpu_slots"] = sorted(state["free_gpu_slots"] + gpu_slots)
+    state["free_cores"] = sorted(state["free_cores"] + cores)
+
+def makeJobEnv(slot, gpu_slots):
+    """Make the environment of a job with its slot id in EVONET_SLOT and GPU slot ids in EVONET_GPU_SLOTS"""
+    return dict(os.environ, EVONET_SLOT=str(slot), EVONET_GPU_SLOTS=",".join(str(g) for g in gpu_slots))
+
+def makePreexecFn(cores, niceness):
+    """Make the function that pins a job to its cores and sets its niceness before the command is started
+
+    Args:
+        cores: list of core ids to pin the job to; empty to not pin the job
+        niceness: increment of the niceness of the job; 0 to keep the niceness
+
+    Returns:
+        the function, or None when there is nothing to set or the platform does not support it
+    """
+    if os.name != "posix" or (not cores and not niceness):
+        return None
+    def preexecFn():
+        if niceness:
+            os.nice(niceness)
+        if cores and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+    return preexecFn
+
+def stopProcessGroup(proc, kill=False):
+    """Terminate or kill a command and the processes it started, which share its process group
+    as the command is started in its own session; only the command itself is stopped where there are no process groups
+
+    Args:
+        proc: the process of the command
+        kill: True to kill the processes instead of asking them to terminate
+    """
+    if os.name != "posix":
+        proc.kill() if kill else proc.terminate()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+    except ProcessLookupError:
+        pass # the process group has already ended
+
+def readProcessTreeCpuTime(pid):
+    """Read the CPU time used so far by a process and all of its descendants from /proc (Linux only).
+    The CPU time of descendants that have already ended is included through the children times
+    of the process that waited for them.
+
+    Args:
+        pid: the process id
+
+    Returns:
+        the user + system CPU time in seconds, or None when it could not be read
+    """
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    cpu_time = 0
+    to_visit = [pid]
+    while to_visit:
+        p = to_visit.pop()
+        try:
+            with open("/proc/{}/stat".format(p)) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu_time += sum(int(field) for field in fields[11:15]) # utime, stime, cutime, cstime
+            for task in os.listdir("/proc/{}/task".format(p)):
+                with open("/proc/{}/task/{}/children".format(p, task)) as f:
+                    to_visit.extend(int(child) for child in f.read().split())
+        except (OSError, IndexError, ValueError):
+            if p == pid:
+                return None
+    return cpu_time / clock_ticks
+
+async def sampleCpuTime(pid, usage, sample_interval):
+    """Sample the CPU time of a running job into usage['cpu_s'] until the task is cancelled"""
+    while True:
+        cpu_time = readProcessTreeCpuTime(pid)
+        if cpu_time is not None:
+            usage["cpu_s"] = cpu_time
+        await asyncio.sleep(sample_interval)
+
+def readAvailableMemoryGb():
+    """Read the available memory in GB from /proc/meminfo (Linux only), or None when it could not be read"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 / 1024
+    except OSError:
+        pass
+    return None
+
+def adjustConcurrency(n_threads, min_threads, max_threads, max_load, min_free_mem_gb):
+    """Raise or lower the number of commands to run at the same time by one
+    depending on the system load average and free memory
+
+    Args:
+        n_threads: the current number of commands to run at the same time
+        min_threads: the lower bound of the number of commands to run at the same time
+        max_threads: the upper bound of the number of commands to run at the same time
+        max_load: the 1 minute load average per core above which the number of commands is lowered
+        min_free_mem_gb: the free memory in GB below which the number of commands is lowered
+
+    Returns:
+        the new number of commands to run at the same time
+    """
+    load = os.getloadavg()[0] / os.cpu_count() if hasattr(os, "getloadavg") else None
+    free_mem_gb = readAvailableMemoryGb()
+    if (load is not None and load > max_load) or (free_mem_gb is not None and free_mem_gb < min_free_mem_gb):
+        return max(min_threads, n_threads - 1)
+    if (load is None or load < 0.9 * max_load) and (free_mem_gb is None or free_mem_gb > 1.5 * min_free_mem_gb):
+        return min(max_threads, n_threads + 1)
+    return n_threads
+
+async def sendMessage(writer, message):
+    """Send a message as a line of json to a coordinator or worker agent"""
+    writer.write((json.dumps(message) + "\n").encode("utf-8"))
+    await writer.drain()
+
+async def readMessage(reader):
+    """Read a line of json message from a coordinator or worker agent
 
-def main(data_dir, filename):
+    Raises:
+        ConnectionError: if the connection was closed
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    return json.loads(line)
+
+def makeJobLogger(log_filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """Make a logger that writes the raw output lines of a single job to its own rotating log file
+
+    Args:
+        log_filename: name of the log file
+        max_bytes: size at which the log file is rotated
+        backup_count: number of rotated log files to keep
+
+    Returns:
+        logging.Logger
+    """
+    logger = logging.getLogger("LaunchMultiCmd." + os.path.basename(log_filename))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.handlers.RotatingFileHandler(log_filename, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+def closeJobLogger(logger):
+    """Close and remove the handlers of a job logger"""
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+def parseProgress(line, progress, progress_pattern, n_epochs=None):
+    """Update the training progress of a job from a line of its output
+
+    Args:
+        line: a line of output
+        progress: dict with 'first_epoch','first_time','epoch','time','n_epochs' that is updated in place
+        progress_pattern: compiled regular expression with the epoch as the first group and
+            optionally the total number of epochs as the second group
+        n_epochs: the total number of epochs when it is not part of the output
+    """
+    match = progress_pattern.search(line)
+    if match is None:
+        return
+    epoch = int(match.group(1))
+    now = time.time()
+    if "first_epoch" not in progress or epoch < progress["epoch"]:
+        progress.update({"first_epoch": epoch, "first_time": now})
+    progress.update({"epoch": epoch, "time": now})
+    if match.lastindex is not None and match.lastindex >= 2 and match.group(2):
+        progress["n_epochs"] = int(match.group(2))
+    elif n_epochs:
+        progress["n_epochs"] = n_epochs
+
+def getProgressRates(progress, now):
+    """Calculate the epochs per second and the estimated time remaining from the training progress
+
+    Args:
+        progress: dict with 'first_epoch','first_time','epoch','time','n_epochs'
+        now: the current time
+
+    Returns:
+        dict with 'epoch','epochs_per_s','eta_s','idle_s'
+    """
+    rates = {"epoch": progress.get("epoch", np.nan), "epochs_per_s": np.nan, "eta_s": np.nan, "idle_s": np.nan}
+    if "epoch" not in progress:
+        return rates
+    rates["idle_s"] = now - progress["time"]
+    if progress["time"] > progress["first_time"]:
+        rates["epochs_per_s"] = (progress["epoch"] - progress["first_epoch"]) / (progress["time"] - progress["first_time"])
+        if progress.get("n_epochs") and rates["epochs_per_s"] > 0:
+            rates["eta_s"] = (progress["n_epochs"] - progress["epoch"]) / rates["epochs_per_s"]
+    return rates
+
+def printProgressTable(running, n_pending, now):
+    """Print a table of the progress of each running job
+
+    Args:
+        running: dict of job number to running job dict
+        n_pending: the number of jobs waiting to be run
+        now: the current time
+    """
+    rows = []
+    for n, job in sorted(running.items()):
+        row = {"job": n, "host": job["host"], "slot": job["slot"], "elapsed_s": now - job["start"]}
+        row.update(getProgressRates(job["progress"], now))
+        rows.append(row)
+    print("[{}] {} jobs running, {} pending".format(formatTime(now), len(rows), n_pending))
+    if rows:
+        print(pd.DataFrame(rows).to_string(index=False, float_format="{:.1f}".format))
+
+async def streamOutput(stream, logger, progress, progress_pattern, n_epochs, prefix="", chunksize=65536):
+    """Copy each line of a job output stream to the job log as it arrives and parse its progress.
+    The stream is read in chunks and split into lines at \\n, \\r\\n and \\r, so that lines of any length
+    and carriage-return progress bars are handled
+
+    Args:
+        stream: asyncio.StreamReader of the stdout or stderr of the job
+        logger: the job logger
+        progress: dict with the training progress of the job
+        progress_pattern: compiled regular expression to parse the progress with
+        n_epochs: the total number of epochs when it is not part of the output
+        prefix: prefix added to each logged line
+        chunksize: the number of bytes to read at a time
+    """
+    def logLine(line):
+        line = line.decode("utf-8", errors="replace").rstrip()
+        logger.info(prefix + line)
+        parseProgress(line, progress, progress_pattern, n_epochs)
+
+    tail = b"" # the partial line at the end of the last chunk
+    after_cr = False
+    while True:
+        chunk = await stream.read(chunksize)
+        if not chunk:
+            break
+        if after_cr and chunk.startswith(b"\n"):
+            chunk = chunk[1:] # the \r\n was split between two chunks
+        after_cr = chunk.endswith(b"\r")
+        lines = re.split(b"\r\n|\r|\n", tail + chunk)
+        tail = lines.pop()
+        for line in lines:
+            logLine(line)
+    if tail:
+        logLine(tail)
+
+async def superviseCommand(command, env, log_filename, progress, progress_pattern, n_epochs, usage=None, cores=None, niceness=0,
+        sample_interval=CPU_SAMPLE_INTERVAL):
+    """Run a command and stream its stdout and stderr into its log file
+
+    Args:
+        command: the shell command to run
+        env: the environment of the command
+        log_filename: name of the log file
+        progress: dict with the training progress of the job that is updated as output arrives
+        progress_pattern: compiled regular expression to parse the progress with
+        n_epochs: the total number of epochs when it is not part of the output
+        usage: dict that the CPU time of the job is sampled into as 'cpu_s' while it runs
+        cores: list of core ids to pin the job to; None or empty to not pin the job
+        niceness: increment of the niceness of the job
+        sample_interval: seconds between samples of the CPU time
+
+    Returns:
+        the exit code of the command
+    """
+    logger = makeJobLogger(log_filename)
+    logger.info("# {} started at {}: {}".format(os.path.basename(log_filename), formatTime(time.time()), command))
+    proc = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env,
+        preexec_fn=makePreexecFn(cores or [], niceness), start_new_session=os.name == "posix")
+    sampler = None
+    if usage is not None and os.path.exists("/proc/{}/stat".format(proc.pid)):
+        sampler = asyncio.ensure_future(sampleCpuTime(proc.pid, usage, sample_interval))
+    try:
+        await asyncio.gather(
+            streamOutput(proc.stdout, logger, progress, progress_pattern, n_epochs),
+            streamOutput(proc.stderr, logger, progress, progress_pattern, n_epochs, "[stderr] "))
+        if sampler is not None:
+            # sample once more in case the process has not been reaped yet
+            cpu_time = readProcessTreeCpuTime(proc.pid)
+            if cpu_time is not None:
+                usage["cpu_s"] = cpu_time
+        returncode = await proc.wait()
+        logger.info("# ended at {} with exit code {}".format(formatTime(time.time()), returncode))
+        return returncode
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        if proc.returncode is None:
+            # the shell and the processes it started are stopped and reaped before the job counts as ended
+            stopProcessGroup(proc)
+            try:
+                await asyncio.wait_for(proc.wait(), TERMINATE_TIMEOUT)
+            except asyncio.TimeoutError:
+                stopProcessGroup(proc, kill=True)
+                await proc.wait()
+            logger.info("# stopped at {} with exit code {}".format(formatTime(time.time()), proc.returncode))
+        closeJobLogger(logger)
+
+async def runCommandsAsync(commands, n_threads, ledger, ledger_filename, max_attempts, pool, log_dir,
+        progress_pattern, n_epochs, status_interval, listen, token, reconnect_grace, pin_cores, niceness, adaptive):
+    """Asynchronous implementation of runCommands"""
+    state = makePoolState(pool, n_threads, pin_cores)
+    limit = n_threads if adaptive is None else max(1, min(n_threads, adaptive["min_threads"]))
+    last_adapt = time.time()
+    progress_pattern = re.compile(progress_pattern)
+    os.makedirs(log_dir, exist_ok=True)
+
+    pending = list(commands)
+    running = {}
+    jobs = []
+    agents = {}
+    wakeup = [asyncio.get_running_loop().create_future()]
+
+    def wakeScheduler():
+        if not wakeup[0].done():
+            wakeup[0].set_result(None)
+
+    def startEntry(n, command, host):
+        entry = ledger[command[1]]
+        entry.update({"status": "running", "returncode": np.nan, "start": time.time(), "end": np.nan, "host": host})
+        entry["attempts"] += 1
+        writeLedger(ledger_filename, ledger)
+        return entry
+
+    def requeueCommand(n, front=False):
+        running_job = running.pop(n)
+        entry = ledger[running_job["command"][1]]
+        entry.update({"status": "pending", "start": np.nan})
+        entry["attempts"] -= 1
+        if front:
+            pending.insert(0, running_job["command"])
+        else:
+            pending.append(running_job["command"])
+        writeLedger(ledger_filename, ledger)
+
+    def findRunning(command_hash):
+        for n, running_job in running.items():
+            if running_job["command"][1] == command_hash:
+                return n
+        return None
+
+    async def handleAgent(reader, writer):
+        """Hand out pending commands to a worker agent and collect their results"""
+        agent = None
+        try:
+            hello = await readMessage(reader)
+            if hello.get("type") != "hello" or hello.get("token") != token:
+                await sendMessage(writer, {"type": "error", "message": "invalid hello or token"})
+                return
+            agent = "{}#{}".format(hello["host"], id(writer))
+            agents[agent] = writer
+
+            # adopt the commands the agent was still running when its previous connection dropped,
+            # unless they were handed to another agent or run locally in the meantime
+            kill = []
+            for command_hash in hello.get("running", []):
+                n = findRunning(command_hash)
+                if n is not None:
+                    if running[n]["orphaned_at"] is not None and running[n]["host"] == hello["host"]:
+                        running[n].update({"agent": agent, "orphaned_at": None})
+                    else:
+                        kill.append(command_hash)
+                    continue
+                command = next((c for c in pending if c[1] == command_hash), None)
+                if command is None:
+                    kill.append(command_hash) # the command already finished
+                    continue
+                pending.remove(command)
+                entry = startEntry(command[0], command, hello["host"])
+                running[command[0]] = {"task": asyncio.get_running_loop().create_future(), "command": command,
+                    "host": hello["host"], "agent": agent, "orphaned_at": None, "slot": None, "gpu_slots": [],
+                    "start": entry["start"], "progress": {}, "log": None}
+            await sendMessage(writer, {"type": "welcome", "kill": kill})
+            print("agent {} connected".format(agent))
+            for command_hash in kill:
+                print("agent {} is told to stop its copy of {}".format(agent, command_hash[:8]))
+
+            while True:
+                message = await readMessage(reader)
+                if message["type"] == "request":
+                    # hand out the first pending command that fits into the free resources of the agent
+                    free = {column: message["free"].get(column) for column in RESOURCE_COLUMNS}
+                    command = next((c for c in pending if fitsResources(c[2], free)), None)
+                    if command is None:
+                        await sendMessage(writer, {"type": "wait" if pending or running else "done", "seconds": AGENT_WAIT_INTERVAL})
+                        continue
+                    pending.remove(command)
+                    n, command_hash, required = command
+                    entry = startEntry(n, command, hello["host"])
+                    running[n] = {"task": asyncio.get_running_loop().create_future(), "command": command,
+                        "host": hello["host"], "agent": agent, "orphaned_at": None, "slot": None, "gpu_slots": [],
+                        "start": entry["start"], "progress": {}, "log": None}
+                    print("job {} started at {} on {} (attempt {})".format(n, formatTime(entry["start"]), hello["host"], entry["attempts"]))
+                    await sendMessage(writer, {"type": "job", "job": n, "hash": command_hash, "command": entry["command"],
+                        "required": {column: float(required[column]) for column in RESOURCE_COLUMNS}})
+
+                elif message["type"] == "result":
+                    await sendMessage(writer, {"type": "ack", "hash": message["hash"]})
+                    n = findRunning(message["hash"])
+                    if n is None or running[n]["agent"] != agent:
+                        print("ignoring result of {} from {} that is no longer assigned to it".format(message["hash"][:8], agent))
+                        continue
+                    running[n].update({"start": message["start"], "remote": message, "orphaned_at": None})
+                    running[n]["task"].set_result(message["returncode"])
+                    wakeScheduler()
+
+                elif message["type"] == "reject":
+                    # the agent could not fit the command into its free resources after all
+                    await sendMessage(writer, {"type": "ack", "hash": message["hash"]})
+                    n = findRunning(message["hash"])
+                    if n is not None and running[n]["agent"] == agent:
+                        print("job {} was handed back by {} and is requeued".format(n, agent))
+                        requeueCommand(n, front=True)
+                        wakeScheduler()
+        except (ConnectionError, OSError, ValueError, KeyError) as e:
+            print("agent {} disconnected: {}".format(agent, e))
+        finally:
+            writer.close()
+            if agent is not None:
+                del agents[agent]
+                for running_job in running.values():
+                    if running_job["agent"] == agent and not running_job["task"].done():
+                        running_job["orphaned_at"] = time.time()
+                wakeScheduler()
+
+    # listen for worker agents
+    server = None
+    if listen:
+        host, port = listen.rsplit(":", 1)
+        server = await asyncio.start_server(handleAgent, host, int(port))
+        print("listening for worker agents on {}".format(listen))
+
+    try:
+        last_status = time.time()
+        while pending or running:
+            # raise or lower the number of local commands with the system load and free memory
+            if adaptive is not None and time.time() >= last_adapt + adaptive["interval"]:
+                last_adapt = time.time()
+                new_limit = adjustConcurrency(limit, adaptive["min_threads"], n_threads, adaptive["max_load"], adaptive["min_free_mem_gb"])
+                if new_limit != limit:
+                    print("running up to {} commands at the same time (was {})".format(new_limit, limit))
+                    limit = new_limit
+
+            # fill up any free local slots with the first pending commands that fit
+            for command in list(pending):
+                if n_threads - len(state["free_slots"]) >= limit:
+                    break
+                n, command_hash, required = command
+                allocated = allocateResources(state, required)
+                if allocated is None:
+                    if not state["free_slots"]:
+                        break
+                    continue
+                pending.remove(command)
+                slot, gpu_slots, cores = allocated
+                entry = startEntry(n, command, "local")
+                log_filename = os.path.join(log_dir, "job{}_{}.log".format(n, command_hash[:8]))
+                progress = {}
+                usage = {}
+                task = asyncio.ensure_future(superviseCommand(entry["command"], makeJobEnv(slot, gpu_slots), log_filename, progress, progress_pattern, n_epochs,
+                    usage, cores, niceness))
+                running[n] = {"task": task, "command": command, "host": "local", "agent": None, "orphaned_at": None,
+                    "slot": slot, "gpu_slots": gpu_slots, "cores": cores, "start": entry["start"], "progress": progress, "usage": usage,
+                    "log": log_filename}
+                print("job {} started at {} in slot {} (attempt {}); logging to {}".format(
+                    n, formatTime(entry["start"]), slot, entry["attempts"], log_filename))
+
+            # wait for a command to finish, an agent to report, or for the next status update
+            timeout = last_status + status_interval - time.time()
+            if adaptive is not None:
+                timeout = min(timeout, last_adapt + adaptive["interval"] - time.time())
+            await asyncio.wait([job["task"] for job in running.values()] + [wakeup[0]],
+                timeout=max(0, timeout), return_when=asyncio.FIRST_COMPLETED)
+            if wakeup[0].done():
+                wakeup[0] = asyncio.get_running_loop().create_future()
+            if time.time() >= last_status + status_interval:
+                last_status = time.time()
+                printProgressTable(running, len(pending), last_status)
+
+            # requeue the commands of agents that did not reconnect in time
+            for n, running_job in list(running.items()):
+                if (running_job["orphaned_at"] is not None and not running_job["task"].done()
+                        and time.time() - running_job["orphaned_at"] >= reconnect_grace):
+                    print("job {} on {} was lost and is requeued".format(n, running_job["host"]))
+                    requeueCommand(n)
+
+            # collect the finished commands
+            for n, running_job in list(running.items()):
+                if not running_job["task"].done():
+                    continue
+                try:
+                    returncode = running_job["task"].result()
+                except OSError as e:
+                    print("job {} could not be started: {}".format(n, e))
+                    returncode = -1
+                except Exception as e:
+                    print("job {} failed in the supervisor: {!r}".format(n, e))
+                    returncode = -1
+                _, command_hash, required = running_job["command"]
+                entry = ledger[command_hash]
+                entry.update({"status": "finished" if returncode == 0 else "failed", "returncode": returncode,
+                    "start": running_job["start"], "end": time.time()})
+                job = dict(entry, job=n, slot=running_job["slot"],
+                    gpu_slots=",".join(str(g) for g in running_job["gpu_slots"]), log=running_job["log"])
+                job.update(getProgressRates(running_job["progress"], entry["end"]))
+                job.update({"cores": ",".join(str(c) for c in running_job.get("cores", [])),
+                    "cpu_s": running_job.get("usage", {}).get("cpu_s", np.nan)})
+                if "remote" in running_job:
+                    entry["end"] = running_job["remote"]["end"]
+                    job.update({"end": entry["end"], "epoch": running_job["remote"].get("epoch"),
+                        "epochs_per_s": running_job["remote"].get("epochs_per_s"), "cores": running_job["remote"].get("cores", ""),
+                        "cpu_s": running_job["remote"].get("cpu_s") if running_job["remote"].get("cpu_s") is not None else np.nan})
+                job["duration"] = entry["end"] - entry["start"]
+                job["cpu_util"] = job["cpu_s"] / job["duration"] if job["duration"] > 0 else np.nan
+                jobs.append(job)
+                print("job {} ended at {} on {} after {:.1f}s with exit code {}".format(
+                    n, formatTime(job["end"]), running_job["host"], job["duration"], returncode))
+
+                # release the resources
+                del running[n]
+                if running_job["host"] == "local":
+                    releaseResources(state, required, running_job["slot"], running_job["gpu_slots"], running_job["cores"])
+
+                # retry failed commands at the end of the queue
+                if returncode != 0 and entry["attempts"] < max_attempts:
+                    pending.append(running_job["command"])
+                writeLedger(ledger_filename, ledger)
+    finally:
+        if server is not None:
+            # tell the connected agents that the sweep is done
+            server.close()
+            linger = time.time() + 2 * AGENT_WAIT_INTERVAL
+            while agents and time.time() < linger:
+                await asyncio.sleep(0.1)
+            for writer in list(agents.values()):
+                writer.close()
+    jobs.sort(key=lambda job: (job["job"], job["attempts"]))
+    return jobs
+
+def runCommands(commands, n_threads, ledger, ledger_filename, max_attempts=1, pool=None, log_dir="logs",
+        progress_pattern=PROGRESS_PATTERN, n_epochs=None, status_interval=60.0, listen=None, token=None, reconnect_grace=60.0,
+        pin_cores=None, niceness=0, adaptive=None):
+    """Run the commands in parallel with at most n_threads running at any one time.
+    As soon as a running command finishes the next pending command is started,
+    so a single long running command does not hold up the remaining slots.
+    When a resource pool is given the pending commands are packed first-fit, in order,
+    into the free resources, so a smaller command may start ahead of a larger one
+    that does not fit yet.  Each command gets its slot id in the EVONET_SLOT
+    environment variable and the ids of its GPU slots in EVONET_GPU_SLOTS.
+    The status of each command is recorded in the ledger which is written to disk
+    every time a command starts or ends.
+
+    The commands are supervised with asyncio: the stdout and stderr of each command are
+    streamed into its own rotating log file in log_dir, and lines matching progress_pattern
+    are parsed as they arrive to print a table of the epochs per second and the
+    estimated time remaining of each running command every status_interval seconds.
+
+    When listen is given as 'host:port' the pending commands are also handed out over TCP
+    to worker agents (see LaunchMultiCmdAgent.py) that report the exit code and timing of
+    each command back into the ledger.  The commands of an agent that drops its connection
+    are requeued unless the agent reconnects within reconnect_grace seconds; an agent that reconnects
+    is told to stop the commands that were handed to someone else in the meantime.
+
+    When pin_cores is given each local command is pinned to its own set of cores (its cpu_cores
+    rounded up, or pin_cores when it does not require any) so that multithreaded commands do not
+    compete for the same cores, and a command only starts when enough cores are free.  When adaptive
+    is given the number of local commands starts at adaptive['min_threads'] and is raised or lowered
+    by one every adaptive['interval'] seconds, up to n_threads, depending on whether the 1 minute load
+    average per core is above adaptive['max_load'] or the free memory is below adaptive['min_free_mem_gb'].
+    The CPU time of each command and its children is sampled while it runs.
+
+    Args:
+        commands: list of (job number, command hash, required resources) tuples to run
+        n_threads: the maximum number of commands to run at the same time on this host
+        ledger: dict of command hash to ledger entry
+        ledger_filename: name of the ledger file
+        max_attempts: the maximum number of times to attempt a failed command
+        pool: dict of resource name to the amount in the pool; None means the resource is not limited
+        log_dir: directory of the job log files
+        progress_pattern: regular expression with the epoch as the first group and
+            optionally the total number of epochs as the second group
+        n_epochs: the total number of epochs used for the estimated time remaining
+            when it is not part of the output
+        status_interval: seconds between printing the progress table
+        listen: 'host:port' to listen on for worker agents; None to only run commands on this host
+        token: shared secret that worker agents must send to connect
+        reconnect_grace: seconds to wait for a dropped agent to reconnect before requeueing its commands
+        pin_cores: the number of cores to pin each command to that does not require cpu_cores; None to not pin the commands
+        niceness: increment of the niceness of each command
+        adaptive: dict with 'min_threads','max_load','min_free_mem_gb','interval' to adapt the number
+            of local commands to the system load; None to always run up to n_threads commands
+
+    Returns:
+        list of dicts with 'job','hash','command','host','start','end','duration','returncode','attempts',
+        'slot','gpu_slots','cores','log','epoch','epochs_per_s','cpu_s','cpu_util' for each attempt
+    """
+    try:
+        return asyncio.run(runCommandsAsync(commands, n_threads, ledger, ledger_filename, max_attempts, pool, log_dir,
+            progress_pattern, n_epochs, status_interval, listen, token, reconnect_grace, pin_cores, niceness, adaptive))
+    except KeyboardInterrupt:
+        for n, command_hash, required in commands:
+            if ledger[command_hash]["status"] == "running":
+                ledger[command_hash]["status"] = "interrupted"
+        writeLedger(ledger_filename, ledger)
+        raise
+
+def estimateWaveTime(durations, n_threads):
+    """Estimate the wall-clock time the same commands would have taken when run
+    in waves of n_threads that each wait for their slowest command to finish
+
+    Args:
+        durations: list of the run time of each command in the order they were submitted
+        n_threads: the number of commands in each wave
+
+    Returns:
+        the estimated wall-clock time in seconds
+    """
+    return sum(max(durations[i:i + n_threads]) for i in range(0, len(durations), n_threads))
+
+def main(data_dir, filename, n_threads=None, max_attempts=1, pool=None, progress_pattern=PROGRESS_PATTERN, n_epochs=None, status_interval=60.0,
+        listen=None, token=None, reconnect_grace=60.0, pin_cores=None, niceness=0, adaptive=None):
     """Run main script"""
 
     # read in the input files
-    commands = readCommandsCsv(filename)
+    commands, resources = readCommandsCsv(filename)
+    if n_threads is None:
+        n_threads = os.cpu_count()
+    if n_threads < 1 and not listen:
+        raise ValueError("At least one thread is needed to run the commands without agents.")
+
+    # skip the commands that were already run in a previous sweep
+    ledger_filename = getLedgerFilename(filename)
+    ledger = readLedger(ledger_filename)
+    commands_to_run = selectCommands(commands, resources, ledger, max_attempts)
+    writeLedger(ledger_filename, ledger)
+    if pool is not None and not listen:
+        checkResources(commands_to_run, pool)
+    if pin_cores and not listen:
+        n_cores = len(getAvailableCores())
+        for n, command_hash, required in commands_to_run:
+            if (int(np.ceil(required["cpu_cores"])) or pin_cores) > n_cores:
+                raise ValueError("Command {} can not be pinned to more than the {} available cores.".format(n, n_cores))
 
     # Run in parallel
-    n_threads = 16 #28 16
-    thread_count = 0
-    commands_to_run = []
-    for command in commands:
-        if thread_count < n_threads:
-            commands_to_run.append(command)
-            thread_count += 1
-        if thread_count >= n_threads or command == commands[-1]:
-            DETACHED_PROCESS = 0x00000008
-            procs = [ Popen(i, creationflags=DETACHED_PROCESS, shell=True) for i in commands_to_run ]
-            for p in procs:
-                p.wait()
-            commands_to_run = []
-            thread_count = 0
+    print("Running {} of {} commands on {} threads...".format(len(commands_to_run), len(commands), n_threads))
+    start = time.time()
+    log_dir = os.path.splitext(filename)[0] + "_logs"
+    jobs = runCommands(commands_to_run, n_threads, ledger, ledger_filename, max_attempts, pool, log_dir,
+        progress_pattern, n_epochs, status_interval, listen, token, reconnect_grace, pin_cores, niceness, adaptive)
+    wall_time = time.time() - start
+
+    # report the timings
+    if jobs:
+        jobs_df = pd.DataFrame(jobs, columns=["job", "attempts", "host", "slot", "gpu_slots", "start", "end", "duration", "returncode", "epoch", "epochs_per_s",
+            "cores", "cpu_s", "cpu_util"])
+        print(jobs_df.to_string(index=False, formatters={
+            "start": formatTime, "end": formatTime, "cpu_util": "{:.2f}".format}))
+        print("wall-clock: {:.1f}s; sum of job times: {:.1f}s".format(wall_time, jobs_df["duration"].sum()))
+        if n_threads > 0 and not listen:
+            print("estimated time in waves of {}: {:.1f}s".format(n_threads, estimateWaveTime(list(jobs_df["duration"]), n_threads)))
+    n_failed = sum(ledger[h]["status"] == "failed" for _, h, _ in commands_to_run)
+    if n_failed:
+        print("{} commands failed; see {}".format(n_failed, ledger_filename))
 
 # Run main
 if __name__ == "__main__":
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-f", "--filename", dest="filename", help = "Input commands csv")
+    parser.add_argument("-n", "--threads", type=int, dest="n_threads", help = "Number of commands to run at the same time; default = number of cores")
+    parser.add_argument("-r", "--attempts", type=int, default=1, dest="max_attempts", help = "Maximum number of times to attempt a failed command, including previous sweeps; default = 1")
+    parser.add_argument("--gpu-slots", type=int, dest="gpu_slots", help = "Number of GPU slots in the resource pool; default = not limited")
+    parser.add_argument("--cpu-cores", type=float, dest="cpu_cores", help = "Number of CPU cores in the resource pool; default = not limited")
+    parser.add_argument("--mem-gb", type=float, dest="mem_gb", help = "Memory in GB in the resource pool; default = not limited")
+    parser.add_argument("--progress-pattern", default=PROGRESS_PATTERN, dest="progress_pattern", help = "Regular expression matching the epoch (first group) and optionally the total epochs (second group) in the job output")
+    parser.add_argument("--epochs", type=int, dest="n_epochs", help = "Total number of epochs of each job used to estimate the time remaining")
+    parser.add_argument("--status-interval", type=float, default=60.0, dest="status_interval", help = "Seconds between printing the progress table; default = 60")
+    parser.add_argument("--listen", dest="listen", help = "host:port to hand out commands to worker agents on; use -n 0 to only run commands on the agents")
+    parser.add_argument("--token", dest="token", help = "Shared secret that worker agents must send to connect")
+    parser.add_argument("--reconnect-grace", type=float, default=60.0, dest="reconnect_grace", help = "Seconds to wait for a dropped agent to reconnect before requeueing its commands; default = 60")
+    parser.add_argument("--pin-cores", type=int, dest="pin_cores", help = "Pin each command to its own set of cores: its cpu_cores, or this many cores when it does not require any; default = no pinning")
+    parser.add_argument("--nice", type=int, default=0, dest="niceness", help = "Niceness increment of each command; default = 0")
+    parser.add_argument("--adaptive", action="store_true", dest="adaptive", help = "Raise or lower the number of commands between --min-threads and -n with the system load and free memory")
+    parser.add_argument("--min-threads", type=int, default=1, dest="min_threads", help = "Lower bound of the number of commands in adaptive mode; default = 1")
+    parser.add_argument("--max-load", type=float, default=1.0, dest="max_load", help = "1 minute load average per core above which adaptive mode runs fewer commands; default = 1.0")
+    parser.add_argument("--min-free-mem-gb", type=float, default=2.0, dest="min_free_mem_gb", help = "Free memory in GB below which adaptive mode runs fewer commands; default = 2")
+    parser.add_argument("--adapt-interval", type=float, default=30.0, dest="adapt_interval", help = "Seconds between adapting the number of commands; default = 30")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+
     # Input files
     data_dir = ""
     filename = data_dir + "CommandsToRun.csv"
-    main(data_dir, filename)
\ No newline at end of file
+    if args.filename:
+        filename = args.filename
+    pool = {column: getattr(args, column) for column in RESOURCE_COLUMNS}
+    adaptive = None
+    if args.adaptive:
+        adaptive = {"min_threads": args.min_threads, "max_load": args.max_load, "min_free_mem_gb": args.min_free_mem_gb,
+            "interval": args.adapt_interval}
+    main(data_dir, filename, args.n_threads, args.max_attempts, pool, args.progress_pattern, args.n_epochs, args.status_interval,
+        args.listen, args.token, args.reconnect_grace, args.pin_cores, args.niceness, adaptive)
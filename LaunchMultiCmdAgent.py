@@ -0,0 +1,180 @@
+import os, re, time, socket, argparse, asyncio
+from LaunchMultiCmd import (RESOURCE_COLUMNS, PROGRESS_PATTERN, makePoolState, allocateResources, releaseResources,
+    makeJobEnv, sendMessage, readMessage, superviseCommand, getProgressRates, formatTime)
+
+async def runAgent(host, port, n_threads, pool, log_dir, token=None, progress_pattern=PROGRESS_PATTERN, n_epochs=None, retry_interval=5.0,
+        idle_timeout=3600.0, pin_cores=None, niceness=0):
+    """Pull commands from a LaunchMultiCmd coordinator, run them, and report their exit code and timing back.
+    The agent reconnects after the connection drops and reports the commands it is still running
+    or has not reported yet so that the coordinator does not hand them out again.  Results that could
+    not be reported are sent again after reconnecting, and the commands that the coordinator handed
+    to someone else in the meantime are stopped together with the processes they started.  A command that does
+    not fit into the free resources of the agent is handed back to the coordinator.  The agent stops when the coordinator has no more commands,
+    or when it has nothing left to report and could not reach the coordinator for idle_timeout seconds.
+
+    Args:
+        host: host name of the coordinator
+        port: port of the coordinator
+        n_threads: the maximum number of commands to run at the same time
+        pool: dict of resource name to the amount in the pool of this host; None means the resource is not limited
+        log_dir: directory of the job log files
+        token: shared secret of the coordinator
+        progress_pattern: regular expression with the epoch as the first group and
+            optionally the total number of epochs as the second group
+        n_epochs: the total number of epochs when it is not part of the output
+        retry_interval: seconds to wait before reconnecting
+        idle_timeout: seconds without a connection after which an agent with nothing left to report stops
+        pin_cores: the number of cores to pin each command to that does not require cpu_cores; None to not pin the commands
+        niceness: increment of the niceness of each command
+    """
+    state = makePoolState(pool, n_threads, pin_cores)
+    progress_pattern = re.compile(progress_pattern)
+    os.makedirs(log_dir, exist_ok=True)
+    running = {}
+    results = {}
+    finished = False
+    disconnected_at = None
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            if disconnected_at is None:
+                print("could not connect to {}:{}: {}; retrying every {}s".format(host, port, e, retry_interval))
+                disconnected_at = time.time()
+            if not running and not results and time.time() - disconnected_at >= idle_timeout:
+                print("giving up after {:.0f}s without a connection".format(time.time() - disconnected_at))
+                return
+            await asyncio.sleep(retry_interval)
+            continue
+        disconnected_at = None
+        try:
+            await sendMessage(writer, {"type": "hello", "host": socket.gethostname(), "token": token, "running": list(running) + list(results)})
+            reply = await readMessage(reader)
+            if reply["type"] == "error":
+                print("coordinator refused the connection: {}".format(reply["message"]))
+                return
+            print("connected to {}:{}".format(host, port))
+
+            # stop the commands that the coordinator handed to someone else while the connection was down
+            for command_hash in reply.get("kill", []):
+                results.pop(command_hash, None)
+                job = running.pop(command_hash, None)
+                if job is not None:
+                    # the resources are only handed out again once the process group of the command has been stopped
+                    job["task"].cancel()
+                    await asyncio.gather(job["task"], return_exceptions=True)
+                    releaseResources(state, job["required"], job["slot"], job["gpu_slots"], job["cores"])
+                    print("job {} was reassigned by the coordinator and is stopped".format(job["job"]))
+
+            while True:
+                # collect the finished commands
+                for command_hash, job in list(running.items()):
+                    if not job["task"].done():
+                        continue
+                    try:
+                        returncode = job["task"].result()
+                    except OSError as e:
+                        print("job {} could not be started: {}".format(job["job"], e))
+                        returncode = -1
+                    except Exception as e:
+                        print("job {} failed in the supervisor: {!r}".format(job["job"], e))
+                        returncode = -1
+                    end = time.time()
+                    rates = getProgressRates(job["progress"], end)
+                    results[command_hash] = {"type": "result", "hash": command_hash, "returncode": returncode,
+                        "start": job["start"], "end": end, "epoch": rates["epoch"], "epochs_per_s": rates["epochs_per_s"],
+                        "cores": ",".join(str(c) for c in job["cores"]), "cpu_s": job["usage"].get("cpu_s")}
+                    releaseResources(state, job["required"], job["slot"], job["gpu_slots"], job["cores"])
+                    del running[command_hash]
+                    print("job {} ended at {} after {:.1f}s with exit code {}".format(job["job"], formatTime(end), end - job["start"], returncode))
+
+                # report the results
+                for command_hash, result in list(results.items()):
+                    await sendMessage(writer, result)
+                    await readMessage(reader)
+                    del results[command_hash]
+
+                # ask for another command when there is a free slot
+                wait = retry_interval
+                free = dict(state["free"])
+                if pin_cores:
+                    # only offer the cores that are not pinned yet
+                    free["cpu_cores"] = len(state["free_cores"]) if free["cpu_cores"] is None else min(free["cpu_cores"], len(state["free_cores"]))
+                if state["free_slots"] and (not pin_cores or len(state["free_cores"]) >= pin_cores) and not finished:
+                    await sendMessage(writer, {"type": "request", "free": free})
+                    reply = await readMessage(reader)
+                    if reply["type"] == "job":
+                        required = {column: reply["required"][column] for column in RESOURCE_COLUMNS}
+                        required["gpu_slots"] = int(required["gpu_slots"])
+                        allocated = allocateResources(state, required)
+                        if allocated is None:
+                            # e.g. the cores to pin the command to are taken, so hand it back and wait before asking again
+                            print("job {} does not fit into the free resources and is handed back".format(reply["job"]))
+                            await sendMessage(writer, {"type": "reject", "hash": reply["hash"]})
+                            await readMessage(reader)
+                        else:
+                            slot, gpu_slots, cores = allocated
+                            log_filename = os.path.join(log_dir, "job{}_{}.log".format(reply["job"], reply["hash"][:8]))
+                            progress = {}
+                            usage = {}
+                            task = asyncio.ensure_future(superviseCommand(reply["command"], makeJobEnv(slot, gpu_slots), log_filename, progress, progress_pattern, n_epochs,
+                                usage, cores, niceness))
+                            running[reply["hash"]] = {"task": task, "job": reply["job"], "required": required, "slot": slot,
+                                "gpu_slots": gpu_slots, "cores": cores, "start": time.time(), "progress": progress, "usage": usage}
+                            print("job {} started at {} in slot {}; logging to {}".format(reply["job"], formatTime(time.time()), slot, log_filename))
+                            continue
+                    elif reply["type"] == "wait":
+                        wait = reply["seconds"]
+                    elif reply["type"] == "done":
+                        finished = True
+                if finished and not running and not results:
+                    print("no more commands to run")
+                    writer.close()
+                    return
+
+                # wait for a command to finish before asking again
+                tasks = [job["task"] for job in running.values()]
+                if tasks:
+                    await asyncio.wait(tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(wait)
+        except (ConnectionError, OSError, ValueError) as e:
+            print("lost the connection to {}:{}: {}".format(host, port, e))
+            writer.close()
+            await asyncio.sleep(retry_interval)
+
+def main(coordinator, n_threads=None, pool=None, log_dir="LaunchMultiCmdAgent_logs", token=None, progress_pattern=PROGRESS_PATTERN, n_epochs=None, retry_interval=5.0,
+        idle_timeout=3600.0, pin_cores=None, niceness=0):
+    """Run main script"""
+    if n_threads is None:
+        n_threads = os.cpu_count()
+    host, port = coordinator.rsplit(":", 1)
+    asyncio.run(runAgent(host, int(port), n_threads, pool, log_dir, token, progress_pattern, n_epochs, retry_interval, idle_timeout,
+        pin_cores, niceness))
+
+# Run main
+if __name__ == "__main__":
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-c", "--coordinator", dest="coordinator", required=True, help = "host:port of the LaunchMultiCmd coordinator")
+    parser.add_argument("-n", "--threads", type=int, dest="n_threads", help = "Number of commands to run at the same time; default = number of cores")
+    parser.add_argument("--gpu-slots", type=int, dest="gpu_slots", help = "Number of GPU slots in the resource pool; default = not limited")
+    parser.add_argument("--cpu-cores", type=float, dest="cpu_cores", help = "Number of CPU cores in the resource pool; default = not limited")
+    parser.add_argument("--mem-gb", type=float, dest="mem_gb", help = "Memory in GB in the resource pool; default = not limited")
+    parser.add_argument("--log-dir", default="LaunchMultiCmdAgent_logs", dest="log_dir", help = "Directory of the job log files")
+    parser.add_argument("--token", dest="token", help = "Shared secret of the coordinator")
+    parser.add_argument("--progress-pattern", default=PROGRESS_PATTERN, dest="progress_pattern", help = "Regular expression matching the epoch (first group) and optionally the total epochs (second group) in the job output")
+    parser.add_argument("--epochs", type=int, dest="n_epochs", help = "Total number of epochs of each job used to estimate the time remaining")
+    parser.add_argument("--retry-interval", type=float, default=5.0, dest="retry_interval", help = "Seconds to wait before reconnecting to the coordinator; default = 5")
+    parser.add_argument("--idle-timeout", type=float, default=3600.0, dest="idle_timeout", help = "Seconds without a connection after which an idle agent stops; default = 3600")
+    parser.add_argument("--pin-cores", type=int, dest="pin_cores", help = "Pin each command to its own set of cores: its cpu_cores, or this many cores when it does not require any; default = no pinning")
+    parser.add_argument("--nice", type=int, default=0, dest="niceness", help = "Niceness increment of each command; default = 0")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    pool = {column: getattr(args, column) for column in RESOURCE_COLUMNS}
+    main(args.coordinator, args.n_threads, pool, args.log_dir, args.token, args.progress_pattern, args.n_epochs, args.retry_interval,
+        args.idle_timeout, args.pin_cores, args.niceness)
@@ -1,24 +1,7 @@
 from matplotlib import pyplot as plt
 import numpy as np
-import csv
-import sys
+from EvoNetColumns import readTensor
                    
-def read_csv(filename, delimiter=','):
-    """read table data from csv file"""
-    data = []
-    try:
-        with open(filename, 'r') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=delimiter)
-            try:
-                keys = reader.fieldnames
-                for row in reader:
-                    data.append(row)
-            except csv.Error as e:
-                sys.exit('file %s, line %d: %s' % (filename, reader.line_num, e))
-    except IOError as e:
-        sys.exit('%s does not exist' % e) 
-    return data
-
 def plotExpectedPredicted(input, output, expected, label, fig, axes):
     """Generate a side by side plot of expected and predicted
 
@@ -48,27 +31,33 @@ def plotExpectedPredicted(input, output, expected, label, fig, axes):
         axes[batch,2] .set_title('Digit Label: {}'.format(label))
         axes[batch,2] .set_xbound([0,28])
 
-def main(filename_input, filename_output, filename_expected, input_headers, output_headers, expected_headers):
-    """Run main script"""
+def main(filename_input, filename_output, filename_expected, batches, n_pixels=784, epochs=None, index_name="Epoch"):
+    """Run main script
+
+    When epochs is given only the rows of those epochs are read, using the epoch index of each file.
+    """
 
-    # read in the data
-    input_data = read_csv(filename_input)
-    output_data = read_csv(filename_output)
-    expected_data = read_csv(filename_expected)
+    # read in the pixels of each batch as (epochs, pixels, batches, memory) arrays
+    first_row = 25
+    if epochs is not None:
+        first_row = 0
+    input_epochs, input_data, input_axes = readTensor(filename_input, "Input", "Input", index_name, range(n_pixels), batches, [0], epochs)
+    output_epochs, output_data, output_axes = readTensor(filename_output, "Output", "Output", index_name, range(n_pixels), batches, [0], epochs)
+    expected_epochs, expected_data, expected_axes = readTensor(filename_expected, "Output", "Expected", index_name, range(n_pixels), batches, [0], epochs)
     assert(len(input_data) == len(output_data) == len(expected_data))
-    assert(len(input_headers[0]) == len(output_headers[0]) == len(expected_headers[0]))
-    n_batches = len(input_headers)
+    assert(input_data.shape[1:] == output_data.shape[1:] == expected_data.shape[1:])
+    n_batches = input_data.shape[2]
     n_data = len(input_data)
     
     # parse each data row
-    for n in range(25, n_data):
+    for n in range(first_row, n_data):
         input = []
         expected = []
         output = []
         for batch in range(0, n_batches):
-            input.append(np.array([input_data[n][h] for h in input_headers[batch]]).astype(np.float))
-            expected.append(np.array([expected_data[n][h] for h in expected_headers[batch]]).astype(np.float))
-            output.append(np.array([output_data[n][h] for h in output_headers[batch]]).astype(np.float))
+            input.append(input_data[n, :, batch, 0].astype(float))
+            expected.append(expected_data[n, :, batch, 0].astype(float))
+            output.append(output_data[n, :, batch, 0].astype(float))
 
         fig, axes = plt.subplots(n_batches,3, 
             figsize=(10,10),
@@ -95,11 +84,6 @@ if __name__ == "__main__":
     filename_input = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu7-3a/VAE_NodeInputsPerEpoch.csv"
     filename_expected = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu7-3a/VAE_ExpectedPerEpoch.csv"
     filename_output = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu7-3a/VAE_NodeOutputsPerEpoch.csv"
-    input_headers = []
-    output_headers = []
-    expected_headers = []
-    for batch in range(0, 4):
-        input_headers.append(["Input_{:012d}_Input_Batch-{}_Memory-0".format(i, batch) for i in range(784)])
-        output_headers.append(["Output_{:012d}_Output_Batch-{}_Memory-0".format(i, batch) for i in range(784)])
-        expected_headers.append(["Output_{:012d}_Expected_Batch-{}_Memory-0".format(i, batch) for i in range(784)])
-    main(filename_input, filename_output, filename_expected, input_headers, output_headers, expected_headers)
\ No newline at end of file
+    batches = list(range(0, 4))
+    epochs = None # e.g. [100, 1000] to read only the rows of these epochs
+    main(filename_input, filename_output, filename_expected, batches, 784, epochs)
\ No newline at end of file
@@ -1,24 +1,7 @@
 from matplotlib import pyplot as plt
 import numpy as np
-import csv
-import sys
+from EvoNetColumns import readTensor
                    
-def read_csv(filename, delimiter=','):
-    """read table data from csv file"""
-    data = []
-    try:
-        with open(filename, 'r') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=delimiter)
-            try:
-                keys = reader.fieldnames
-                for row in reader:
-                    data.append(row)
-            except csv.Error as e:
-                sys.exit('file %s, line %d: %s' % (filename, reader.line_num, e))
-    except IOError as e:
-        sys.exit('%s does not exist' % e) 
-    return data
-
 def plotLatentTraversal(input, output, dimension, fig, axes):
     """Generate a plot of the latent traversals with the batch samples across
         the top axis and the dimensions along the side axis
@@ -40,15 +23,17 @@ def plotLatentTraversal(input, output, dimension, fig, axes):
         axes[dimension,batch].set_axis_off();
         axes[dimension,batch].set_frame_on(False)
 
-def main(filename_input, filename_output, input_headers, output_headers):
-    """Run main script"""
+def main(filename_input, filename_output, input_node, batches, n_dimensions=8, n_pixels=784, epochs=None, index_name="Epoch"):
+    """Run main script
+
+    When epochs is given only the rows of those epochs are read, using the epoch index of each file.
+    """
 
-    # read in the data
-    input_data = read_csv(filename_input)
-    output_data = read_csv(filename_output)
+    # read in the latent values and pixels of each batch as (epochs, nodes, batches, memory) arrays
+    input_epochs, input_data, input_axes = readTensor(filename_input, input_node, "Input", index_name, range(n_dimensions), batches, [0], epochs)
+    output_epochs, output_data, output_axes = readTensor(filename_output, "Output", "Output", index_name, range(n_pixels), batches, [0], epochs)
     assert(len(input_data) == len(output_data))
-    n_batches = len(input_headers)
-    n_dimensions = len(input_headers[0]);
+    n_batches = input_data.shape[2]
     n_data = len(input_data)
     
     # parse each data row
@@ -61,8 +46,8 @@ def main(filename_input, filename_output, input_headers, output_headers):
         input = []
         output = []
         for batch in range(0, n_batches):
-            input.append(np.array([input_data[n][h] for h in input_headers[batch]]).astype(np.float))
-            output.append(np.array([output_data[n][h] for h in output_headers[batch]]).astype(np.float))
+            input.append(input_data[n, :, batch, 0].astype(float))
+            output.append(output_data[n, :, batch, 0].astype(float))
 
         plotLatentTraversal(input, output, dimension, fig, axes)
 
@@ -83,10 +68,8 @@ if __name__ == "__main__":
     filename_output = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu0-2c/CVAEDecoder_NodeOutputsPerEpoch.csv"
     # filename_input = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu3-0a/CVAEDecoder_NodeInputsPerEpoch.csv"
     # filename_output = "C:/Users/dmccloskey/Documents/GitHub/EvoNetData/MNIST_examples/CVAE/Gpu3-0a/CVAEDecoder_NodeOutputsPerEpoch.csv"
-    input_headers = []
-    output_headers = []
-    for batch in range(0, 8):
-        input_headers.append(["Gaussian_encoding_{:012d}_Input_Batch-{}_Memory-0".format(i, batch) for i in range(8)])
-        #input_headers.append(["Categorical_encoding-SoftMax-Out_{:012d}_Input_Batch-{}_Memory-0".format(i, batch) for i in range(8)])
-        output_headers.append(["Output_{:012d}_Output_Batch-{}_Memory-0".format(i, batch) for i in range(784)])
-    main(filename_input, filename_output, input_headers, output_headers)
\ No newline at end of file
+    input_node = "Gaussian_encoding"
+    #input_node = "Categorical_encoding-SoftMax-Out"
+    batches = list(range(0, 8))
+    epochs = None # e.g. [100, 1000] to read only the rows of these epochs
+    main(filename_input, filename_output, input_node, batches, 8, 784, epochs)
\ No newline at end of file
@@ -1,58 +1,383 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import io
 import glob
+import time
+import argparse
+import concurrent.futures
 
-def main(dirs_filename, data_filename, epoch_precision, index_name):
-    """Run main script"""
+def readHeader(filename):
+    """Read the column names of a csv file without reading its data
 
-    # read in the input files
-    dirs = pd.read_csv(dirs_filename)    
-    dirs = dirs[dirs["used_"] == True]
-    filenames = pd.read_csv(data_filename)    
-    filenames = filenames[filenames["used_"] == True]
+    Args:
+        filename: name of the csv file
 
-    # merge each file according to date
-    for dir_iter, dir in dirs.iterrows():
-        for row_iter, row in filenames.iterrows():
+    Returns:
+        list of column names
+    """
+    return pd.read_csv(filename, nrows=0).columns.tolist()
+
+def readLastEpoch(filename, index_name, block_size=65536):
+    """Read the epoch of the last row of a csv file by reading backwards from the end of the file
+
+    Args:
+        filename: name of the csv file
+        index_name: name of the epoch column
+        block_size: number of bytes to read at a time
+
+    Returns:
+        the epoch of the last row as float32, or None when the file has no rows
+    """
+    with open(filename, "rb") as f:
+        header = f.readline()
+        data_start = f.tell()
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > data_start:
+            step = min(block_size, pos - data_start)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            lines = tail.rstrip(b"\r\n").rsplit(b"\n", 1)
+            if len(lines) > 1 or pos == data_start:
+                break
+    last_line = tail.rstrip(b"\r\n").rsplit(b"\n", 1)[-1]
+    if not last_line.strip():
+        return None
+    df = pd.read_csv(io.BytesIO(header + last_line + b"\n"), dtype=np.float32)
+    return df[index_name].to_numpy()[0]
+
+OUTPUT_FORMATS = ["csv", "parquet", "feather"]
+MANIFEST_COLUMNS = ["file", "size", "mtime_ns", "epoch_offset", "epoch_trim", "epoch_first", "epoch_last", "start_row", "n_rows", "start_byte", "end_byte"]
+
+def getManifestFilename(merged_filename):
+    """Make the name of the manifest file of a merged file"""
+    return os.path.splitext(merged_filename)[0] + "_manifest.csv"
+
+def readManifest(filename):
+    """Read the manifest of the fragments in a merged file
+
+    Args:
+        filename: name of the manifest file
+
+    Returns:
+        list of dicts with the MANIFEST_COLUMNS of each fragment, in merge order, or an empty list when there is no manifest
+        or it is not in the current format
+    """
+    if not os.path.exists(filename):
+        return []
+    manifest = pd.read_csv(filename, dtype={"file": str})
+    if manifest.columns.tolist() != MANIFEST_COLUMNS:
+        return []
+    # the mtime is compared exactly, so it is kept as integer nanoseconds
+    manifest = manifest.astype({"size": np.int64, "mtime_ns": np.int64})
+    return manifest.to_dict("records")
+
+def writeManifest(filename, manifest):
+    """Write the manifest of the fragments in a merged file
+
+    Args:
+        filename: name of the manifest file
+        manifest: list of dicts with the MANIFEST_COLUMNS of each fragment
+    """
+    tmp_filename = filename + ".tmp"
+    pd.DataFrame(manifest, columns=MANIFEST_COLUMNS).to_csv(tmp_filename, index=False)
+    os.replace(tmp_filename, filename)
+
+def readFragment(f, columns, epoch_trim, epoch_trim_cummulative, first, index_name, start_row, chunksize):
+    """Read, trim and offset the rows of a fragment in chunks
+
+    Args:
+        f: name of the fragment file
+        columns: the columns of the merged file
+        epoch_trim: the epoch to trim the fragment at; None to not trim the fragment
+        epoch_trim_cummulative: the epoch offset of the fragment
+        first: True for the first fragment, whose epochs are not offset
+        index_name: name of the epoch column
+        start_row: the index of the first row of the fragment in the merged file
+        chunksize: number of rows to read at a time
+
+    Yields:
+        DataFrame of each chunk of rows with the merged columns and row index
+    """
+    n_rows = 0
+    for df in pd.read_csv(f, dtype=np.float32, chunksize=chunksize):
+        df['file'] = f.split('/')[-1] # add in the filename to the dataframe
+        if epoch_trim is not None:
+            df = df[df[index_name]<=epoch_trim]
+
+        # update the epoch
+        if not first:
+            df[index_name] = df[index_name] + epoch_trim_cummulative
+
+        df = df.reindex(columns=columns)
+        df.index = pd.RangeIndex(start_row + n_rows, start_row + n_rows + len(df))
+        n_rows += len(df)
+        yield df
+
+def getOutputFilename(merged_filename, output_format):
+    """Make the name of the merged file in an output format"""
+    if output_format == "csv":
+        return merged_filename
+    return os.path.splitext(merged_filename)[0] + "." + output_format
+
+class BinaryWriter:
+    """Write chunks of rows to a Parquet or Feather file one row group or record batch at a time.
+    All columns except 'file' are written as float32.  Requires pyarrow."""
+
+    def __init__(self, filename, output_format, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(column, pa.string() if column == "file" else pa.float32()) for column in columns])
+        if output_format == "parquet":
+            self.writer = pq.ParquetWriter(filename, self.schema)
+        elif output_format == "feather":
+            self.writer = pa.ipc.new_file(filename, self.schema)
+        else:
+            raise ValueError("Unknown output format {}.".format(output_format))
+
+    def write(self, df):
+        if not len(df):
+            return
+        df = df.astype({column: np.float32 for column in self.columns if column != "file"})
+        self.writer.write_table(self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
 
-            # read and sort the filenames by date
-            all_files = glob.glob(os.path.join(dir["dirs"], row["filenames"]))
-            all_files.sort(key=os.path.getmtime)
-            all_df = []
+def mergeFiles(all_files, merged_filename, epoch_precision, index_name, chunksize=10000, force=False, output_formats=None):
+    """Merge the fragments of a restarted run into a single file.
+    Each fragment except the last is trimmed at the nearest epoch_precision below its last epoch,
+    and the epochs of each fragment after the first are offset by the trimmed epochs before it.
+    The fragments are read and written in chunks of rows, so the memory needed depends on
+    chunksize and not on the length of the run.  The output is the same as concatenating
+    all of the trimmed fragments with the columns sorted by name.
 
-            # parse and trim each of the files
-            epoch_trim_cummulative = 1
-            epoch_trim = 0
-            for f_iter, f in enumerate(all_files):
-                df = pd.read_csv(f, dtype=np.float32)
-                df['file'] = f.split('/')[-1] # add in the filename to the dataframe
+    The path, size, mtime in nanoseconds, trimmed epoch range and epoch offset of each merged fragment
+    are recorded in a manifest beside the merged file.  When the merged file is merged again
+    and the fragments in the manifest are unchanged, only the last merged fragment, which was
+    not trimmed yet, and the new fragments are written again; nothing is written when no
+    fragments were added.  Any other change merges all of the fragments again.
 
+    Besides csv the merged file can be written as Parquet or Feather beside the csv file,
+    with float32 columns and one row group or record batch per chunk in epoch order.
+    These are written again in full whenever any fragment is written.
+
+    Args:
+        all_files: list of the fragment filenames in the order to merge them
+        merged_filename: name of the merged output file
+        epoch_precision: the precision to trim the epochs of each fragment at
+        index_name: name of the epoch column
+        chunksize: number of rows to read at a time
+        force: True to merge all of the fragments again regardless of the manifest
+        output_formats: list of 'csv','parquet','feather' to write the merged file as; default = ['csv']
+
+    Returns:
+        the number of fragments that were written
+    """
+    if output_formats is None:
+        output_formats = ["csv"]
+
+    # the merged columns are the sorted union of the columns of all fragments
+    columns = set(["file"])
+    for f in all_files:
+        columns.update(readHeader(f))
+    columns = sorted(columns)
+
+    # keep the fragments of the manifest that are unchanged and were already trimmed
+    manifest_filename = getManifestFilename(merged_filename)
+    manifest = [] if force else readManifest(manifest_filename)
+    fragments = [{"file": f.split('/')[-1], "size": os.path.getsize(f), "mtime_ns": os.stat(f).st_mtime_ns} for f in all_files]
+    binary_formats = [output_format for output_format in output_formats if output_format != "csv"]
+    n_keep = 0
+    if (manifest and len(manifest) <= len(fragments)
+            and all(entry["file"] == fragment["file"] and entry["size"] == fragment["size"] and entry["mtime_ns"] == fragment["mtime_ns"]
+                for entry, fragment in zip(manifest, fragments))):
+        csv_current = ("csv" not in output_formats or (os.path.exists(merged_filename)
+            and os.path.getsize(merged_filename) == manifest[-1]["end_byte"]
+            and pd.read_csv(merged_filename, nrows=0, index_col=0).columns.tolist() == columns))
+        binary_current = all(os.path.exists(getOutputFilename(merged_filename, output_format))
+            and os.path.getmtime(getOutputFilename(merged_filename, output_format)) >= os.path.getmtime(manifest_filename)
+            for output_format in binary_formats)
+        if csv_current and binary_current and len(manifest) == len(fragments):
+            return 0
+        if csv_current and "csv" in output_formats:
+            n_keep = len(manifest) - 1
+    manifest = manifest[:n_keep]
+
+    # truncate the merged csv file after the kept fragments and append the remaining fragments
+    csv_file = None
+    if "csv" in output_formats and n_keep:
+        os.truncate(merged_filename, manifest[-1]["end_byte"])
+        csv_file = open(merged_filename, "a", newline="")
+    elif "csv" in output_formats:
+        csv_file = open(merged_filename + ".tmp", "w", newline="")
+
+    # the binary files are written in full
+    binary_writers = {output_format: BinaryWriter(getOutputFilename(merged_filename, output_format) + ".tmp", output_format, columns)
+        for output_format in binary_formats}
+    try:
+        epoch_trim_cummulative = 1
+        start_row = 0
+        for f_iter, f in enumerate(all_files):
+            if f_iter >= n_keep:
                 # trim at the nearest epoch_percent
+                epoch_trim = None
                 if f_iter < len(all_files) - 1:
-                    epoch_last = df.tail(1)[index_name].to_numpy()[0]
+                    epoch_last = readLastEpoch(f, index_name)
+                    if epoch_last is None:
+                        raise ValueError("{} has no rows to trim.".format(f))
                     epoch_trim = np.floor(epoch_last / epoch_precision) * epoch_precision
-                    df = df[df[index_name]<=epoch_trim]
+                entry = dict(fragments[f_iter], epoch_offset=epoch_trim_cummulative if f_iter != 0 else 0,
+                    epoch_trim=epoch_trim if epoch_trim is not None else 0, epoch_first=np.nan, epoch_last=np.nan,
+                    start_row=start_row, n_rows=0, start_byte=np.nan, end_byte=np.nan)
+            else:
+                entry = manifest[f_iter]
+                epoch_trim = entry["epoch_trim"] if f_iter < len(all_files) - 1 else None
+            if not binary_writers and f_iter < n_keep:
+                # only the csv file is written and it already has the rows of this fragment
+                epoch_trim_cummulative += entry["epoch_trim"]
+                start_row += entry["n_rows"]
+                continue
 
-                # update the epoch
-                if f_iter != 0:
-                    df[index_name] = df[index_name] + epoch_trim_cummulative
-
-                all_df.append(df)
+            # append to the merged files
+            write_csv = csv_file is not None and f_iter >= n_keep
+            if write_csv:
+                if f_iter == 0:
+                    pd.DataFrame(columns=columns).to_csv(csv_file)
+                csv_file.flush()
+                entry["start_byte"] = csv_file.tell()
+            for df in readFragment(f, columns, epoch_trim, epoch_trim_cummulative, f_iter == 0, index_name, start_row, chunksize):
+                if write_csv:
+                    df.to_csv(csv_file, header=False)
+                for writer in binary_writers.values():
+                    writer.write(df)
+                if f_iter >= n_keep and len(df):
+                    if entry["n_rows"] == 0:
+                        entry["epoch_first"] = df[index_name].iloc[0]
+                    entry["epoch_last"] = df[index_name].iloc[-1]
+                    entry["n_rows"] += len(df)
+            if write_csv:
+                csv_file.flush()
+                entry["end_byte"] = csv_file.tell()
+            if f_iter >= n_keep:
+                manifest.append(entry)
+            start_row += entry["n_rows"]
+            if epoch_trim is not None:
                 epoch_trim_cummulative += epoch_trim;
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+        for writer in binary_writers.values():
+            writer.close()
+    if csv_file is not None and not n_keep:
+        os.replace(merged_filename + ".tmp", merged_filename)
+    writeManifest(manifest_filename, manifest)
+    for output_format in binary_formats:
+        # the binary files are current when they are newer than the manifest
+        os.replace(getOutputFilename(merged_filename, output_format) + ".tmp", getOutputFilename(merged_filename, output_format))
+        os.utime(getOutputFilename(merged_filename, output_format))
+    return len(all_files) - n_keep
+
+def mergeDirFiles(dir, filenames, merged_name, epoch_precision, index_name, chunksize=10000, force=False, output_formats=None):
+    """Merge the fragments in a directory that match a filename pattern
+
+    Args:
+        dir: directory of the fragments
+        filenames: glob pattern of the fragment filenames
+        merged_name: filename of the merged file in dir
+        epoch_precision: the precision to trim the epochs of each fragment at
+        index_name: name of the epoch column
+        chunksize: number of rows to read at a time
+        force: True to merge all of the fragments again regardless of the manifest
+        output_formats: list of 'csv','parquet','feather' to write the merged file as; default = ['csv']
+
+    Returns:
+        the number of fragments that were written
+    """
+    if output_formats is None:
+        output_formats = ["csv"]
+
+    # read and sort the filenames by date
+    all_files = glob.glob(os.path.join(dir, filenames))
+    all_files.sort(key=os.path.getmtime)
+    if not all_files:
+        return 0
+
+    # parse, trim and write each of the new files
+    return mergeFiles(all_files, os.path.join(dir, merged_name), epoch_precision, index_name, chunksize, force, output_formats)
 
-            # concatenate and write to disk
-            merged_df = pd.concat(all_df, ignore_index=True, sort=True)
-            merged_df.to_csv(os.path.join(dir["dirs"], row["merged_names"]))
+def main(dirs_filename, data_filename, epoch_precision, index_name, chunksize=10000, force=False, n_jobs=1, output_formats=None):
+    """Run main script
+
+    Returns:
+        the exit status: 0 when every (dir, filenames) pair was merged, 1 when any of them failed
+    """
+    if output_formats is None:
+        output_formats = ["csv"]
+
+    # read in the input files
+    dirs = pd.read_csv(dirs_filename)
+    dirs = dirs[dirs["used_"] == True]
+    filenames = pd.read_csv(data_filename)
+    filenames = filenames[filenames["used_"] == True]
+
+    # merge each file according to date
+    pairs = [(dir["dirs"], row["filenames"], row["merged_names"]) for dir_iter, dir in dirs.iterrows() for row_iter, row in filenames.iterrows()]
+    errors = []
+    start = time.time()
+    def report(n, pair, future):
+        try:
+            n_written = future.result()
+            print("[{}/{}] {}: {} fragments written to {} ({:.1f}s)".format(n + 1, len(pairs), os.path.join(pair[0], pair[1]),
+                n_written, pair[2], time.time() - start), flush=True)
+        except Exception as e:
+            errors.append((pair, e))
+            print("[{}/{}] {}: failed: {!r}".format(n + 1, len(pairs), os.path.join(pair[0], pair[1]), e), flush=True)
+    if n_jobs > 1:
+        # each (dir, filenames) pair is independent, so run them in a pool of processes
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+            futures = {executor.submit(mergeDirFiles, *pair, epoch_precision, index_name, chunksize, force, output_formats): pair for pair in pairs}
+            for n, future in enumerate(concurrent.futures.as_completed(futures)):
+                report(n, futures[future], future)
+    else:
+        for n, pair in enumerate(pairs):
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(mergeDirFiles(*pair, epoch_precision, index_name, chunksize, force, output_formats))
+            except Exception as e:
+                future.set_exception(e)
+            report(n, pair, future)
+
+    # report the pairs that could not be merged
+    if errors:
+        print("{} of {} merges failed:".format(len(errors), len(pairs)))
+        for pair, e in errors:
+            print("  {} -> {}: {!r}".format(os.path.join(pair[0], pair[1]), pair[2], e))
+        return 1
+    return 0
 
 # Run main
 if __name__ == "__main__":
-    # Input files
-    path = ""
-    dirs_filename = path + "MergeTrainTestRunsDirs.csv"
-    data_filename = path + "MergeTrainTestRunsFilenames.csv"
-    epoch_precision = 1000
-    index_name = "Epoch"
-
-    # Name of the index
-    main(dirs_filename, data_filename, epoch_precision, index_name)
\ No newline at end of file
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-d", "--dirs", default="MergeTrainTestRunsDirs.csv", dest="dirs_filename", help = "Input directories csv")
+    parser.add_argument("-f", "--filenames", default="MergeTrainTestRunsFilenames.csv", dest="data_filename", help = "Input filename patterns csv")
+    parser.add_argument("-p", "--epoch-precision", type=int, default=1000, dest="epoch_precision", help = "Precision to trim the epochs of each fragment at; default = 1000")
+    parser.add_argument("-i", "--index", default="Epoch", dest="index_name", help = "Name of the epoch column; default = Epoch")
+    parser.add_argument("--chunksize", type=int, default=10000, dest="chunksize", help = "Number of rows to read at a time; default = 10000")
+    parser.add_argument("--force", action="store_true", dest="force", help = "Merge all fragments again regardless of the manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=1, dest="n_jobs", help = "Number of (dir, filenames) pairs to merge at the same time; default = 1")
+    parser.add_argument("--format", nargs="+", choices=OUTPUT_FORMATS, default=["csv"], dest="output_formats", help = "Formats to write each merged file as: csv, parquet and/or feather (requires pyarrow); default = csv")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    sys.exit(main(args.dirs_filename, args.data_filename, args.epoch_precision, args.index_name, args.chunksize, args.force, args.n_jobs, args.output_formats))
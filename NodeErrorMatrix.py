@@ -0,0 +1,137 @@
+from matplotlib import pyplot as plt
+from matplotlib.colors import LogNorm
+import numpy as np
+import os, warnings, itertools
+import argparse
+from EvoNetColumns import readTensorChunks
+
+ERROR_METRICS = ["mse", "mae", "maxabs"]
+
+def computeNodeErrors(output_values, expected_values):
+    """Compute the error of the outputs of each epoch, node and batch over the memory steps
+
+    Args:
+        output_values: 4-D array of shape (epochs, nodes, batches, memory) of the output values
+        expected_values: 4-D array of the expected values of the same shape
+
+    Returns:
+        4-D float32 array of shape (metrics, epochs, nodes, batches) with the ERROR_METRICS,
+        which are NaN where a node and batch has no values
+    """
+    difference = output_values - expected_values
+    n_values = np.sum(~np.isnan(difference), axis=3)
+    absolute = np.abs(difference)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mse = np.nansum(difference * difference, axis=3) / n_values
+        mae = np.nansum(absolute, axis=3) / n_values
+    maxabs = np.where(n_values > 0, np.max(np.nan_to_num(absolute, nan=-np.inf), axis=3), np.nan)
+    return np.stack([mse, mae, maxabs]).astype(np.float32)
+
+def makeErrorMatrix(output_filename, expected_filename, node="Output", index_name="Epoch", chunksize=10000):
+    """Make the error matrix of the outputs of a node against the expected values over all of the epochs.
+    Both files are read once, a chunk of rows of each at a time.
+
+    Args:
+        output_filename: name of the *_NodeOutputsPerEpoch.csv file
+        expected_filename: name of the *_ExpectedPerEpoch.csv file of the same run
+        node: the node name of the outputs
+        index_name: name of the index header
+        chunksize: the number of rows to read at a time
+
+    Returns:
+        dict with 'epochs', 'node_index', 'batch', 'metrics' and 'errors', the array from computeNodeErrors of all of the epochs
+    """
+    output_axes, output_chunks = readTensorChunks(output_filename, node, "Output", index_name, chunksize=chunksize)
+    expected_axes, expected_chunks = readTensorChunks(expected_filename, node, "Expected", index_name,
+        output_axes["node_index"], output_axes["batch"], output_axes["memory"], chunksize)
+    for name in ["node_index", "batch", "memory"]:
+        if not np.array_equal(output_axes[name], expected_axes[name]):
+            raise ValueError("{} and {} do not have the same {} values.".format(output_filename, expected_filename, name))
+
+    epochs, errors = [], []
+    for output_chunk, expected_chunk in itertools.zip_longest(output_chunks, expected_chunks):
+        if output_chunk is None:
+            raise ValueError("{} has more rows than {}.".format(expected_filename, output_filename))
+        if expected_chunk is None:
+            raise ValueError("{} has more rows than {}.".format(output_filename, expected_filename))
+        (output_epochs, output_values), (expected_epochs, expected_values) = output_chunk, expected_chunk
+        if not np.array_equal(output_epochs, expected_epochs):
+            raise ValueError("The {} of the rows of {} and {} do not match.".format(index_name, output_filename, expected_filename))
+        epochs.append(output_epochs)
+        errors.append(computeNodeErrors(output_values, expected_values))
+    return {"epochs": np.concatenate(epochs), "node_index": output_axes["node_index"], "batch": output_axes["batch"],
+        "metrics": np.array(ERROR_METRICS), "errors": np.concatenate(errors, axis=1)}
+
+def writeErrorMatrix(filename, matrix):
+    """Write the error matrix to a compressed .npz file"""
+    with open(filename + ".tmp", "wb") as f:
+        np.savez_compressed(f, **matrix)
+    os.replace(filename + ".tmp", filename)
+
+def plotErrorMatrix(matrix, metric, index_name="Epoch", log_scale=False, figure_filename=None, dpi=150):
+    """Plot the error of each epoch and node, averaged over the batches, as a heatmap
+
+    Args:
+        matrix: dict from makeErrorMatrix
+        metric: one of ERROR_METRICS
+        index_name: name of the index header
+        log_scale: True to use a logarithmic color scale
+        figure_filename: name of the file to save the figure to, or None to show the figure
+        dpi: the resolution of the saved figure
+    """
+    errors = matrix["errors"][list(matrix["metrics"]).index(metric)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # nodes without values
+        node_errors = np.nanmean(errors, axis=2)
+    epochs = matrix["epochs"]
+
+    # the epochs are along x so that long runs stay readable
+    fig, ax = plt.subplots(figsize=(12, 1 + 0.4 * len(matrix["node_index"])))
+    norm = None
+    if log_scale and np.any(node_errors > 0):
+        norm = LogNorm(vmin=np.nanmin(node_errors[node_errors > 0]), vmax=np.nanmax(node_errors))
+    image = ax.imshow(node_errors.T, aspect="auto", interpolation="nearest", origin="lower", norm=norm,
+        extent=(epochs[0], epochs[-1], -0.5, len(matrix["node_index"]) - 0.5))
+    ax.set_yticks(np.arange(len(matrix["node_index"])))
+    ax.set_yticklabels(matrix["node_index"])
+    ax.set_xlabel(index_name)
+    ax.set_ylabel("Node")
+    ax.set_title("{} of the outputs averaged over the batches".format(metric.upper()))
+    fig.colorbar(image, ax=ax, label=metric)
+    fig.tight_layout()
+    if figure_filename is None:
+        plt.show()
+    else:
+        fig.savefig(figure_filename, dpi=dpi)
+        plt.close(fig)
+
+def main(output_filename, expected_filename, node, index_name, matrix_filename, figure_filename=None, metric="mse", log_scale=False, chunksize=10000):
+    """Run main script"""
+    print("Computing the errors of {} against {}...".format(output_filename, expected_filename))
+    matrix = makeErrorMatrix(output_filename, expected_filename, node, index_name, chunksize)
+    print("Writing the {} x {} x {} error matrix to {}...".format(len(matrix["epochs"]), len(matrix["node_index"]), len(matrix["batch"]), matrix_filename))
+    writeErrorMatrix(matrix_filename, matrix)
+    print("Plotting the {} heatmap...".format(metric))
+    plotErrorMatrix(matrix, metric, index_name, log_scale, figure_filename)
+
+# Run main
+if __name__ == "__main__":
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-o", "--outputs", required=True, dest="output_filename", help = "Input *_NodeOutputsPerEpoch.csv file")
+    parser.add_argument("-x", "--expected", required=True, dest="expected_filename", help = "Input *_ExpectedPerEpoch.csv file of the same run")
+    parser.add_argument("-n", "--node", default="Output", dest="node", help = "Name of the output node; default = Output")
+    parser.add_argument("-i", "--index", default="Epoch", dest="index_name", help = "Name of the index; default = Epoch")
+    parser.add_argument("-m", "--matrix", default="NodeErrorMatrix.npz", dest="matrix_filename", help = "Output .npz file of the epochs, node indices, batches, metrics and errors; default = NodeErrorMatrix.npz")
+    parser.add_argument("-f", "--figure", dest="figure_filename", help = "Save the heatmap to this file instead of showing it")
+    parser.add_argument("--metric", default="mse", choices=ERROR_METRICS, dest="metric", help = "Error to plot; default = mse")
+    parser.add_argument("--log", action="store_true", dest="log_scale", help = "Use a logarithmic color scale")
+    parser.add_argument("--chunksize", type=int, default=10000, dest="chunksize", help = "Number of rows to read at a time; default = 10000")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    main(args.output_filename, args.expected_filename, args.node, args.index_name, args.matrix_filename,
+        args.figure_filename, args.metric, args.log_scale, args.chunksize)
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import os
+import io
+import hashlib
+
+def getEpochIndexFilename(filename):
+    """Make the name of the epoch index file of a *PerEpoch.csv file"""
+    return os.path.splitext(filename)[0] + "_epochindex.npz"
+
+def scanEpochOffsets(f, start, column):
+    """Find the byte range and the epoch of each complete line of a csv file from start onwards
+
+    Args:
+        f: the csv file opened in binary mode
+        start: the byte offset of the first line to scan
+        column: the position of the index column
+
+    Returns:
+        arrays of the epoch, start byte and end byte of each line, and the end byte of the last complete line
+    """
+    epochs, starts, ends = [], [], []
+    f.seek(start)
+    pos = start
+    for line in f:
+        if not line.endswith(b"\n"):
+            break # a partially written last line is indexed by the next scan
+        if line.strip():
+            epochs.append(float(line.split(b",", column + 1)[column]))
+            starts.append(pos)
+            ends.append(pos + len(line))
+        pos += len(line)
+    return np.array(epochs, dtype=np.float64), np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64), pos
+
+def hashLine(f, start, end):
+    """Hash the bytes of a line of a file, to check later that the line did not change"""
+    f.seek(start)
+    return hashlib.sha1(f.read(end - start)).hexdigest()
+
+def writeEpochIndex(filename, index):
+    """Write the epoch index of a *PerEpoch.csv file next to it.  The index is only kept in memory
+    when its directory is not writable."""
+    index_filename = getEpochIndexFilename(filename)
+    try:
+        with open(index_filename + ".tmp", "wb") as f:
+            np.savez(f, **index)
+        os.replace(index_filename + ".tmp", index_filename)
+    except OSError as e:
+        print("could not store the epoch index of {}: {}".format(filename, e))
+
+def loadEpochIndex(filename, index_name):
+    """Load the index of the byte range of the line of each epoch of a *PerEpoch.csv file.
+    The index is stored in <file>_epochindex.npz and is used as is when the size and modification time
+    of the file did not change.  When the file grew, and the header and the last line that was indexed are
+    unchanged, only the lines that were appended are scanned; otherwise the index is built again.
+
+    Args:
+        filename: name of the *PerEpoch.csv file
+        index_name: name of the index header
+
+    Returns:
+        dict with 'epochs','starts','ends' of each line, 'header' (the header line), 'column' (the position
+        of the index column), 'indexed_size' (the end of the last line indexed), 'last_line' (the hash of the
+        last line indexed), 'file_size' and 'mtime_ns'
+    """
+    stat = os.stat(filename)
+    index = None
+    try:
+        with np.load(getEpochIndexFilename(filename)) as stored:
+            index = {key: stored[key] for key in stored.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    if index is not None and int(index["file_size"]) == stat.st_size and int(index["mtime_ns"]) == stat.st_mtime_ns:
+        return index
+
+    with open(filename, "rb") as f:
+        header = f.readline()
+        if index is not None:
+            # the indexed lines are kept when the header and the last indexed line are the same,
+            # which catches a file that was written again from scratch
+            if (bytes(index["header"]) != header or stat.st_size <= int(index["file_size"]) or "last_line" not in index
+                    or (len(index["ends"]) and hashLine(f, int(index["starts"][-1]), int(index["ends"][-1])) != str(index["last_line"]))):
+                index = None
+        if index is None:
+            columns = header.rstrip(b"\r\n").decode().split(",")
+            if index_name not in columns:
+                raise ValueError("{} has no column {}.".format(filename, index_name))
+            index = {"epochs": np.empty(0), "starts": np.empty(0, dtype=np.int64), "ends": np.empty(0, dtype=np.int64),
+                "header": np.frombuffer(header, dtype=np.uint8), "column": columns.index(index_name), "indexed_size": len(header)}
+            print("building the epoch index of {}...".format(filename))
+        epochs, starts, ends, indexed_size = scanEpochOffsets(f, int(index["indexed_size"]), int(index["column"]))
+        index.update(epochs=np.concatenate([index["epochs"], epochs]), starts=np.concatenate([index["starts"], starts]),
+            ends=np.concatenate([index["ends"], ends]), indexed_size=indexed_size, file_size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        index["last_line"] = hashLine(f, int(index["starts"][-1]), int(index["ends"][-1])) if len(index["ends"]) else ""
+    writeEpochIndex(filename, index)
+    return index
+
+def readEpochRows(filename, epochs, usecols, index_name, dtype=np.float32):
+    """Read the rows of some epochs of a *PerEpoch.csv file by seeking to their lines with the epoch index,
+    instead of parsing the whole file
+
+    Args:
+        filename: name of the *PerEpoch.csv file
+        epochs: list of the index values of the rows to read
+        usecols: list of the column names to read
+        index_name: name of the index header
+        dtype: the data type of the values
+
+    Returns:
+        pandas data frame of the rows in the order of the file, as pd.read_csv(filename, usecols=usecols)
+        filtered on the epochs, including the row numbers
+
+    Raises:
+        ValueError: if the epochs of the lines read do not match the epoch index
+    """
+    index = loadEpochIndex(filename, index_name)
+    rows = np.flatnonzero(np.isin(index["epochs"], np.asarray(epochs, dtype=np.float64)))
+    buffer = [bytes(index["header"])]
+    with open(filename, "rb") as f:
+        for start, end in zip(index["starts"][rows], index["ends"][rows]):
+            f.seek(start)
+            buffer.append(f.read(end - start))
+
+    # the index column is always read to check the lines against the epoch index
+    index_column = int(index["column"]) if all(isinstance(column, (int, np.integer)) for column in usecols) else index_name
+    read_cols = list(usecols) if index_column in usecols else list(usecols) + [index_column]
+    data = pd.read_csv(io.BytesIO(b"".join(buffer)), usecols=read_cols, dtype=dtype)
+    if not np.array_equal(data[index_name].to_numpy(), index["epochs"][rows].astype(data[index_name].dtype)):
+        raise ValueError("The epoch index of {} is out of date; remove {} and read the file again.".format(filename, getEpochIndexFilename(filename)))
+    if index_column not in usecols:
+        data = data.drop(columns=[index_name])
+    data.index = rows # the row numbers in the file
+    return data
+
+def parseRange(values):
+    """Expand a list of numbers and start:stop[:step] ranges, e.g. ["0:300:100", "1000"] -> [0, 100, 200, 1000]"""
+    expanded = []
+    for value in values:
+        if ":" in str(value):
+            expanded.extend(range(*[int(part) for part in str(value).split(":")]))
+        else:
+            expanded.append(int(value))
+    return expanded
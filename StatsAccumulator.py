@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import os
+
+def concatenateColumn(chunks):
+    """Concatenate the chunks of values of a column into a single array,
+    falling back to an object array when the chunks do not share a common type
+
+    Args:
+        chunks: list of 1-D numpy arrays
+
+    Returns:
+        numpy array
+    """
+    if not chunks:
+        return np.array([], dtype=object)
+    try:
+        return np.concatenate(chunks)
+    except (TypeError, ValueError):
+        return np.concatenate([chunk.astype(object) for chunk in chunks])
+
+class StatsAccumulator:
+    """Collects the rows of an aggregate statistics table into columnar buffers
+    and builds the data frame once, instead of copying the whole table on every
+    DataFrame.append.  Columns that are not in the initial columns are added at the end
+    in the order they are first seen, and missing values are NaN, as with DataFrame.append.
+
+    When streaming is enabled each flush appends the rows added since the previous flush
+    to the output file, so the rows of the finished runs survive a crash.  If new columns
+    appear after the header was written the file is written again in full on close.
+    """
+
+    def __init__(self, columns, filename=None, stream=False):
+        """Make an empty accumulator
+
+        Args:
+            columns: list of the initial column names
+            filename: name of the csv file to write the table to
+            stream: True to append the rows to filename on each flush
+        """
+        self.columns = list(columns)
+        self.chunks = {column: [] for column in self.columns}
+        self.chunk_sizes = []
+        self.n_rows = 0
+        self.filename = filename
+        self.stream = stream
+        self.n_rows_written = 0
+        self.n_chunks_written = 0
+        self.columns_written = None
+
+    def append(self, rows):
+        """Add a row or rows to the table
+
+        Args:
+            rows: dict of column name to value for a single row, or a data frame of rows
+        """
+        if isinstance(rows, dict):
+            n_new = 1
+            values = {column: np.asarray([value]) for column, value in rows.items()}
+        else:
+            n_new = len(rows)
+            values = {column: rows[column].to_numpy() for column in rows.columns}
+        for column in values:
+            if column not in self.chunks:
+                self.columns.append(column)
+                # one chunk per earlier append so that the chunks of all columns line up
+                self.chunks[column] = [np.full(n, np.nan, dtype=np.float32) for n in self.chunk_sizes]
+        for column in self.columns:
+            self.chunks[column].append(values[column] if column in values else np.full(n_new, np.nan, dtype=np.float32))
+        self.chunk_sizes.append(n_new)
+        self.n_rows += n_new
+
+    def toDataFrame(self):
+        """Build the data frame of the table
+
+        Returns:
+            pandas data frame
+        """
+        data = {column: concatenateColumn(self.chunks[column]) for column in self.columns}
+        return pd.DataFrame(data, columns=self.columns, index=pd.RangeIndex(0, self.n_rows))
+
+    def flush(self):
+        """Append the rows added since the previous flush to the output file when streaming"""
+        if not self.stream or self.filename is None or self.n_rows == self.n_rows_written:
+            return
+        if self.columns_written is not None and self.columns_written != self.columns:
+            return # the header is out of date; the file is written in full on close
+        header = self.columns_written is None
+
+        # every column has one chunk per append
+        data = {column: concatenateColumn(self.chunks[column][self.n_chunks_written:]) for column in self.columns}
+        df = pd.DataFrame(data, columns=self.columns, index=pd.RangeIndex(self.n_rows_written, self.n_rows))
+        df.to_csv(self.filename, mode="w" if header else "a", header=header)
+        self.columns_written = list(self.columns)
+        self.n_rows_written = self.n_rows
+        self.n_chunks_written = len(self.chunk_sizes)
+
+    def close(self):
+        """Write the rows that have not been written yet to the output file
+
+        Returns:
+            pandas data frame of the table
+        """
+        df = self.toDataFrame()
+        if self.filename is None:
+            return df
+        if self.stream and self.columns_written == self.columns:
+            self.flush()
+        else:
+            tmp_filename = self.filename + ".tmp"
+            df.to_csv(tmp_filename)
+            os.replace(tmp_filename, self.filename)
+            self.columns_written = list(self.columns)
+            self.n_rows_written = self.n_rows
+        return df
@@ -1,8 +1,16 @@
 from matplotlib import pyplot as plt
+from matplotlib import rcParams
+from PIL import Image
 import numpy as np
 import pandas as pd
+import os, argparse, warnings, shutil, subprocess
+from PerEpochReader import parseRange
+from EvoNetColumns import addToTensorPlan, readTensorPlan, getTensorSlice
 
-def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles, input_data, output_data, expected_data, label, axs, color, marker, series):
+# the file, node name and kind of the values of each panel
+PANEL_VALUES = [("input_filenames", "Input", "Input"), ("output_filenames", "Output", "Output"), ("expected_filenames", "Output", "Expected")]
+
+def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles, input_values, output_values, expected_values, label, axs, color, marker, series):
     """Generate a side by side plot of the input node values, output node values, and expected output node values.
     Each figure is of a single train/text batch.
     Each panel is of a single node.
@@ -10,9 +18,9 @@ def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles,
     Args:
         n_node
         subplot_titles
-        input_data
-        output_data
-        expected_data
+        input_values: the input values of each memory step
+        output_values: the output values of each memory step
+        expected_values: the expected values of each memory step
         nodes_to_labels
         axs
         color: the color to use for the plots
@@ -22,11 +30,11 @@ def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles,
 
     # Make the subplots
     try:
-        axs[n_row, 0].scatter(x_data, input_data.iloc[0][1:],
+        axs[n_row, 0].scatter(x_data, input_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[n_row, 1].scatter(x_data, output_data.iloc[0][1:],
+        axs[n_row, 1].scatter(x_data, output_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[n_row, 2].scatter(x_data, expected_data.iloc[0][1:],
+        axs[n_row, 2].scatter(x_data, expected_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
 
         # Make the titles 
@@ -38,11 +46,11 @@ def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles,
         axs[n_row,0].legend(loc="upper left", markerscale=2)
 
     except:
-        axs[0].scatter(x_data, input_data.iloc[0][1:],
+        axs[0].scatter(x_data, input_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[1].scatter(x_data, output_data.iloc[0][1:],
+        axs[1].scatter(x_data, output_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
-        axs[2].scatter(x_data, expected_data.iloc[0][1:],
+        axs[2].scatter(x_data, expected_values,
                     alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=series)
 
         # Make the titles 
@@ -53,29 +61,201 @@ def plotTimeCourse(n_node, n_row, memory_size, sequence_length, subplot_titles,
         # make the legend
         axs[0].legend(loc="upper left", markerscale=2)
 
-def makeColumnHeaders(n_batch, n_node, memory_size, sequence_length, index_name): 
-    """Make the expected headers for the input, output, and expected data files.
-    The sequence is generated downwards to match the memory steps.
+def getMemorySteps(memory_size, sequence_length):
+    """Get the memory steps of the time course, generated downwards from the end of the sequence"""
+    return list(range(sequence_length-1, sequence_length - memory_size, -1))
+
+def planTimeCourseReads(filenames, nodes_to_labels, memory_steps, epochs=None):
+    """Plan the node values and epochs needed from each file for each node and filename row
 
     Args:
-        headers: list of train/test metric names
-        agg_func: name of an aggregation function
+        filenames: data frame of the input/output/expected filenames with 'n_epoch','n_batch' of each row
+        nodes_to_labels: data frame of the nodes
+        memory_steps: list of the memory steps from getMemorySteps
+        epochs: list of the epochs to read of each row, or None to read the 'n_epoch' of the row
+
+    Returns:
+        the read plan for readTensorPlan
+    """
+    read_plan = {}
+    for n_row in range(len(nodes_to_labels)):
+        for index, row in filenames.iterrows():
+            for n_epoch in ([row['n_epoch']] if epochs is None else epochs):
+                for key, node, kind in PANEL_VALUES:
+                    addToTensorPlan(read_plan, row[key], node, kind, n_epoch, [nodes_to_labels.iloc[n_row].loc["nodes"]], [row['n_batch']], memory_steps)
+    return read_plan
+
+def makeSweepFigure(values, x_data, labels, series, subplot_titles, colors, markers):
+    """Make the figure of the epoch sweep with a scatter of each node, series and panel that is created once,
+    and axis limits that hold the values of all of the epochs
+
+    Args:
+        values: dict of (node row, series row, panel) to the 2-D array of the values of each epoch
+        x_data: the memory steps of the values
+        labels: list of the label of each node row
+        series: list of the series label of each series row
+        subplot_titles: the titles of the input, output and expected panels
+        colors, markers: lists of the color and marker of each series row
+
+    Returns:
+        figure, dict of (node row, series row, panel) to the scatter, and the title
+    """
+    fig, axs = plt.subplots(len(labels), 3, sharex=True, sharey=False, squeeze=False, figsize=(12, 3 * len(labels)))
+    artists = {}
+    for (n_row, n_series, m), epoch_values in values.items():
+        # animated artists are left out of the background and drawn on each frame
+        artists[(n_row, n_series, m)] = axs[n_row, m].scatter(x_data, epoch_values[0],
+            alpha=0.5, c=colors[n_series], marker=markers[n_series], edgecolors='none', s=20, label=series[n_series], animated=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # panels without values
+        for n_row in range(len(labels)):
+            for m in range(3):
+                panel = np.concatenate([epoch_values.ravel() for (i, n_series, j), epoch_values in values.items() if i == n_row and j == m])
+                low, high = np.nanmin(panel), np.nanmax(panel)
+                if np.isfinite(low) and np.isfinite(high):
+                    margin = 0.05 * (high - low) if high > low else 0.5
+                    axs[n_row, m].set_ylim(low - margin, high + margin)
+                axs[n_row, m].title.set_text("{} {}".format(labels[n_row], subplot_titles[m]))
+            axs[n_row, 0].legend(loc="upper left", markerscale=2)
+    title = fig.suptitle("", animated=True)
+    fig.tight_layout(rect=(0, 0, 1, 0.96)) # leave room for the title
+    return fig, artists, title
+
+def updateSweepFrame(n_epoch, epoch, values, x_data, artists, title, index_name):
+    """Move the points of each scatter to the values of an epoch
+
+    Args:
+        n_epoch: the position of the epoch in the sweep
+        epoch: the epoch
+        values: dict of (node row, series row, panel) to the 2-D array of the values of each epoch
+        x_data: the memory steps of the values
+        artists: dict of (node row, series row, panel) to the scatter
+        title: the title of the figure
         index_name: name of the index header
-        data: the actual data frame of values to aggregate according to the specified statistics
 
     Returns:
-        pandas data frame
-    """   
-    input_headers = ["Input_{:012d}_Input_Batch-{}_Memory-{}".format(n_node, n_batch, j) for j in range(sequence_length-1, sequence_length - memory_size, -1)]
-    output_headers = ["Output_{:012d}_Output_Batch-{}_Memory-{}".format(n_node, n_batch, j) for j in range(sequence_length-1, sequence_length - memory_size, -1)]
-    expected_headers = ["Output_{:012d}_Expected_Batch-{}_Memory-{}".format(n_node, n_batch, j) for j in range(sequence_length-1, sequence_length - memory_size, -1)]
-    input_headers.append(index_name)
-    output_headers.append(index_name)
-    expected_headers.append(index_name)
-    return input_headers, output_headers, expected_headers
-
-def main(data_dir, data_filename, nodes_filename, index_name):
-    """Run main script"""
+        list of the artists that changed
+    """
+    for key, artist in artists.items():
+        artist.set_offsets(np.column_stack([x_data, values[key][n_epoch]]))
+    title.set_text("{} {}".format(index_name, epoch))
+    return list(artists.values()) + [title]
+
+def renderSweepFrames(fig, epochs, values, x_data, artists, title, index_name):
+    """Render the frame of each epoch by drawing the figure once without the scatters and title,
+    and then drawing only the moved scatters and the title over a copy of it on each frame
+
+    Args:
+        fig: the figure from makeSweepFigure
+        epochs: list of the epochs
+        values: dict of (node row, series row, panel) to the 2-D array of the values of each epoch
+        x_data: the memory steps of the values
+        artists: dict of (node row, series row, panel) to the scatter
+        title: the title of the figure
+        index_name: name of the index header
+
+    Yields:
+        the epoch, and the RGBA array of the frame, which is overwritten by the next frame
+    """
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    for n_epoch, epoch in enumerate(epochs):
+        fig.canvas.restore_region(background)
+        for artist in updateSweepFrame(n_epoch, epoch, values, x_data, artists, title, index_name):
+            fig.draw_artist(artist)
+        yield epoch, np.asarray(fig.canvas.buffer_rgba())
+
+def writeSweepFrames(frames, output, index_name, fps=10):
+    """Write the frames of the sweep to an .mp4 file (with ffmpeg), a .gif file or a .png per frame in a directory
+
+    Args:
+        frames: iterable of the epoch and RGBA array of each frame, from renderSweepFrames
+        output: name of the .mp4 or .gif file, or of the directory of the .png frames
+        index_name: name of the index header
+        fps: the number of frames per second of the animation
+    """
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".mp4":
+        ffmpeg = shutil.which(rcParams["animation.ffmpeg_path"])
+        if ffmpeg is None:
+            raise ValueError("ffmpeg is needed to write .mp4 files.")
+        process = None
+        for epoch, frame in frames:
+            if process is None:
+                # the frames are streamed to ffmpeg as they are rendered
+                process = subprocess.Popen([ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+                    "-s", "{}x{}".format(frame.shape[1], frame.shape[0]), "-r", str(fps), "-i", "-",
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", output], stdin=subprocess.PIPE)
+            process.stdin.write(frame.tobytes())
+        if process is not None:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise ValueError("ffmpeg could not write {}.".format(output))
+    elif extension == ".gif":
+        # the palette of the first frame is used for all of the frames
+        images = []
+        for epoch, frame in frames:
+            image = Image.fromarray(frame).convert("RGB")
+            images.append(image.quantize(method=Image.Quantize.FASTOCTREE) if not images
+                else image.quantize(palette=images[0], dither=Image.Dither.NONE))
+        if images:
+            images[0].save(output, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+    else:
+        os.makedirs(output, exist_ok=True)
+        for epoch, frame in frames:
+            Image.fromarray(frame).save(os.path.join(output, "TimeCourse_{}-{:06d}.png".format(index_name, int(epoch))), compress_level=1)
+
+def sweepTimeCourse(filenames, nodes_to_labels, index_name, memory_size, sequence_length, epochs, output, fps=10, dpi=100):
+    """Render the time courses of each node and series of the 'n_batch' of each row over a range of epochs,
+    as the frames of an animation (.mp4 or .gif) or as a sequence of images (a directory).
+    The columns needed are read once for all of the epochs, and the scatters are made once and
+    moved between frames, so that only the scatters are drawn again on each frame.
+
+    Args:
+        filenames: data frame of the input/output/expected filenames, 'series' and 'n_batch' of each row
+        nodes_to_labels: data frame of the nodes
+        index_name: name of the index header
+        memory_size: the number of memory steps
+        sequence_length: the length of the sequence
+        epochs: list of the epochs
+        output: name of the .mp4 or .gif file, or of the directory of the .png frames
+        fps: the number of frames per second of the animation
+        dpi: the resolution of the frames
+    """
+    plt.switch_backend("Agg")
+    x_data = np.arange(sequence_length-1, sequence_length - memory_size, -1)
+
+    # read the values of all of the epochs from each file once
+    memory_steps = getMemorySteps(memory_size, sequence_length)
+    tensors = readTensorPlan(planTimeCourseReads(filenames, nodes_to_labels, memory_steps, epochs), index_name)
+    values = {}
+    for n_row in range(len(nodes_to_labels)):
+        for n_series, (index, row) in enumerate(filenames.iterrows()):
+            for m, (key, node, kind) in enumerate(PANEL_VALUES):
+                values[(n_row, n_series, m)] = getTensorSlice(tensors, row[key], node, kind, epochs,
+                    [nodes_to_labels.iloc[n_row].loc["nodes"]], [row['n_batch']], memory_steps)[:, 0, 0, :]
+
+    # make the artists once
+    all_colors = ["b","r","g","m","c","y","k"]
+    all_markers = [".","+",",","o","x","v"]
+    n_series = len(filenames)
+    colors = [all_colors[i % len(all_colors)] for i in range(n_series)]
+    markers = [all_markers[(i // len(all_colors)) % len(all_markers)] for i in range(n_series)]
+    rcParams["figure.dpi"] = dpi
+    fig, artists, title = makeSweepFigure(values, x_data, nodes_to_labels["labels"].tolist(), filenames["series"].tolist(),
+        ["Input", "Output", "Expected"], colors, markers)
+
+    # render the frames
+    print("Rendering {} frames to {}...".format(len(epochs), output))
+    writeSweepFrames(renderSweepFrames(fig, epochs, values, x_data, artists, title, index_name), output, index_name, fps)
+    plt.close(fig)
+
+def main(data_dir, data_filename, nodes_filename, index_name, epochs=None, output=None, fps=10, dpi=100):
+    """Run main script
+
+    When epochs are given the time courses of the 'n_batch' of each row are rendered over the epochs
+    to output instead of showing a single figure of the 'n_epoch' of each row.
+    """
 
     # read in the input files
     filenames = pd.read_csv(data_filename)
@@ -86,6 +266,9 @@ def main(data_dir, data_filename, nodes_filename, index_name):
     # extract the memory size
     memory_size = np.min(filenames["memory_sizes"].to_numpy())
     sequence_length = np.min(filenames["sequence_length"].to_numpy())
+    if epochs is not None:
+        sweepTimeCourse(filenames, nodes_to_labels, index_name, memory_size, sequence_length, epochs, output, fps, dpi)
+        return
 
     # make the initial figure
     n_nodes = len(nodes_to_labels)
@@ -98,22 +281,20 @@ def main(data_dir, data_filename, nodes_filename, index_name):
     subplot_titles = ["Input", "Output", "Expected"]
     marker_iter = 0
     color_iter = 0
+
+    # plan the node values and epochs needed from each file and read each file once
+    memory_steps = getMemorySteps(memory_size, sequence_length)
+    tensors = readTensorPlan(planTimeCourseReads(filenames, nodes_to_labels, memory_steps), index_name)
+
     for n_row in range(len(nodes_to_labels)):
         print("adding node {}...".format(nodes_to_labels.iloc[n_row].loc["nodes"]))
         for index, row in filenames.iterrows():
-            # make the expected column headers
-            input_headers, output_headers, expected_headers = makeColumnHeaders(row['n_batch'], nodes_to_labels.iloc[n_row].loc["nodes"], memory_size, sequence_length, index_name)
-
-            # read in and trim the data
-            input_data = pd.read_csv(row['input_filenames'], usecols = input_headers, dtype=np.float32)
-            input_data = input_data[input_data[index_name]==row['n_epoch']] # filter on epoch
-            output_data = pd.read_csv(row["output_filenames"], usecols = output_headers, dtype=np.float32)
-            output_data = output_data[output_data[index_name]==row['n_epoch']] # filter on epoch
-            expected_data = pd.read_csv(row["expected_filenames"], usecols = expected_headers, dtype=np.float32)
-            expected_data = expected_data[expected_data[index_name]==row['n_epoch']] # filter on epoch
+            # get the values of the memory steps of the epoch
+            input_values, output_values, expected_values = [getTensorSlice(tensors, row[key], node, kind, [row['n_epoch']],
+                [nodes_to_labels.iloc[n_row].loc["nodes"]], [row['n_batch']], memory_steps)[0, 0, 0, :] for key, node, kind in PANEL_VALUES]
 
             # plot each node time-course
-            plotTimeCourse(nodes_to_labels.iloc[n_row].loc["nodes"], n_row, memory_size, sequence_length, subplot_titles, input_data, output_data, expected_data, nodes_to_labels.iloc[n_row].loc["labels"],
+            plotTimeCourse(nodes_to_labels.iloc[n_row].loc["nodes"], n_row, memory_size, sequence_length, subplot_titles, input_values, output_values, expected_values, nodes_to_labels.iloc[n_row].loc["labels"],
                             axs, all_colors[color_iter], all_markers[marker_iter], row['series'])
             color_iter += 1
             if color_iter >= len(all_colors):
@@ -128,11 +309,20 @@ def main(data_dir, data_filename, nodes_filename, index_name):
 
 # Run main
 if __name__ == "__main__":
-    # Input files
-    data_dir = ""
-    data_filename = data_dir + "TimeCourseFilenames.csv"
-    nodes_filename = data_dir + "TimeCourseNodes.csv"
-
-    # Input parameters
-    index_name = "Epoch"
-    main(data_dir, data_filename, nodes_filename, index_name)
\ No newline at end of file
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-d", "--data", default="TimeCourseFilenames.csv", dest="data_filename", help = "Input data filenames csv")
+    parser.add_argument("-l", "--nodes", default="TimeCourseNodes.csv", dest="nodes_filename", help = "Input nodes csv")
+    parser.add_argument("-i", "--index", default="Epoch", dest="index_name", help = "Name of the index; default = Epoch")
+    parser.add_argument("-e", "--epochs", nargs="+", dest="epochs", help = "Sweep over these epochs, as numbers and/or start:stop[:step] ranges, instead of showing the plot")
+    parser.add_argument("-o", "--output", default="TimeCourse.mp4", dest="output", help = "The .mp4 or .gif file of the sweep, or a directory for a .png per epoch; default = TimeCourse.mp4")
+    parser.add_argument("--fps", type=int, default=10, dest="fps", help = "Frames per second of the sweep; default = 10")
+    parser.add_argument("--dpi", type=int, default=100, dest="dpi", help = "Resolution of the frames; default = 100")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    main("", args.data_filename, args.nodes_filename, args.index_name,
+        None if args.epochs is None else parseRange(args.epochs), args.output, args.fps, args.dpi)
\ No newline at end of file
@@ -1,8 +1,106 @@
 from matplotlib import pyplot as plt
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba
+from matplotlib.lines import Line2D
+from matplotlib.markers import MarkerStyle
+from matplotlib.transforms import IdentityTransform
 import numpy as np
 import pandas as pd
+import os, io, re, time, argparse, warnings
+from StatsAccumulator import StatsAccumulator
 
-def plotTrainTest(index_name, headers, data, axs, color, marker, label):
+def downsampleMinMax(x, y, n_points):
+    """Downsample each column of y to at most n_points by keeping the minimum and maximum
+    of each of n_points/2 equal sized buckets, so that spikes are kept
+
+    Args:
+        x: 1-D array of the x values
+        y: 2-D array of the y values of each column
+        n_points: the maximum number of points of each column
+
+    Returns:
+        2-D arrays of the x values and y values of the points kept for each column
+    """
+    n_rows, n_columns = y.shape
+    n_buckets = max(1, n_points // 2)
+    if n_rows <= n_points:
+        return np.repeat(x[:, None], n_columns, axis=1), y
+    bucket_size = int(np.ceil(n_rows / n_buckets))
+    n_buckets = int(np.ceil(n_rows / bucket_size))
+
+    # pad the rows to whole buckets with NaN that are never selected
+    y_pad = np.full((n_buckets * bucket_size, n_columns), np.nan, dtype=y.dtype)
+    y_pad[:n_rows] = y
+    y_buckets = y_pad.reshape(n_buckets, bucket_size, n_columns)
+    i_min = np.argmin(np.where(np.isnan(y_buckets), np.inf, y_buckets), axis=1)
+    i_max = np.argmax(np.where(np.isnan(y_buckets), -np.inf, y_buckets), axis=1)
+
+    # keep the minimum and maximum of each bucket in the order they occur
+    offsets = (np.arange(n_buckets) * bucket_size)[:, None]
+    rows = np.stack([np.minimum(i_min, i_max), np.maximum(i_min, i_max)], axis=1) + offsets[:, None]
+    rows = np.minimum(rows.reshape(2 * n_buckets, n_columns), n_rows - 1)
+    return x[rows], np.take_along_axis(y, rows, axis=0)
+
+def downsampleLTTB(x, y, n_points):
+    """Downsample each column of y to n_points with Largest-Triangle-Three-Buckets:
+    the first and last points are kept and from each bucket in between the point is kept that
+    forms the largest triangle with the previous kept point and the average of the next bucket.
+    The buckets are processed in order but all of the columns at once.
+
+    Args:
+        x: 1-D array of the x values
+        y: 2-D array of the y values of each column
+        n_points: the number of points of each column
+
+    Returns:
+        2-D arrays of the x values and y values of the points kept for each column
+    """
+    n_rows, n_columns = y.shape
+    if n_rows <= n_points or n_points < 3:
+        return np.repeat(x[:, None], n_columns, axis=1), y
+    x = x.astype(np.float64)
+    y_filled = np.nan_to_num(y.astype(np.float64))
+    edges = np.floor(np.linspace(1, n_rows - 1, n_points - 1)).astype(int)
+    rows = np.zeros((n_points, n_columns), dtype=int)
+    rows[-1] = n_rows - 1
+    column_ids = np.arange(n_columns)
+    for b in range(n_points - 2):
+        start, end = edges[b], max(edges[b + 1], edges[b] + 1)
+        next_start, next_end = end, (edges[b + 2] if b + 2 < len(edges) else n_rows)
+        next_end = max(next_end, next_start + 1)
+        a_x, a_y = x[rows[b]], y_filled[rows[b], column_ids]
+        c_x, c_y = x[next_start:next_end].mean(), y_filled[next_start:next_end].mean(axis=0)
+        areas = np.abs((a_x - c_x) * (y_filled[start:end] - a_y) - (a_x - x[start:end, None]) * (c_y - a_y))
+        rows[b + 1] = start + np.argmax(areas, axis=0)
+    return x[rows].astype(y.dtype), np.take_along_axis(y, rows, axis=0)
+
+def downsampleData(index_name, columns, data, n_points=2000, method="minmax"):
+    """Downsample each column for plotting
+
+    Args:
+        index_name: name of the index header
+        columns: list of the column names to downsample
+        data: data frame where each row is an iteration
+        n_points: the point budget of each column
+        method: 'minmax' for min/max bucketing, 'lttb' for Largest-Triangle-Three-Buckets, or 'none'
+
+    Returns:
+        dict of column name to the x and y values to plot
+    """
+    columns = list(dict.fromkeys(columns))
+    x = data.loc[:, index_name].to_numpy()
+    y = data.loc[:, columns].to_numpy()
+    if method == "minmax":
+        x_ds, y_ds = downsampleMinMax(x, y, n_points)
+    elif method == "lttb":
+        x_ds, y_ds = downsampleLTTB(x, y, n_points)
+    elif method == "none":
+        x_ds, y_ds = np.repeat(x[:, None], len(columns), axis=1), y
+    else:
+        raise ValueError("Unknown downsampling method {}.".format(method))
+    return {column: (x_ds[:, i], y_ds[:, i]) for i, column in enumerate(columns)}
+
+def plotTrainTest(index_name, headers, data, axs, color, marker, label, n_points=2000, downsample_method="minmax"):
     """Generate a side by side plot of expected and predicted
 
     Args:
@@ -12,72 +110,416 @@ def plotTrainTest(index_name, headers, data, axs, color, marker, label):
         color: the color to use for the plots
         maker: the marker to use for the plots
         label: the label to use for the plots
+        n_points: the point budget of each metric
+        downsample_method: 'minmax', 'lttb' or 'none'
     """
     n_metric_pairs = len(headers)
-    data_downsampled = data.iloc[::2] # down sample by 1/2
+    data_downsampled = downsampleData(index_name, [header for header_tup in headers for header in header_tup], data, n_points, downsample_method)
     for n in range(0,n_metric_pairs):
         try:
             if n==0:
-                axs[n, 0].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][0]],
+                axs[n, 0].scatter(*data_downsampled[headers[n][0]],
                            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=label)
                 axs[n, 0].title.set_text("Train")
-                axs[n, 1].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][1]],
+                axs[n, 1].scatter(*data_downsampled[headers[n][1]],
                            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=label)
                 axs[n, 1].title.set_text("Test")
             else:
-                axs[n, 0].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][0]],
+                axs[n, 0].scatter(*data_downsampled[headers[n][0]],
                            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20)
-                axs[n, 1].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][1]],
+                axs[n, 1].scatter(*data_downsampled[headers[n][1]],
                            alpha=0.5, c=color, marker=marker, edgecolors='none', s=20)
         except:
-            axs[0].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][0]],
+            axs[0].scatter(*data_downsampled[headers[n][0]],
                         alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=label)
             axs[0].title.set_text("Train")
-            axs[1].scatter(data_downsampled.loc[:, index_name],  data_downsampled.loc[:, headers[n][1]],
+            axs[1].scatter(*data_downsampled[headers[n][1]],
                         alpha=0.5, c=color, marker=marker, edgecolors='none', s=20, label=label)
             axs[1].title.set_text("Test")
 
-def aggregateTrainTestStats(headers, agg_funcs, index_name, data, label, n_agg_values = 10):
+def getSignedMagnitudes(data, flat_headers, is_min):
+    """Make a float32 block of the magnitudes of the metrics with the 'min' metrics negated,
+    so that the extreme of every metric is its maximum"""
+    values = np.abs(data.loc[:, flat_headers].to_numpy(dtype=np.float32))
+    values[:, is_min] *= -1
+    return values
+
+def updateTrainTestStats(stats, headers, agg_funcs, data, n_agg_values = 10, n_agg_values_error = 1, tolerance = 0.02):
+    """Update the running aggregation statistics of the train/test metrics with the rows
+    that were added to data since the previous update.
+
+    All of the metrics are aggregated at once over a single float32 block of their magnitudes:
+    'min' metrics are negated so that the extremes are a single max, and the iteration at which
+    the n-th value within the tolerance is reached is found from the cumulative count of the values
+    within the tolerance.  The counts of the metrics whose extreme did not change are continued
+    over the new rows only; the metrics with a new extreme are counted again over all of the rows.
+
+    Args:
+        stats: the statistics returned by the previous update, or None to aggregate all of the rows
+        headers: list of train/test metric names
+        agg_funcs: list of the name of the aggregation function of each train/test metric pair
+        data: the data frame of all of the rows so far
+        n_agg_values: the number of values within the tolerance of the aggregation function value to reach
+        n_agg_values_error: the number of values to reach for the "_Error" metrics
+        tolerance: the fraction of the aggregation function value that a value may differ by
+
+    Returns:
+        dict with 'flat_headers','is_max','is_min','n_required','n_rows','extremes','counts','positions'
+    """
+    assert(len(headers)==len(agg_funcs))
+    if stats is None:
+        flat_headers = [header for header_tup in headers for header in header_tup]
+        flat_agg_funcs = [agg_func for header_tup, agg_func in zip(headers, agg_funcs) for header in header_tup]
+        # TODO: added only for loss error
+        stats = {"flat_headers": flat_headers,
+            "is_max": np.array([agg_func == "max" for agg_func in flat_agg_funcs], dtype=bool),
+            "is_min": np.array([agg_func == "min" for agg_func in flat_agg_funcs], dtype=bool),
+            "n_required": np.array([n_agg_values_error if "_Error" in header else n_agg_values for header in flat_headers], dtype=int),
+            "n_rows": 0, "extremes": np.full(len(flat_headers), np.nan, dtype=np.float32),
+            "counts": np.zeros(len(flat_headers), dtype=int), "positions": np.zeros(len(flat_headers), dtype=int)}
+    else:
+        stats = dict(stats, extremes=stats["extremes"].copy(), counts=stats["counts"].copy(), positions=stats["positions"].copy())
+    flat_headers, is_max, is_min, n_required = stats["flat_headers"], stats["is_max"], stats["is_min"], stats["n_required"]
+    n_old = stats["n_rows"]
+    stats["n_rows"] = len(data)
+    if not flat_headers or len(data) == n_old:
+        return stats
+
+    # calculate the aggregation statistic; just use the magnitude and not the direction
+    values = getSignedMagnitudes(data.iloc[n_old:], flat_headers, is_min)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN metrics aggregate to NaN
+        extremes = np.fmax(stats["extremes"], np.nanmax(values, axis=0))
+    changed = ~((extremes == stats["extremes"]) | (np.isnan(extremes) & np.isnan(stats["extremes"])))
+    if n_old == 0:
+        changed[:] = True
+    stats["extremes"] = extremes
+    agg_func_values = np.where(is_max, extremes, -extremes)
+    thresholds = np.where(is_max, agg_func_values*(1 - tolerance), -(agg_func_values*(1 + tolerance))).astype(np.float32)
+
+    # calculate # of iterations using the agg stat: continue the counts of the unchanged metrics
+    unchanged = np.flatnonzero(~changed)
+    if len(unchanged):
+        counts = stats["counts"][unchanged] + np.cumsum(values[:, unchanged] >= thresholds[unchanged], axis=0)
+        reached = (stats["counts"][unchanged] < n_required[unchanged]) & (counts[-1] >= n_required[unchanged])
+        positions = n_old + np.argmax(counts >= n_required[unchanged], axis=0)
+        stats["positions"][unchanged[reached]] = positions[reached]
+        stats["counts"][unchanged] = counts[-1]
+
+    # and count the metrics with a new extreme again
+    changed = np.flatnonzero(changed)
+    if len(changed):
+        if n_old:
+            values = getSignedMagnitudes(data, [flat_headers[i] for i in changed], is_min[changed])
+        else:
+            values = values[:, changed]
+        counts = np.cumsum(values >= thresholds[changed], axis=0)
+        stats["counts"][changed] = counts[-1]
+        stats["positions"][changed] = np.argmax(counts >= n_required[changed], axis=0)
+    return stats
+
+def makeTrainTestStatsRow(stats, data, label):
+    """Make the row of the aggregate statistics table from the running aggregation statistics
+
+    Args:
+        stats: the statistics from updateTrainTestStats
+        data: the data frame that was aggregated
+        label: the label of the data
+
+    Returns:
+        dict of header to aggregation function value and header + "_itersToValue" to the number of iterations
+    """
+    row_data = {"label":label}
+    agg_func_values = np.where(stats["is_max"], stats["extremes"], -stats["extremes"])
+    for i, header in enumerate(stats["flat_headers"]):
+        if stats["is_max"][i] or stats["is_min"][i]:
+            row_data.update({header:agg_func_values[i]})
+            index = data.index[stats["positions"][i]] if stats["counts"][i] >= stats["n_required"][i] else np.nan
+        else:
+            row_data.update({header:None})
+            index = np.nan
+        row_data.update({header + "_itersToValue":index})
+    return row_data
+
+def smoothRollingMean(values, window):
+    """Smooth each column of values with a trailing rolling mean from cumulative sums,
+    so that the cost does not depend on the window.  Missing values are skipped and
+    the first rows are averaged over the rows so far.
+
+    Args:
+        values: 2-D array of the values of each metric
+        window: the number of rows to average over
+
+    Returns:
+        2-D float64 array of the smoothed values
+    """
+    present = ~np.isnan(values)
+    sums = np.zeros((len(values) + 1, values.shape[1]))
+    sums[1:] = np.cumsum(np.where(present, values, 0), axis=0)
+    counts = np.zeros((len(values) + 1, values.shape[1]))
+    counts[1:] = np.cumsum(present, axis=0)
+    starts = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[1:] - sums[starts]) / (counts[1:] - counts[starts])
+
+def smoothEMA(values, alpha):
+    """Smooth each column of values with an exponential moving average that starts at the first value,
+    as pandas ewm(alpha, adjust=False).  The recursion is written as cumulative sums of the values
+    scaled by powers of 1 - alpha, over blocks of rows short enough for the powers not to overflow.
+    Missing values are replaced by the previous value.
+
+    Args:
+        values: 2-D array of the values of each metric
+        alpha: the smoothing factor between 0 and 1
+
+    Returns:
+        2-D float64 array of the smoothed values
+    """
+    # hold the last value over the missing values, and start each column at its first value
+    present = ~np.isnan(values)
+    first = np.argmax(present, axis=0)
+    rows = np.where(present, np.arange(len(values))[:, None], first)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    values = np.take_along_axis(values, rows, axis=0).astype(np.float64)
+    if alpha >= 1:
+        smoothed = values
+    else:
+        # s_t = decay^t s_0 + alpha sum_k decay^(t-k) x_k, with the last average of the previous block as s_0
+        smoothed = np.empty_like(values)
+        smoothed[0] = values[0]
+        decay = 1 - alpha
+        block_size = max(1, int(100 / -np.log10(decay)))
+        for start in range(1, len(values), block_size):
+            block = values[start:start + block_size]
+            powers = decay ** np.arange(1, len(block) + 1)[:, None]
+            smoothed[start:start + len(block)] = powers * (smoothed[start - 1] + np.cumsum(alpha * block / powers, axis=0))
+    smoothed[np.arange(len(values))[:, None] < first] = np.nan
+    return smoothed
+
+def findPlateaus(smoothed, tolerance, min_rows):
+    """Find the first row of each column from which the smoothed curve stays within
+    tolerance times its range of its final value
+
+    Args:
+        smoothed: 2-D array of the smoothed values of each metric
+        tolerance: the fraction of the range of the smoothed values that a value may differ from the final value
+        min_rows: the minimum number of rows of a plateau
+
+    Returns:
+        1-D array of the first row of the plateau of each column, or -1 when there is no plateau
+    """
+    n_rows = len(smoothed)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN metrics have no plateau
+        final = smoothed[-1]
+        band = tolerance * (np.nanmax(smoothed, axis=0) - np.nanmin(smoothed, axis=0))
+        outside = ~(np.abs(smoothed - final) <= band)
+
+    # the plateau starts after the last row outside the band
+    last_outside = n_rows - 1 - np.argmax(outside[::-1], axis=0)
+    starts = np.where(outside.any(axis=0), last_outside + 1, 0)
+    return np.where((n_rows - starts >= min_rows) & ~np.isnan(final), starts, -1)
+
+def analyzeConvergence(flat_headers, data, convergence):
+    """Smooth all of the metrics at once and find the iteration at which each smoothed curve
+    reaches its plateau, which is less sensitive to single noisy epochs than the "_itersToValue" columns
+
+    Args:
+        flat_headers: list of the metric names
+        data: the data frame of the metrics
+        convergence: dict with 'method' ('mean' or 'ema'), 'window' (the rows of the rolling mean,
+            or the span of the EMA), 'tolerance' and 'min_rows' (see findPlateaus)
+
+    Returns:
+        dict of header + "_smoothed" to the final smoothed value and header + "_itersToPlateau" to the number of iterations
+    """
+    row_data = {}
+    if len(data) == 0:
+        return row_data
+    values = data.loc[:, flat_headers].to_numpy(dtype=np.float64)
+    if convergence["method"] == "ema":
+        smoothed = smoothEMA(values, 2 / (convergence["window"] + 1))
+    else:
+        smoothed = smoothRollingMean(values, convergence["window"])
+    starts = findPlateaus(smoothed, convergence["tolerance"], convergence["min_rows"])
+    for i, header in enumerate(flat_headers):
+        row_data.update({header + "_smoothed":smoothed[-1, i]})
+        row_data.update({header + "_itersToPlateau":data.index[starts[i]] if starts[i] >= 0 else np.nan})
+    return row_data
+
+def plotTrainTestBatched(headers, series, axs, alpha=0.5, size=20):
+    """Generate the side by side plots of train and test with a single rasterized collection
+    per panel and color/marker for all of the series, instead of a scatter artist per series and panel
+
+    Args:
+        headers: list of train/test metric names
+        series: list of (points, color, marker, label) of each series, where points are
+            the downsampled points of each metric from downsampleData
+        axs: 2-D array of axes with a row per train/test metric pair
+        alpha: the transparency of the points
+        size: the size of the points
+
+    Returns:
+        list of legend handles of the series
+    """
+    # group the series by color and marker so that each collection can be drawn as a single stamped marker
+    styles = list(dict.fromkeys((color, marker) for points, color, marker, label in series))
+    groups = [[points for points, series_color, series_marker, label in series if (series_color, series_marker) == style] for style in styles]
+
+    for n in range(0,len(headers)):
+        for m, header in enumerate(headers[n]):
+            for (color, marker), group in zip(styles, groups):
+                offsets = []
+                for points in group:
+                    x, y = points[header]
+                    keep = ~np.isnan(y)
+                    offsets.append(np.column_stack([x[keep], y[keep]]))
+                offsets = np.concatenate(offsets)
+                marker_style = MarkerStyle(marker)
+                rgba = to_rgba(color, alpha)
+                collection = PathCollection([marker_style.get_path().transformed(marker_style.get_transform())], sizes=[size],
+                    offsets=offsets, offset_transform=axs[n, m].transData, transform=IdentityTransform(),
+                    facecolors=[rgba] if marker_style.is_filled() else "none", edgecolors="face" if marker_style.is_filled() else [rgba],
+                    linewidths=0 if marker_style.is_filled() else 1, rasterized=True)
+                # the data limits are updated from the offsets directly, which is much faster than from the marker extents
+                axs[n, m].add_collection(collection, autolim=False)
+                axs[n, m].update_datalim(offsets)
+            axs[n, m].autoscale_view()
+            if m == 0:
+                axs[n, m].set_ylabel(header, fontsize="small")
+        if n==0:
+            axs[n, 0].title.set_text("Train")
+            axs[n, 1].title.set_text("Test")
+    return [Line2D([], [], linestyle="none", color=color, marker=marker, alpha=alpha, label=label) for points, color, marker, label in series]
+
+def getReplicateGroup(label, replicate_pattern):
+    """Get the replicate group of a label by removing the first match of replicate_pattern,
+    e.g. 'Model_MSE_01' -> 'Model_MSE' with the pattern '_\\d+$'"""
+    return re.sub(replicate_pattern, "", label, count=1)
+
+def interpolateOntoGrid(x, values, grid_step):
+    """Interpolate each column of values onto the multiples of grid_step within the range of x
+
+    Args:
+        x: 1-D array of the index values
+        values: 2-D array of the values of each metric
+        grid_step: the distance between the grid points
+
+    Returns:
+        the number of the first grid point, and 2-D float32 array of the interpolated values at each
+        grid point in the range of x, which is NaN where a column has no values to interpolate from
+        and has no rows when x is empty
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if len(x) == 0:
+        # a replicate that has not written any rows yet
+        return 0, np.full((0, values.shape[1]), np.nan, dtype=np.float32)
+    order = np.argsort(x, kind="stable")
+    x, values = x[order], values[order]
+    first, last = int(np.ceil(x[0] / grid_step)), int(np.floor(x[-1] / grid_step))
+    grid = np.arange(first, last + 1) * grid_step
+    interpolated = np.full((len(grid), values.shape[1]), np.nan, dtype=np.float32)
+    for j in range(values.shape[1]):
+        present = ~np.isnan(values[:, j])
+        if present.any():
+            interpolated[:, j] = np.interp(grid, x[present], values[present, j], left=np.nan, right=np.nan)
+    return first, interpolated
+
+def aggregateReplicates(runs, quantiles=(0.1, 0.9)):
+    """Stack the interpolated values of the replicates of a group on their common grid and
+    compute the statistics over the replicates of each grid point and metric
+
+    Args:
+        runs: list of the (first grid point, interpolated values) of each replicate from interpolateOntoGrid
+        quantiles: the lower and upper quantile of the quantile band
+
+    Returns:
+        1-D array of the grid points, and dict of 'n','mean','std','lower','upper' to 2-D arrays
+        of the statistic at each grid point of each metric; the replicates without any grid points
+        are skipped, and there are no grid points when none of the replicates has any
+    """
+    n_metrics = runs[0][1].shape[1]
+    runs = [(first, values) for first, values in runs if len(values)]
+    if not runs:
+        empty = np.zeros((0, n_metrics), dtype=np.float32)
+        return np.arange(0), {"n": np.zeros((0, n_metrics), dtype=int), "mean": empty, "std": empty, "lower": empty, "upper": empty}
+    start = min(first for first, values in runs)
+    end = max(first + len(values) for first, values in runs)
+    stack = np.full((len(runs), end - start, n_metrics), np.nan, dtype=np.float32)
+    for r, (first, values) in enumerate(runs):
+        stack[r, first - start:first - start + len(values)] = values
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # grid points without any replicate are NaN
+        counts = np.sum(~np.isnan(stack), axis=0)
+        stats = {"n": counts, "mean": np.nanmean(stack, axis=0),
+            "std": np.where(counts > 1, np.nanstd(stack, axis=0, ddof=1), 0)}
+        stats["lower"], stats["upper"] = np.nanquantile(stack, quantiles, axis=0)
+    return np.arange(start, end), stats
+
+def makeReplicateTable(index_name, flat_headers, group, grid, stats):
+    """Make the tidy table of the replicate statistics of a group with a row per grid point and metric"""
+    table = pd.DataFrame({"group": group,
+        index_name: np.repeat(grid, len(flat_headers)),
+        "metric": np.tile(flat_headers, len(grid))})
+    for stat in ["n", "mean", "std", "lower", "upper"]:
+        table[stat] = stats[stat].reshape(-1)
+    return table
+
+def plotReplicateBands(headers, bands, axs, band="std", alpha=0.25):
+    """Generate the side by side plots of train and test with the mean of each replicate group
+    as a line and a single shaded band around it
+
+    Args:
+        headers: list of train/test metric names
+        bands: list of (x, stats, color, linestyle, label) of each group, where stats are from aggregateReplicates
+            and its columns are in the order of the flattened headers
+        axs: 2-D array of axes with a row per train/test metric pair
+        band: 'std' for the mean +/- the standard deviation, or 'quantile' for the quantile band
+        alpha: the transparency of the bands
+
+    Returns:
+        list of legend handles of the groups
+    """
+    for n in range(0,len(headers)):
+        for m, header in enumerate(headers[n]):
+            i = 2 * n + m
+            for x, stats, color, linestyle, label in bands:
+                mean = stats["mean"][:, i]
+                if band == "quantile":
+                    lower, upper = stats["lower"][:, i], stats["upper"][:, i]
+                else:
+                    lower, upper = mean - stats["std"][:, i], mean + stats["std"][:, i]
+                axs[n, m].fill_between(x, lower, upper, color=color, alpha=alpha, linewidth=0)
+                axs[n, m].plot(x, mean, color=color, linestyle=linestyle, linewidth=1)
+            if m == 0:
+                axs[n, m].set_ylabel(header, fontsize="small")
+        if n==0:
+            axs[n, 0].title.set_text("Train")
+            axs[n, 1].title.set_text("Test")
+    return [Line2D([], [], color=color, linestyle=linestyle, label=label) for x, stats, color, linestyle, label in bands]
+
+def aggregateTrainTestStats(headers, agg_funcs, index_name, data, label, n_agg_values = 10, n_agg_values_error = 1, tolerance = 0.02):
     """Creates a pandas data frame with headers according to headers
     and row labels according to labels where the column data from the
     specified header is aggregated according to the specified aggregation function.
     In addition, the number of iterations required to reach the aggregation function
-    100 times is also reported.
+    value within the tolerance n_agg_values times is also reported.
 
     Args:
         headers: list of train/test metric names
         agg_func: name of an aggregation function
         index_name: name of the index header
         data: the actual data frame of values to aggregate according to the specified statistics
+        label: the label of the data
+        n_agg_values: the number of values within the tolerance of the aggregation function value to reach
+        n_agg_values_error: the number of values to reach for the "_Error" metrics
+        tolerance: the fraction of the aggregation function value that a value may differ by
 
     Returns:
-        pandas data frame
+        dict of header to aggregation function value and header + "_itersToValue" to the number of iterations
     """
-    assert(len(headers)==len(agg_funcs))
-    row_data = {"label":label}    
-    for header_tup, agg_func in zip(headers, agg_funcs):
-        for header in header_tup:
-            # calculate the aggregation statistic
-            agg_func_value = None
-            if agg_func == "max":
-                agg_func_value = data.loc[:,header].abs().max() # just use the magnitude and not the direction
-            elif agg_func == "min":
-                agg_func_value = data.loc[:,header].abs().min() # just use the magnitude and not the direction
-            row_data.update({header:agg_func_value})
-
-            # calculate # of iterations using the agg stat
-            indices = []
-            if agg_func == "max":
-                indices = data[data[header].abs()>=agg_func_value*0.98].index.tolist()
-            elif agg_func == "min":
-                indices = data[data[header].abs()<=agg_func_value*1.02].index.tolist()
-            # TODO: added only for loss error
-            n_agg_values = 10
-            if "_Error" in header:
-                n_agg_values = 1
-            index = indices[n_agg_values-1] if len(indices) >= n_agg_values else np.NaN
-            row_data.update({header + "_itersToValue":index})
-    return row_data
+    stats = updateTrainTestStats(None, headers, agg_funcs, data, n_agg_values, n_agg_values_error, tolerance)
+    return makeTrainTestStatsRow(stats, data, label)
 
 def readDataFilenamesCsv(filename):
     """Creates a pandas data frame with headers for 'filenames','labels','color','marker'
@@ -115,25 +557,168 @@ def readDataHeaders(filename):
     #filenames, labels, colors, markers = data_used.loc[:, "filenames"], data_used.loc[:, "labels"], data_used.loc[:, "colors"], data_used.loc[:, "markers"]
     return headers, agg_funcs
 
-def main(data_dir, data_filename, headers_filename, index_name, n_rows, display_plot):
-    """Run main script"""
+def makeTailState(filename):
+    """Make the bookkeeping to read the rows that are appended to a file"""
+    return {"filename": filename, "inode": None, "offset": 0, "header": None, "data": None, "stats": None}
+
+def readNewRows(tail, usecols):
+    """Read the complete rows that were appended to a file since the previous read.
+    A partially written last line is left for the next read.  When the file was truncated
+    or replaced (e.g. by a restarted run) the file is read again from the start.
+
+    Args:
+        tail: the bookkeeping from makeTailState, which is updated
+        usecols: the columns to read
+
+    Returns:
+        data frame of the new rows, or None when there are no new rows;
+        True when the file was truncated or replaced
+    """
+    try:
+        stat = os.stat(tail["filename"])
+    except FileNotFoundError:
+        return None, False
+    with open(tail["filename"], "rb") as f:
+        # the file was replaced, truncated, or rewritten when the last read row no longer ends at the offset
+        reset = tail["inode"] is not None and (stat.st_ino != tail["inode"] or stat.st_size < tail["offset"])
+        if not reset and tail["offset"] > 0:
+            f.seek(tail["offset"] - 1)
+            reset = f.read(1) != b"\n"
+        if reset:
+            tail.update({"offset": 0, "header": None, "data": None, "stats": None})
+        tail["inode"] = stat.st_ino
+
+        # read up to the last complete line
+        f.seek(tail["offset"])
+        chunk = f.read()
+    end = chunk.rfind(b"\n")
+    if end < 0:
+        return None, reset
+    chunk = chunk[:end + 1]
+    tail["offset"] += len(chunk)
+    if tail["header"] is None:
+        header, _, chunk = chunk.partition(b"\n")
+        tail["header"] = header + b"\n"
+    if not chunk.strip():
+        return None, reset
+    return pd.read_csv(io.BytesIO(tail["header"] + chunk), usecols=usecols, dtype=np.float32), reset
+
+def followTrainTest(filenames, labels, headers, agg_funcs, index_name, n_rows, display_plot, output_filename,
+    n_agg_values=10, n_agg_values_error=1, tolerance=0.02, n_points=2000, downsample_method="minmax", follow_interval=5.0, convergence=None):
+    """Follow training runs that are still writing their metrics: every follow_interval seconds only
+    the rows appended to each file are read, the aggregate statistics are updated incrementally
+    and written to output_filename, and the figure is redrawn in place.  Stops on Ctrl+C.
+
+    Args:
+        filenames: list of the metrics files
+        labels: list of the label of each file
+        headers: list of train/test metric names
+        agg_funcs: list of the name of the aggregation function of each train/test metric pair
+        index_name: name of the index header
+        n_rows: the maximum number of rows to read of each file
+        display_plot: True to show the figure
+        output_filename: name of the aggregate statistics csv file
+        n_agg_values, n_agg_values_error, tolerance: see aggregateTrainTestStats
+        n_points, downsample_method: see plotTrainTest
+        follow_interval: seconds between reading the files
+        convergence: see analyzeConvergence; None to not analyze the convergence
+    """
+    flat_headers = [item for sublist in headers for item in sublist]
+    custom_headers = ["label"] + [item + "_itersToValue" for item in flat_headers] + flat_headers
+    if convergence is not None:
+        custom_headers += [item + "_itersToPlateau" for item in flat_headers] + [item + "_smoothed" for item in flat_headers]
+    usecols = [index_name] + flat_headers
+    tails = [makeTailState(filename) for filename in filenames]
+    all_colors = ["b","r","g","m","c","y","k"]
+    all_markers = [".","+",",","o","x","v"]
+    if display_plot:
+        plt.ion()
+        fig, axs = plt.subplots(len(headers), 2, sharex=True, sharey=False)
+    try:
+        while True:
+            # read the new rows and update the aggregate statistics
+            n_new = 0
+            for tail in tails:
+                data, reset = readNewRows(tail, usecols)
+                if reset:
+                    print("{} was truncated or replaced; reading it again...".format(tail["filename"]))
+                    n_new += 1
+                if data is None or (tail["data"] is not None and len(tail["data"]) >= n_rows):
+                    continue
+                data = data if tail["data"] is None else pd.concat([tail["data"], data], ignore_index=True)
+                tail["data"] = data.iloc[:n_rows,:]
+                tail["stats"] = updateTrainTestStats(tail["stats"], headers, agg_funcs, tail["data"], n_agg_values, n_agg_values_error, tolerance)
+                n_new += len(data)
+
+            if n_new:
+                # store the aggregate statistics
+                agg_stats = StatsAccumulator(custom_headers, output_filename)
+                for tail, label in zip(tails, labels):
+                    if tail["data"] is not None:
+                        row_data = makeTrainTestStatsRow(tail["stats"], tail["data"], label)
+                        if convergence is not None:
+                            row_data.update(analyzeConvergence(flat_headers, tail["data"], convergence))
+                        agg_stats.append(row_data)
+                agg_stats.close()
+                print("{}: {} rows; aggregate statistics stored".format(time.strftime("%H:%M:%S"),
+                    sum(len(tail["data"]) for tail in tails if tail["data"] is not None)))
+
+                # redraw the figure
+                if display_plot:
+                    for ax in np.ravel(axs):
+                        ax.cla()
+                    for n, (tail, label) in enumerate(zip(tails, labels)):
+                        if tail["data"] is not None:
+                            plotTrainTest(index_name, headers, tail["data"], axs, all_colors[n % len(all_colors)],
+                                all_markers[(n // len(all_colors)) % len(all_markers)], label, n_points, downsample_method)
+                    np.ravel(axs)[0].legend(loc="upper left", markerscale=2)
+                    fig.canvas.draw_idle()
+            if display_plot:
+                plt.pause(follow_interval)
+            else:
+                time.sleep(follow_interval)
+    except KeyboardInterrupt:
+        print("Stopped following.")
+
+def main(data_dir, data_filename, headers_filename, index_name, n_rows, display_plot, stream_output=False,
+    n_agg_values=10, n_agg_values_error=1, tolerance=0.02, n_points=2000, downsample_method="minmax", follow=False, follow_interval=5.0,
+    batched=False, figure_filename=None, dpi=150, convergence=None, replicates=None):
+    """Run main script
+
+    When replicates is given, a dict with 'pattern','grid_step','n_grid','band','quantiles', the files are
+    grouped into replicates by their label without the first match of 'pattern', the metrics of each file
+    are interpolated onto the multiples of 'grid_step' (by default the range of the first file with rows divided by
+    'n_grid'), the statistics over the replicates are stored in TrainTestMetricsReplicates.csv, and
+    the plot shows one line and 'band' ('std' or 'quantile') per group instead of the points of each file.
+    """
 
     # read in the input files
     filenames, labels = readDataFilenamesCsv(data_filename)
     headers, agg_funcs = readDataHeaders(headers_filename)
+    if follow:
+        followTrainTest(filenames, labels, headers, agg_funcs, index_name, n_rows, display_plot, data_dir + "TrainTestMetrics.csv",
+            n_agg_values, n_agg_values_error, tolerance, n_points, downsample_method, follow_interval, convergence)
+        return
 
     # make the empty data frame for the aggregate statistics
     flat_headers = [item for sublist in headers for item in sublist]
     custom_headers = [item + "_itersToValue" for item in flat_headers]
     custom_headers.extend(flat_headers)
     custom_headers.insert(0, "label")
-    agg_stats = pd.DataFrame(columns=custom_headers)
+    if convergence is not None:
+        custom_headers.extend([item + "_itersToPlateau" for item in flat_headers])
+        custom_headers.extend([item + "_smoothed" for item in flat_headers])
+    agg_stats = StatsAccumulator(custom_headers, data_dir + "TrainTestMetrics.csv", stream_output)
     flat_headers.insert(0, index_name)
 
     # make the initial figure
     n_metric_pairs = len(headers)
     n_data = len(filenames)
-    if display_plot:
+    batched = batched or figure_filename is not None or replicates is not None
+    series = [] # the downsampled points of each file for the batched plot
+    replicate_runs = {} # the interpolated metrics of the files of each replicate group
+    grid_step = None if replicates is None else replicates["grid_step"]
+    if display_plot and not batched:
         print("Preparing the plot...")
         fig, axs = plt.subplots(n_metric_pairs, 2, sharex=True, sharey=False)
 
@@ -147,11 +732,23 @@ def main(data_dir, data_filename, headers_filename, index_name, n_rows, display_
         # trim the data
         data = pd.read_csv(filenames[n], usecols=flat_headers, dtype=np.float32).iloc[:n_rows,:]
 
+        # interpolate each train/test metric onto the grid of the replicates
+        if replicates is not None:
+            x = data.loc[:, index_name].to_numpy()
+            if grid_step is None and len(x):
+                grid_step = max(float(x.max() - x.min()), 1.0) / replicates["n_grid"]
+            group = getReplicateGroup(labels[n], replicates["pattern"])
+            replicate_runs.setdefault(group, []).append(interpolateOntoGrid(x, data.loc[:, flat_headers[1:]].to_numpy(), grid_step))
+
         # plot each train/test metric
-        if display_plot:
+        elif batched or display_plot:
             print("Adding data for {} to the plot...".format(n))
-            plotTrainTest(index_name, headers, data, 
-                          axs, all_colors[color_iter], all_markers[marker_iter], labels[n])
+            if batched:
+                series.append((downsampleData(index_name, flat_headers[1:], data, n_points, downsample_method),
+                    all_colors[color_iter], all_markers[marker_iter], labels[n]))
+            else:
+                plotTrainTest(index_name, headers, data, 
+                              axs, all_colors[color_iter], all_markers[marker_iter], labels[n], n_points, downsample_method)
             color_iter += 1
             if color_iter >= len(all_colors):
                 color_iter = 0;
@@ -161,14 +758,52 @@ def main(data_dir, data_filename, headers_filename, index_name, n_rows, display_
 
         # calculate the aggregate statistics
         print("Aggregating statistics for {}...".format(n))
-        row_data = aggregateTrainTestStats(headers, agg_funcs, index_name, data, labels[n])
-        agg_stats = agg_stats.append(row_data, ignore_index=True)
+        row_data = aggregateTrainTestStats(headers, agg_funcs, index_name, data, labels[n], n_agg_values, n_agg_values_error, tolerance)
+        if convergence is not None:
+            row_data.update(analyzeConvergence(flat_headers[1:], data, convergence))
+        agg_stats.append(row_data)
+        agg_stats.flush()
 
     # store the aggregate statistics
     print("Storing aggregate statistics...")
-    agg_stats.to_csv(data_dir + "TrainTestMetrics.csv")
+    agg_stats.close()
 
-    if display_plot:
+    # aggregate the replicates of each group
+    if replicates is not None:
+        print("Aggregating the replicates of {} groups...".format(len(replicate_runs)))
+        all_linestyles = ["-","--",":","-."]
+        replicate_stats = StatsAccumulator(["group", index_name, "metric", "n", "mean", "std", "lower", "upper"],
+            data_dir + "TrainTestMetricsReplicates.csv")
+        bands = []
+        for g, (group, runs) in enumerate(replicate_runs.items()):
+            grid, stats = aggregateReplicates(runs, replicates["quantiles"])
+            if len(grid) == 0:
+                print("Skipping {}, none of its replicates has any rows yet...".format(group))
+                continue
+            replicate_stats.append(makeReplicateTable(index_name, flat_headers[1:], group, grid * grid_step, stats))
+            bands.append((grid * grid_step, stats, all_colors[g % len(all_colors)],
+                all_linestyles[(g // len(all_colors)) % len(all_linestyles)], "{} (n={})".format(group, sum(len(values) > 0 for first, values in runs))))
+        replicate_stats.close()
+
+    if batched and (display_plot or figure_filename is not None):
+        # render all of the files at once, without a display unless the plot is shown
+        print("Rendering the plot...")
+        if not display_plot:
+            plt.switch_backend("Agg")
+        fig, axs = plt.subplots(n_metric_pairs, 2, sharex=True, sharey=False, squeeze=False,
+            figsize=(10, 2 + 2 * n_metric_pairs))
+        if replicates is not None:
+            handles = plotReplicateBands(headers, bands, axs, replicates["band"])
+        else:
+            handles = plotTrainTestBatched(headers, series, axs)
+        fig.legend(handles=handles, loc="upper center", ncol=min(4, max(1, len(handles))), fontsize="small", markerscale=1.5)
+        fig.tight_layout(rect=(0, 0, 1, 1 - 0.25 * np.ceil(len(handles) / 4) / (2 + 2 * n_metric_pairs)))
+        if figure_filename is not None:
+            print("Saving the plot to {}...".format(figure_filename))
+            fig.savefig(figure_filename, dpi=dpi)
+        if display_plot:
+            plt.show()
+    elif display_plot and not batched:
         print("Displaying the plot...")
         # make the legend
         try:
@@ -181,15 +816,48 @@ def main(data_dir, data_filename, headers_filename, index_name, n_rows, display_
 
 # Run main
 if __name__ == "__main__":
-    # Input files
-    data_dir = ""
-    data_filename = data_dir + "TrainTestMetricsInput.csv"
-    headers_filename = data_dir + "TrainTestMetricsHeaders.csv"
-
-    # Name of the index
-    index_name = "Epoch"
-    #n_rows = 100000
-    n_rows = 200000
-    #show_plot = True
-    show_plot = False
-    main(data_dir, data_filename, headers_filename, index_name, n_rows, show_plot)
\ No newline at end of file
+
+    # Initialize parser
+    parser = argparse.ArgumentParser()
+
+    # Adding optional argument
+    parser.add_argument("-d", "--data", default="TrainTestMetricsInput.csv", dest="data_filename", help = "Input data filenames csv")
+    parser.add_argument("-l", "--headers", default="TrainTestMetricsHeaders.csv", dest="headers_filename", help = "Input headers csv")
+    parser.add_argument("-o", "--output-dir", default="", dest="data_dir", help = "Directory to store TrainTestMetrics.csv in")
+    parser.add_argument("-i", "--index", default="Epoch", dest="index_name", help = "Name of the index; default = Epoch")
+    parser.add_argument("-n", "--rows", type=int, default=200000, dest="n_rows", help = "Maximum number of rows to read of each file; default = 200000")
+    parser.add_argument("-p", "--plot", action="store_true", dest="show_plot", help = "Show the plot")
+    parser.add_argument("--stream", action="store_true", dest="stream_output", help = "Append the aggregate statistics of each file to the output as soon as it is processed")
+    parser.add_argument("--n-agg-values", type=int, default=10, dest="n_agg_values", help = "Number of values within the tolerance to reach; default = 10")
+    parser.add_argument("--n-agg-values-error", type=int, default=1, dest="n_agg_values_error", help = "Number of values within the tolerance to reach for _Error metrics; default = 1")
+    parser.add_argument("--tolerance", type=float, default=0.02, dest="tolerance", help = "Fraction of the aggregation function value that a value may differ by; default = 0.02")
+    parser.add_argument("--points", type=int, default=2000, dest="n_points", help = "Point budget of each plotted series; default = 2000")
+    parser.add_argument("--downsample", default="minmax", choices=["minmax", "lttb", "none"], dest="downsample_method", help = "Downsampling method of the plotted series; default = minmax")
+    parser.add_argument("-b", "--batched", action="store_true", dest="batched", help = "Plot all files with a single rasterized collection per panel")
+    parser.add_argument("-s", "--save-figure", dest="figure_filename", help = "Save the batched plot to this .png, .svg or .pdf file; renders without a display unless --plot is given")
+    parser.add_argument("--dpi", type=int, default=150, dest="dpi", help = "Resolution of the saved plot and its rasterized points; default = 150")
+    parser.add_argument("-c", "--convergence", action="store_true", dest="convergence", help = "Add the iterations to the plateau and the final value of the smoothed metrics to TrainTestMetrics.csv")
+    parser.add_argument("--smooth", default="mean", choices=["mean", "ema"], dest="smooth_method", help = "Smoothing of the metrics for the convergence analysis: rolling mean or EMA; default = mean")
+    parser.add_argument("--smooth-window", type=int, default=50, dest="smooth_window", help = "Rows of the rolling mean, or span of the EMA; default = 50")
+    parser.add_argument("--plateau-tolerance", type=float, default=0.02, dest="plateau_tolerance", help = "Fraction of the range of a smoothed metric that the plateau may differ from its final value by; default = 0.02")
+    parser.add_argument("--plateau-min-rows", type=int, default=100, dest="plateau_min_rows", help = "Minimum number of rows of a plateau; default = 100")
+    parser.add_argument("-r", "--replicates", action="store_true", dest="replicates", help = "Group the files into replicates and plot the mean and a band of each group")
+    parser.add_argument("--replicate-pattern", default=r"_\d+$", dest="replicate_pattern", help = "Regular expression that is removed from a label to get its replicate group; default = _\\d+$")
+    parser.add_argument("--grid-step", type=float, dest="grid_step", help = "Distance between the points of the common index grid of the replicates; default = range of the first file / --grid-points")
+    parser.add_argument("--grid-points", type=int, default=500, dest="n_grid", help = "Number of grid points over the range of the first file when --grid-step is not given; default = 500")
+    parser.add_argument("--band", default="std", choices=["std", "quantile"], dest="band", help = "Band of each replicate group: mean +/- standard deviation, or the --quantiles; default = std")
+    parser.add_argument("--quantiles", type=float, nargs=2, default=[0.1, 0.9], dest="quantiles", help = "Lower and upper quantile of the quantile band; default = 0.1 0.9")
+    parser.add_argument("-f", "--follow", action="store_true", dest="follow", help = "Keep reading the rows appended to the files and update the statistics and plot")
+    parser.add_argument("--follow-interval", type=float, default=5.0, dest="follow_interval", help = "Seconds between reading the files in follow mode; default = 5")
+
+    # Read arguments from command line
+    args = parser.parse_args()
+    convergence = None
+    if args.convergence:
+        convergence = {"method": args.smooth_method, "window": args.smooth_window, "tolerance": args.plateau_tolerance, "min_rows": args.plateau_min_rows}
+    replicates = None
+    if args.replicates:
+        replicates = {"pattern": args.replicate_pattern, "grid_step": args.grid_step, "n_grid": args.n_grid, "band": args.band, "quantiles": args.quantiles}
+    main(args.data_dir, args.data_filename, args.headers_filename, args.index_name, args.n_rows, args.show_plot, args.stream_output,
+        args.n_agg_values, args.n_agg_values_error, args.tolerance, args.n_points, args.downsample_method, args.follow, args.follow_interval,
+        args.batched, args.figure_filename, args.dpi, convergence, replicates)
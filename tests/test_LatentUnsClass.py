@@ -0,0 +1,28 @@
+import itertools
+import numpy as np
+import pandas as pd
+from LatentUnsClass import aggregateCategoryLabel, sweepThresholds
+
+def test_sweep_with_repeated_epochs_matches_filtering():
+    data = pd.DataFrame({
+        "Epoch": [0, 1, 1, 2, 2, 2, 3],
+        "a": [0.1, 0.9, 0.2, 0.5, 0.8, np.nan, 0.6],
+        "b": [0.7, 0.1, 0.9, 0.6, 0.3, 0.9, 0.2]})
+    categories = pd.DataFrame({
+        "category": [0, 1, 1, 2, 0, 3],
+        "predicted": 0,
+        "input": ["x", "y", "x", "z", "y", "z"],
+        "index": [1, 1, 2, 2, 3, 5],
+        "used_": True})
+    grid = {"a": [0.0, 0.4, 0.7], "b": [0.0, 0.25, 0.5]}
+    sweep = sweepThresholds(grid, categories, "Epoch", data, "L")
+
+    for (a, b), row in zip(itertools.product(*grid.values()), sweep.itertuples()):
+        thresholds = pd.DataFrame({"headers": ["a", "b"], "thresholds": [a, b], "used_": True})
+        filtered = aggregateCategoryLabel(thresholds, categories, "Epoch", data, "L")
+        matched = filtered.dropna(subset=["category"])
+        assert (row.a, row.b) == (a, b)
+        assert row.n_epochs == filtered["Epoch"].notna().sum()
+        assert row.n_matched == len(matched)
+        assert row.n_categories == matched["category"].nunique()
+        assert row.n_inputs == matched["input"].nunique()
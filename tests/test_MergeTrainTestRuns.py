@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+import MergeTrainTestRuns
+
+def writeFragment(filename, start, n_rows, mtime_ns):
+    pd.DataFrame({"Epoch": np.arange(start, start + n_rows, dtype=np.float32),
+        "Train_Error": np.linspace(1, 0, n_rows, dtype=np.float32)}).to_csv(filename, index=False)
+    # sub-microsecond mtimes do not survive a round trip through a float in a csv file
+    os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+def test_rerun_on_unchanged_directory_writes_nothing(tmp_path):
+    for n in range(3):
+        writeFragment(str(tmp_path / "run_{}.csv".format(n)), 0, 2500, 1792318683601221300 + n * 1000000007)
+    merged = str(tmp_path / "merged.csv")
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "merged.csv", 1000, "Epoch", chunksize=700) == 3
+    expected = open(merged, "rb").read()
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "merged.csv", 1000, "Epoch", chunksize=700) == 0
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "merged.csv", 1000, "Epoch", chunksize=700) == 0
+    assert open(merged, "rb").read() == expected
+
+def test_rerun_after_a_new_fragment_writes_the_last_and_new_fragments(tmp_path):
+    for n in range(2):
+        writeFragment(str(tmp_path / "run_{}.csv".format(n)), 0, 2500, 1792318683601221300 + n * 1000000007)
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "merged.csv", 1000, "Epoch") == 2
+    writeFragment(str(tmp_path / "run_2.csv"), 0, 2500, 1792318693601221300)
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "merged.csv", 1000, "Epoch") == 2
+    full = str(tmp_path / "full.csv")
+    assert MergeTrainTestRuns.mergeDirFiles(str(tmp_path), "run_*.csv", "full.csv", 1000, "Epoch", force=True) == 3
+    assert open(str(tmp_path / "merged.csv"), "rb").read() == open(full, "rb").read()
+
+def test_main_returns_nonzero_when_a_pair_fails(tmp_path):
+    good, bad = tmp_path / "good", tmp_path / "bad"
+    good.mkdir()
+    bad.mkdir()
+    writeFragment(str(good / "run_0.csv"), 0, 10, 1792318683601221300)
+    pd.DataFrame({"Step": [0, 1]}).to_csv(str(bad / "run_0.csv"), index=False)
+    dirs_filename = str(tmp_path / "dirs.csv")
+    data_filename = str(tmp_path / "filenames.csv")
+    pd.DataFrame({"dirs": [str(good), str(bad)], "used_": True}).to_csv(dirs_filename, index=False)
+    pd.DataFrame({"filenames": ["run_*.csv"], "merged_names": ["merged.csv"], "used_": True}).to_csv(data_filename, index=False)
+    assert MergeTrainTestRuns.main(dirs_filename, data_filename, 1000, "Epoch") == 1
+    assert os.path.exists(str(good / "merged.csv"))
+
+    pd.DataFrame({"dirs": [str(good)], "used_": True}).to_csv(dirs_filename, index=False)
+    assert MergeTrainTestRuns.main(dirs_filename, data_filename, 1000, "Epoch") == 0
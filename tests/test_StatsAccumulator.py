@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from StatsAccumulator import StatsAccumulator
+
+def test_column_that_appears_late_with_flushes_in_between(tmp_path):
+    filename = str(tmp_path / "stats.csv")
+    accumulator = StatsAccumulator(["x"], filename, stream=True)
+    for x in range(3):
+        accumulator.append({"x": x})
+    accumulator.append({"x": 3, "y": 30})
+    accumulator.flush()
+    accumulator.append({"x": 4, "y": 40})
+    accumulator.append(pd.DataFrame({"x": [5, 6]}))
+    accumulator.flush()
+    df = accumulator.close()
+
+    assert df.columns.tolist() == ["x", "y"]
+    assert df["x"].tolist() == list(range(7))
+    np.testing.assert_array_equal(df["y"].to_numpy(dtype=float), [np.nan, np.nan, np.nan, 30, 40, np.nan, np.nan])
+    written = pd.read_csv(filename, index_col=0)
+    assert written.index.tolist() == list(range(7))
+    np.testing.assert_array_equal(written.to_numpy(dtype=float), df.to_numpy(dtype=float))
+
+def test_column_that_appears_after_the_header_is_written(tmp_path):
+    filename = str(tmp_path / "stats.csv")
+    accumulator = StatsAccumulator(["x"], filename, stream=True)
+    accumulator.append({"x": 0})
+    accumulator.flush()
+    accumulator.append({"x": 1, "y": 10})
+    accumulator.flush()
+    accumulator.append({"x": 2})
+    df = accumulator.close()
+
+    written = pd.read_csv(filename, index_col=0)
+    assert written.columns.tolist() == ["x", "y"]
+    np.testing.assert_array_equal(written.to_numpy(dtype=float), df.to_numpy(dtype=float))
+    np.testing.assert_array_equal(written["y"].to_numpy(), [np.nan, 10, np.nan])